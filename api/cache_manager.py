@@ -1,24 +1,155 @@
 """
 Sistema de caché para resultados de búsquedas web y consultas a la IA.
 Reduce el número de llamadas a APIs externas reutilizando respuestas recientes.
+
+La caché tiene dos niveles: uno en memoria (LRU con caducidad por entrada) propio de cada proceso
+y la colección `cache` de MongoDB, compartida por todos. Las lecturas consultan primero la
+memoria y las escrituras van a los dos niveles.
+
+Cada entrada guarda en `expires_at` su fecha de caducidad, calculada con el tiempo de vida de su
+tipo de proveedor (ver get_ttl_days), y MongoDB la borra en segundo plano al alcanzarla gracias
+al índice TTL de la colección (ver api/index_registry.py).
+
+Las respuestas grandes (como las búsquedas de Tavily con el contenido completo de las páginas) se
+guardan comprimidas en un campo binario y se descomprimen al leerlas (ver encode_response).
+
+Los fallos simultáneos de una misma clave se agrupan (ver single_flight y api/single_flight.py):
+solo el primero llama a los proveedores y el resto recibe su resultado.
 """
+import asyncio
+import copy
 import hashlib
 import json
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Union, List
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Awaitable, Callable, Optional, Tuple, Union, List
 from bson import ObjectId
-from pymongo import IndexModel, ASCENDING
+from pymongo import ReplaceOne, UpdateOne
 
 from .database import cache_collection, db
+from .index_registry import create_registered_indexes
+from .metrics import metrics
+from .single_flight import DistributedLock, SingleFlight
 from models.cache import CacheEntry
 
+# Bloqueos de las claves que se están calculando, para agrupar los fallos entre procesos
+cache_locks_collection = db["cache_locks"]
+
+# CACHE_MEMORY_MAX_ENTRIES: entradas como máximo en la caché en memoria de cada proceso (0 la desactiva)
+CACHE_MEMORY_MAX_ENTRIES = int(os.environ.get("CACHE_MEMORY_MAX_ENTRIES", "1000"))
+# CACHE_MEMORY_TTL_SECONDS: segundos que una entrada puede servirse desde memoria sin volver a MongoDB
+CACHE_MEMORY_TTL_SECONDS = float(os.environ.get("CACHE_MEMORY_TTL_SECONDS", "900"))
+# CACHE_TTL_DAYS: días de vida de las entradas de los tipos de proveedor sin política propia
+CACHE_TTL_DAYS = int(os.environ.get("CACHE_TTL_DAYS", "7"))
+# CACHE_COMPRESSION_MIN_BYTES: tamaño de la respuesta en JSON a partir del cual se guarda comprimida (0 = nunca)
+CACHE_COMPRESSION_MIN_BYTES = int(os.environ.get("CACHE_COMPRESSION_MIN_BYTES", "8192"))
+# CACHE_COMPRESSION_LEVEL: nivel de compresión de zlib, de 1 (más rápido) a 9 (más pequeño)
+CACHE_COMPRESSION_LEVEL = int(os.environ.get("CACHE_COMPRESSION_LEVEL", "6"))
+# Codificación de las respuestas comprimidas, guardada en response_encoding
+CACHE_COMPRESSION_ENCODING = "json+zlib"
+# CACHE_LOCK_ENABLED: agrupa también entre procesos los fallos de una misma clave con un bloqueo en MongoDB
+CACHE_LOCK_ENABLED = os.environ.get("CACHE_LOCK_ENABLED", "false").lower() == "true"
+# CACHE_LOCK_TTL_SECONDS: duración del bloqueo. Si quien lo tiene no termina antes, otro proceso puede tomarlo
+CACHE_LOCK_TTL_SECONDS = float(os.environ.get("CACHE_LOCK_TTL_SECONDS", "120"))
+# CACHE_LOCK_WAIT_SECONDS: espera máxima al resultado de otro proceso antes de calcularlo igualmente
+CACHE_LOCK_WAIT_SECONDS = float(os.environ.get("CACHE_LOCK_WAIT_SECONDS", "60"))
+# Segundos entre comprobaciones de la caché mientras otro proceso tiene el bloqueo
+CACHE_LOCK_POLL_SECONDS = 0.5
+
+# Días de vida de las entradas por tipo de proveedor. Las claves de caché incluyen la fecha, así
+# que las búsquedas solo se reutilizan el mismo día y basta con conservarlas poco más. Se pueden
+# sobrescribir con la variable de entorno CACHE_TTL_<TIPO_DE_PROVEEDOR>_DAYS
+DEFAULT_CACHE_TTL_DAYS = {
+    "tavily_search": 2,
+    "serpapi_search": 2,
+    "openai_web_search": 2,
+    "groq_web_search": 2,
+    "deepseek_web_search": 2,
+    "groq_simulate_search": 2,
+}
+
+
+class MemoryCache:
+    """
+    Caché en memoria LRU con caducidad por entrada. Seguro entre hilos.
+
+    Guarda copias de las respuestas, de forma que quien las lee puede modificarlas sin afectar
+    al resto de lecturas, igual que con los documentos leídos de MongoDB.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[Any, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key: str, created_date: str) -> Optional[Any]:
+        """
+        Obtiene una respuesta si está en memoria, es del día indicado y no ha caducado.
+
+        Returns:
+            Copia de la respuesta, o None si no está
+        """
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            response, entry_date, expires_at = entry
+            if entry_date != created_date or expires_at <= time.monotonic():
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+        return copy.deepcopy(response)
+
+    def set(self, cache_key: str, response: Any, created_date: str, ttl_seconds: Optional[float] = None) -> None:
+        """
+        Guarda una respuesta, descartando las menos usadas recientemente si se supera el máximo.
+
+        Args:
+            ttl_seconds: Segundos de vida de la entrada. Como mucho los de la caché
+        """
+        if self.max_entries <= 0:
+            return
+        ttl = min(self.ttl_seconds, ttl_seconds) if ttl_seconds is not None else self.ttl_seconds
+        entry = (copy.deepcopy(response), created_date, time.monotonic() + ttl)
+        with self._lock:
+            self._entries[cache_key] = entry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, cache_key: str) -> None:
+        """Elimina una entrada si existe."""
+        with self._lock:
+            self._entries.pop(cache_key, None)
+
+    def clear(self) -> None:
+        """Elimina todas las entradas."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
 class CacheManager:
     """
     Gestiona la caché de respuestas de APIs externas.
     
     Guarda los resultados de búsquedas y consultas en MongoDB y los recupera
-    cuando se realizan consultas similares dentro del mismo día.
+    cuando se realizan consultas similares dentro del mismo día. Delante de MongoDB hay
+    una caché en memoria (`memory_cache`) que sirve sin acceder a la red las claves repetidas
+    dentro de un mismo proceso, como las de los usuarios de una misma cohorte.
     """
+
+    memory_cache = MemoryCache(CACHE_MEMORY_MAX_ENTRIES, CACHE_MEMORY_TTL_SECONDS)
+    flights = SingleFlight()
+    cache_lock = DistributedLock(cache_locks_collection, CACHE_LOCK_TTL_SECONDS)
     
     @classmethod
     def initialize_cache(cls) -> None:
@@ -31,16 +162,10 @@ class CacheManager:
             db.create_collection("cache")
             print("Colección de caché creada correctamente")
         
-        # Crear índices para mejorar el rendimiento de búsquedas
-        indices = [
-            IndexModel([("cache_key", ASCENDING)], unique=True),
-            IndexModel([("created_date", ASCENDING)]),
-            IndexModel([("provider_type", ASCENDING)])
-        ]
-        
-        # Crear los índices en la colección
+        # Crear los índices registrados para la colección (ver api/index_registry.py)
         try:
-            cache_collection.create_indexes(indices)
+            create_registered_indexes(cache_collection)
+            create_registered_indexes(cache_locks_collection)
             print("Índices de caché creados correctamente")
         except Exception as e:
             print(f"Error al crear índices de caché: {str(e)}")
@@ -83,6 +208,9 @@ class CacheManager:
     def get_from_cache(cache_key: str) -> Optional[Dict[str, Any]]:
         """
         Recupera una respuesta de la caché si existe y es del día actual.
+        Busca primero en memoria y, si no está, en MongoDB, guardando en memoria lo encontrado.
+        Los aciertos y fallos se cuentan en total (cache_hits, cache_misses) y por nivel
+        (cache_memory_hits, cache_memory_misses, cache_mongo_hits, cache_mongo_misses).
         
         Args:
             cache_key: La clave generada para identificar la consulta
@@ -93,17 +221,154 @@ class CacheManager:
         # Obtener la fecha actual (solo día, mes y año)
         today_date = datetime.now().strftime("%Y-%m-%d")
         
+        # Buscar primero en memoria, sin acceder a la red
+        cached_response = CacheManager.memory_cache.get(cache_key, today_date)
+        if cached_response is not None:
+            metrics.increment("cache_memory_hits")
+            metrics.increment("cache_hits")
+            return cached_response
+        metrics.increment("cache_memory_misses")
+        
         # Buscar en la caché
-        cached_item = cache_collection.find_one({
-            "cache_key": cache_key,
-            "created_date": today_date
-        })
+        with metrics.time("cache"):
+            cached_item = cache_collection.find_one({
+                "cache_key": cache_key,
+                "created_date": today_date
+            })
         
         if cached_item:
-            return cached_item.get("response")
+            metrics.increment("cache_mongo_hits")
+            metrics.increment("cache_hits")
+            response = CacheManager.decode_response(cached_item)
+            CacheManager.memory_cache.set(cache_key, response, today_date)
+            return response
         
+        metrics.increment("cache_mongo_misses")
+        metrics.increment("cache_misses")
         return None
     
+    @staticmethod
+    def peek_cache(cache_key: str) -> Optional[Any]:
+        """
+        Igual que get_from_cache, pero sin contar aciertos ni fallos. Se usa para comprobar si otro
+        hilo o proceso ya ha guardado la respuesta de una clave que acaba de fallar.
+        """
+        today_date = datetime.now().strftime("%Y-%m-%d")
+        cached_response = CacheManager.memory_cache.get(cache_key, today_date)
+        if cached_response is not None:
+            return cached_response
+        
+        cached_item = cache_collection.find_one({"cache_key": cache_key, "created_date": today_date})
+        if not cached_item:
+            return None
+        response = CacheManager.decode_response(cached_item)
+        CacheManager.memory_cache.set(cache_key, response, today_date)
+        return response
+    
+    @staticmethod
+    def single_flight(cache_key: str, compute: Callable[[], Any]) -> Any:
+        """
+        Calcula la respuesta de una clave que no está en caché, agrupando los fallos simultáneos:
+        si otro hilo ya la está calculando, espera su resultado en lugar de repetir las llamadas.
+        Con CACHE_LOCK_ENABLED, también espera a otros procesos, hasta encontrar su respuesta en
+        la caché o hasta CACHE_LOCK_WAIT_SECONDS. Las respuestas compartidas se cuentan en
+        cache_coalesced.
+        
+        Args:
+            cache_key: La clave que ha fallado
+            compute: Función que calcula la respuesta y la guarda en caché si procede
+            
+        Returns:
+            La respuesta calculada, propia o compartida
+        """
+        (value, reused), shared = CacheManager.flights.do(
+            cache_key, lambda: CacheManager._compute_locked(cache_key, compute)
+        )
+        # Cada petición se cuenta una sola vez, tanto si espera a otro hilo como a otro proceso
+        if shared or reused:
+            metrics.increment("cache_coalesced")
+        return value
+    
+    @staticmethod
+    async def single_flight_async(cache_key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Versión asíncrona de single_flight: agrupa los fallos de las corrutinas del bucle de eventos.
+        
+        Args:
+            cache_key: La clave que ha fallado
+            compute: Función que devuelve la corrutina que calcula la respuesta
+            
+        Returns:
+            La respuesta calculada, propia o compartida
+        """
+        (value, reused), shared = await CacheManager.flights.do_async(
+            cache_key, lambda: CacheManager._compute_locked_async(cache_key, compute)
+        )
+        if shared or reused:
+            metrics.increment("cache_coalesced")
+        return value
+    
+    @staticmethod
+    def _compute_locked(cache_key: str, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Calcula la respuesta de una clave como único hilo del proceso que lo hace. Antes comprueba
+        si ya la ha guardado otro y, con CACHE_LOCK_ENABLED, toma el bloqueo de la clave en MongoDB.
+        Devuelve la respuesta y si es la que guardó otro; single_flight la cuenta en cache_coalesced.
+        """
+        cached = CacheManager.peek_cache(cache_key)
+        if cached is not None:
+            return cached, True
+        if not CACHE_LOCK_ENABLED:
+            return compute(), False
+        
+        owner = ObjectId()
+        deadline = time.monotonic() + CACHE_LOCK_WAIT_SECONDS
+        while not CacheManager.cache_lock.acquire(cache_key, owner):
+            if time.monotonic() >= deadline:
+                return compute(), False
+            time.sleep(CACHE_LOCK_POLL_SECONDS)
+            cached = CacheManager.peek_cache(cache_key)
+            if cached is not None:
+                return cached, True
+        
+        try:
+            # Otro proceso puede haber guardado la respuesta justo antes de liberar el bloqueo
+            cached = CacheManager.peek_cache(cache_key)
+            if cached is not None:
+                return cached, True
+            return compute(), False
+        finally:
+            CacheManager.cache_lock.release(cache_key, owner)
+    
+    @staticmethod
+    async def _compute_locked_async(cache_key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Versión asíncrona de _compute_locked. Los accesos a MongoDB se hacen en un hilo.
+        """
+        cached = await asyncio.to_thread(CacheManager.peek_cache, cache_key)
+        if cached is not None:
+            return cached, True
+        if not CACHE_LOCK_ENABLED:
+            return await compute(), False
+        
+        owner = ObjectId()
+        deadline = time.monotonic() + CACHE_LOCK_WAIT_SECONDS
+        while not await asyncio.to_thread(CacheManager.cache_lock.acquire, cache_key, owner):
+            if time.monotonic() >= deadline:
+                return await compute(), False
+            await asyncio.sleep(CACHE_LOCK_POLL_SECONDS)
+            cached = await asyncio.to_thread(CacheManager.peek_cache, cache_key)
+            if cached is not None:
+                return cached, True
+        
+        try:
+            cached = await asyncio.to_thread(CacheManager.peek_cache, cache_key)
+            if cached is not None:
+                return cached, True
+            return await compute(), False
+        finally:
+            await asyncio.to_thread(CacheManager.cache_lock.release, cache_key, owner)
+    
     @staticmethod
     def get_today_cache_by_provider(provider_type: str) -> List[Dict[str, Any]]:
         """
@@ -124,7 +389,7 @@ class CacheManager:
             "created_date": today_date
         }))
         
-        return cached_items
+        return [CacheManager.decode_document(item) for item in cached_items]
     
     @staticmethod
     def get_provider_cache_by_date(provider_type: str, date_str: str) -> List[Dict[str, Any]]:
@@ -144,58 +409,234 @@ class CacheManager:
             "created_date": date_str
         }))
         
-        return cached_items
+        return [CacheManager.decode_document(item) for item in cached_items]
     
     @staticmethod
-    def save_to_cache(cache_key: str, response: Union[Dict[str, Any], str], provider_type: str = "generic", query: Optional[str] = None, ttl_days: int = 7) -> None:
+    def encode_response(response: Union[Dict[str, Any], str]) -> Dict[str, Any]:
         """
-        Guarda una respuesta en la caché utilizando el modelo CacheEntry.
+        Prepara una respuesta para guardarla en la caché. Si en JSON ocupa al menos
+        CACHE_COMPRESSION_MIN_BYTES, se guarda comprimida con zlib en `response_compressed`
+        en lugar de en `response`.
         
         Args:
-            cache_key: La clave generada para identificar la consulta
-            response: La respuesta de la API que se guardará
-            provider_type: Tipo de proveedor que generó la respuesta
-            query: Consulta original (opcional)
-            ttl_days: Tiempo de vida en días (por defecto 7 días)
+            response: La respuesta de la API
+            
+        Returns:
+            Los campos de la respuesta en el documento: response, response_compressed,
+            response_encoding y los bytes de la respuesta sin comprimir (raw_bytes) y guardados (stored_bytes)
+        """
+        try:
+            raw = json.dumps(response, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        except (TypeError, ValueError):
+            # No se puede serializar en JSON: se guarda tal cual
+            return {"response": response}
+        
+        if 0 < CACHE_COMPRESSION_MIN_BYTES <= len(raw):
+            compressed = zlib.compress(raw, CACHE_COMPRESSION_LEVEL)
+            if len(compressed) < len(raw):
+                return {
+                    "response": None,
+                    "response_compressed": compressed,
+                    "response_encoding": CACHE_COMPRESSION_ENCODING,
+                    "raw_bytes": len(raw),
+                    "stored_bytes": len(compressed),
+                }
+        
+        return {"response": response, "raw_bytes": len(raw), "stored_bytes": len(raw)}
+    
+    @staticmethod
+    def decode_response(document: Dict[str, Any]) -> Any:
+        """
+        Obtiene la respuesta de un documento de la caché, descomprimiéndola si es necesario.
+        
+        Args:
+            document: El documento de la caché
+            
+        Returns:
+            La respuesta guardada
+        """
+        encoding = document.get("response_encoding")
+        if not encoding:
+            return document.get("response")
+        if encoding != CACHE_COMPRESSION_ENCODING:
+            raise ValueError(f"Codificación de caché desconocida: {encoding}")
+        return json.loads(zlib.decompress(document["response_compressed"]).decode("utf-8"))
+    
+    @staticmethod
+    def decode_document(document: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Devuelve el documento de la caché con la respuesta descomprimida en `response`.
         """
-        # Eliminar entradas antiguas con la misma clave (si existen)
-        cache_collection.delete_many({"cache_key": cache_key})
+        if document.get("response_encoding"):
+            document["response"] = CacheManager.decode_response(document)
+            del document["response_compressed"]
+            del document["response_encoding"]
+        return document
+    
+    @staticmethod
+    def get_ttl_days(provider_type: str) -> int:
+        """
+        Obtiene los días de vida de las entradas de un tipo de proveedor: los de la variable de
+        entorno CACHE_TTL_<TIPO_DE_PROVEEDOR>_DAYS, los de DEFAULT_CACHE_TTL_DAYS o CACHE_TTL_DAYS.
+        
+        Args:
+            provider_type: El tipo de proveedor (ej. "tavily_search", "groq_content")
+            
+        Returns:
+            Días de vida de las entradas
+        """
+        default = DEFAULT_CACHE_TTL_DAYS.get(provider_type, CACHE_TTL_DAYS)
+        return int(os.environ.get(f"CACHE_TTL_{provider_type.upper()}_DAYS", default))
+    
+    @staticmethod
+    def build_cache_document(cache_key: str, response: Union[Dict[str, Any], str], provider_type: str = "generic", query: Optional[str] = None, ttl_days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Crea el documento de una entrada de caché utilizando el modelo CacheEntry.
+        
+        El documento no lleva `_id`: al reemplazar una entrada existente se conserva el suyo
+        y al insertarla lo genera MongoDB.
         
+        Args:
+            Los mismos que save_to_cache
+            
+        Returns:
+            El documento listo para replace_one
+        """
         # Obtener la fecha actual
         now = datetime.now()
-        today_date = now.strftime("%Y-%m-%d")
+        if ttl_days is None:
+            ttl_days = CacheManager.get_ttl_days(provider_type)
         
-        # Crear una nueva entrada de caché usando el modelo
         cache_entry = CacheEntry(
             _id=ObjectId(),
             cache_key=cache_key,
-            response=response,
+            **CacheManager.encode_response(response),
             created_at=now,
-            created_date=today_date,
+            created_date=now.strftime("%Y-%m-%d"),
             provider_type=provider_type,
             query=query,
             tags=[provider_type],
-            ttl_days=ttl_days
+            ttl_days=ttl_days,
+            expires_at=datetime.now(timezone.utc) + timedelta(days=ttl_days)
+        )
+        document = dict(cache_entry.__dict__)
+        document.pop("_id")
+        return document
+    
+    @staticmethod
+    def save_to_cache(cache_key: str, response: Union[Dict[str, Any], str], provider_type: str = "generic", query: Optional[str] = None, ttl_days: Optional[int] = None) -> None:
+        """
+        Guarda una respuesta en la caché utilizando el modelo CacheEntry.
+        
+        La entrada anterior con la misma clave, si existe, se reemplaza en una sola operación
+        atómica (replace_one con upsert), de forma que dos procesos que guardan la misma clave
+        a la vez no chocan con el índice único de cache_key.
+        
+        Args:
+            cache_key: La clave generada para identificar la consulta
+            response: La respuesta de la API que se guardará
+            provider_type: Tipo de proveedor que generó la respuesta
+            query: Consulta original (opcional)
+            ttl_days: Tiempo de vida en días (por defecto el del tipo de proveedor, ver get_ttl_days)
+        """
+        document = CacheManager.build_cache_document(cache_key, response, provider_type, query, ttl_days)
+        
+        # Guardar en la base de datos y en memoria
+        cache_collection.replace_one({"cache_key": cache_key}, document, upsert=True)
+        CacheManager.memory_cache.set(cache_key, response, document["created_date"], document["ttl_days"] * 24 * 60 * 60)
+        CacheManager.record_stored_bytes(document)
+    
+    @staticmethod
+    def save_many_to_cache(entries: List[Dict[str, Any]]) -> int:
+        """
+        Guarda varias respuestas en la caché con un solo bulk_write.
+        
+        Args:
+            entries: Un diccionario por entrada con los argumentos de save_to_cache
+                ("cache_key", "response" y, opcionalmente, "provider_type", "query" y "ttl_days")
+            
+        Returns:
+            Número de entradas insertadas o reemplazadas
+        """
+        if not entries:
+            return 0
+        
+        documents = [CacheManager.build_cache_document(**entry) for entry in entries]
+        result = cache_collection.bulk_write(
+            [ReplaceOne({"cache_key": document["cache_key"]}, document, upsert=True) for document in documents],
+            ordered=False,
+        )
+        for entry, document in zip(entries, documents):
+            CacheManager.memory_cache.set(
+                document["cache_key"], entry["response"], document["created_date"], document["ttl_days"] * 24 * 60 * 60
+            )
+            CacheManager.record_stored_bytes(document)
+        return result.upserted_count + result.modified_count
+    
+    @staticmethod
+    def record_stored_bytes(document: Dict[str, Any]) -> None:
+        """
+        Suma a las métricas los bytes de la respuesta de un documento guardado, sin comprimir
+        (cache_raw_bytes) y tal como se guardan (cache_stored_bytes).
+        """
+        metrics.increment("cache_raw_bytes", document.get("raw_bytes") or 0)
+        metrics.increment("cache_stored_bytes", document.get("stored_bytes") or 0)
+    
+    @staticmethod
+    def backfill_cache_expiry(batch_size: int = 500) -> int:
+        """
+        Migración que asigna `expires_at` a las entradas creadas antes de que existiera el campo,
+        a partir de su fecha de creación y de su `ttl_days`, para que las borre el índice TTL.
+        Solo procesa las entradas sin el campo, por lo que tras la primera vez no hace nada.
+        
+        Args:
+            batch_size: Entradas por escritura en bloque
+            
+        Returns:
+            Número de entradas actualizadas
+        """
+        cursor = cache_collection.find(
+            {"expires_at": {"$exists": False}},
+            {"_id": 1, "created_at": 1, "provider_type": 1, "ttl_days": 1},
+            batch_size=batch_size,
         )
         
-        # Convertir a diccionario y guardar en la base de datos
-        cache_collection.insert_one(cache_entry.__dict__)
+        updated = 0
+        operations = []
+        for entry in cursor:
+            ttl_days = entry.get("ttl_days") or CacheManager.get_ttl_days(entry.get("provider_type") or "generic")
+            # created_at se guardó con la hora local sin zona horaria
+            created_at = (entry.get("created_at") or datetime.now()).astimezone(timezone.utc)
+            operations.append(UpdateOne({"_id": entry["_id"]}, {"$set": {"expires_at": created_at + timedelta(days=ttl_days)}}))
+            if len(operations) >= batch_size:
+                updated += cache_collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            updated += cache_collection.bulk_write(operations, ordered=False).modified_count
+        
+        return updated
     
     @staticmethod
     def clear_expired_cache(days_to_keep: int = 7) -> int:
         """
-        Elimina entradas de caché antiguas.
+        Elimina las entradas de caché caducadas.
+        
+        Borra las que ya han pasado su `expires_at` sin esperar al índice TTL, que MongoDB aplica
+        en segundo plano cada minuto, y las que no tienen el campo (ver backfill_cache_expiry)
+        creadas hace más de `days_to_keep` días.
         
         Args:
-            days_to_keep: Número de días que se conservarán las entradas
+            days_to_keep: Días que se conservan las entradas sin `expires_at`
             
         Returns:
             Número de documentos eliminados
         """
-        # Calcular la fecha límite
+        # created_at se guardó con la hora local sin zona horaria
         cutoff_date = datetime.now() - timedelta(days=days_to_keep)
         
-        # Eliminar documentos antiguos
-        result = cache_collection.delete_many({"created_at": {"$lt": cutoff_date}})
+        result = cache_collection.delete_many({"$or": [
+            {"expires_at": {"$lt": datetime.now(timezone.utc)}},
+            {"expires_at": {"$exists": False}, "created_at": {"$lt": cutoff_date}},
+        ]})
         
         return result.deleted_count
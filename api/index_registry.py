@@ -0,0 +1,214 @@
+"""
+Registro declarativo de los índices de MongoDB.
+
+Cada colección que consulta la aplicación (api/, maintenance.py y el servicio de Stripe) declara
+aquí sus índices, junto a la consulta a la que sirve cada uno. Los servicios crean los índices de
+sus colecciones con create_registered_indexes y `python maintenance.py indexes` aplica el registro
+completo, de forma idempotente, e informa de los índices que faltaban, de los que existen en la
+base de datos sin estar en el registro y de los que no se han usado desde el último reinicio.
+
+Las búsquedas por `_id` (prompts, subscription, send_runs...) usan el índice que MongoDB crea
+siempre, por lo que esas colecciones no declaran ninguno más.
+"""
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+# Errores al crear un índice que no impiden crear los demás: ya existe con otras opciones
+# (IndexOptionsConflict, IndexKeySpecsConflict) o es único y hay valores repetidos (DuplicateKey)
+SKIPPABLE_INDEX_ERRORS = (85, 86, 11000)
+
+from api.database import db
+
+# Opciones que distinguen dos índices con las mismas claves
+INDEX_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # Login, registro, perfil, bienvenida y proveedores de IA: find_one({"email_lower": ...}).
+        # Único para que no haya dos cuentas con emails que solo difieren en mayúsculas, y disperso
+        # para admitir a los usuarios anteriores al campo hasta que se ejecuta la migración
+        IndexModel([("email_lower", ASCENDING)], unique=True, sparse=True),
+        # Usuarios pendientes de la franja: {"account_status": "active", "next_send_at": {"$lt": ...}}
+        IndexModel([("account_status", ASCENDING), ("next_send_at", ASCENDING)]),
+        # Reserva de pendientes por prioridad (ver DUE_SORT en schedule_service)
+        IndexModel([
+            ("account_status", ASCENDING),
+            ("send_priority", DESCENDING),
+            ("send_failures", DESCENDING),
+            ("next_send_at", ASCENDING),
+        ]),
+        # Lectura de la tanda recién reservada: find({"send_lease.token": ...})
+        IndexModel([("send_lease.token", ASCENDING)], sparse=True),
+    ],
+    "sessions": [
+        # Expiración automática de las sesiones cuando se alcanza expires_at
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        # Validación de la sesión de cada petición: find_one({"token": ...})
+        IndexModel([("token", ASCENDING)], unique=True),
+        # Sesiones de un usuario: cierre de todas sus sesiones y borrado de la cuenta
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    "stripe_customers": [
+        # Cliente de Stripe de un usuario: find_one / upsert por user_id
+        IndexModel([("user_id", ASCENDING)], unique=True),
+        # Webhooks de suscripción: find_one({"stripe_subscription_id": ...})
+        IndexModel([("stripe_subscription_id", ASCENDING)], sparse=True),
+    ],
+    "cache": [
+        # Lectura de la caché: find_one({"cache_key": ..., "created_date": ...})
+        IndexModel([("cache_key", ASCENDING)], unique=True),
+        # Entradas de un proveedor en un día: find({"provider_type": ..., "created_date": ...})
+        IndexModel([("provider_type", ASCENDING), ("created_date", ASCENDING)]),
+        # Limpieza de entradas antiguas: delete_many({"created_at": {"$lt": ...}})
+        IndexModel([("created_at", ASCENDING)]),
+        # Expiración automática de las entradas cuando se alcanza expires_at
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "cache_locks": [
+        # Borrado de los bloqueos de la caché que han caducado sin liberarse
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "send_ledger": [
+        # Una sola entrada por usuario y semana, y usuarios ya enviados de una tanda
+        IndexModel([("run_week", ASCENDING), ("user_id", ASCENDING)], unique=True),
+        # Usuarios por estado dentro de una semana
+        IndexModel([("run_week", ASCENDING), ("state", ASCENDING)]),
+    ],
+    "maintenance_runs": [
+        # Ejecuciones pendientes de una tarea, por orden de llegada
+        IndexModel([("kind", ASCENDING), ("status", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    "email_retries": [
+        # Un solo reintento por usuario y semana
+        IndexModel([("run_week", ASCENDING), ("user_id", ASCENDING)], unique=True),
+        # Reintentos cuyo siguiente intento ya toca: {"next_attempt_at": {"$lte": ...}}
+        IndexModel([("next_attempt_at", ASCENDING)]),
+        # Lectura de los reintentos recién reservados: find({"lock_token": ...})
+        IndexModel([("lock_token", ASCENDING)], sparse=True),
+        # Usuarios de una tanda con un reintento pendiente: {"user_id": {"$in": [...]}}
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    "email_dead_letters": [
+        IndexModel([("run_week", ASCENDING), ("user_id", ASCENDING)]),
+    ],
+}
+
+
+def get_index_models(collection_name: str) -> List[IndexModel]:
+    """Obtiene los índices registrados de una colección (vacío si no tiene ninguno)."""
+    return INDEXES.get(collection_name, [])
+
+
+def create_registered_indexes(collection: Collection) -> List[str]:
+    """
+    Crea los índices registrados de la colección. Es idempotente. Si uno de ellos ya existe con
+    otras opciones o no se puede crear por valores repetidos, se crean igualmente los demás.
+
+    Args:
+        collection: Colección, que se busca en el registro por su nombre
+
+    Returns:
+        list: Nombres de los índices registrados de la colección
+    """
+    models = get_index_models(collection.name)
+    if not models:
+        return []
+    try:
+        return collection.create_indexes(models)
+    except OperationFailure as e:
+        if e.code not in SKIPPABLE_INDEX_ERRORS:
+            raise
+
+    # Crear uno a uno los que se puedan; `python maintenance.py indexes` informa de los demás
+    names = []
+    for model in models:
+        try:
+            names.extend(collection.create_indexes([model]))
+        except OperationFailure as e:
+            if e.code not in SKIPPABLE_INDEX_ERRORS:
+                raise
+            print(f"No se ha creado el índice {model.document['name']} de {collection.name}: {str(e)}")
+    return names
+
+
+def get_index_signature(spec: Dict[str, Any]) -> tuple:
+    """Obtiene las claves de un índice con su dirección, para comparar índices existentes y registrados."""
+    key = spec["key"]
+    key = list(key.items()) if hasattr(key, "items") else list(key)
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in key)
+
+
+def get_index_usage(collection: Collection) -> Optional[Dict[str, int]]:
+    """
+    Obtiene cuántas veces se ha usado cada índice de la colección desde el último reinicio
+    del servidor, con $indexStats.
+
+    Returns:
+        dict | None: Operaciones por nombre de índice, o None si el servidor no lo permite
+    """
+    try:
+        return {stat["name"]: int(stat["accesses"]["ops"]) for stat in collection.aggregate([{"$indexStats": {}}])}
+    except Exception:
+        return None
+
+
+def apply_index_registry(database: Optional[Database] = None, create: bool = True) -> Dict[str, Dict[str, Any]]:
+    """
+    Aplica el registro de índices a la base de datos e informa del estado de cada colección.
+
+    Args:
+        database: Base de datos. Por defecto la de la aplicación
+        create: Si se crean los índices que faltan. Con False solo se informa
+
+    Returns:
+        dict: Por colección, índices que faltaban ("missing"), creados ("created"), con las mismas
+        claves pero distintas opciones ("conflicts"), existentes fuera del registro ("unmanaged")
+        y sin ningún uso según $indexStats ("unused", None si el servidor no lo permite)
+    """
+    database = db if database is None else database
+    report = {}
+    for collection_name, models in INDEXES.items():
+        collection = database[collection_name]
+        existing = collection.index_information()
+        existing_by_key = {get_index_signature(info): (name, info) for name, info in existing.items()}
+        registered_keys = set()
+
+        missing, created, conflicts = [], [], []
+        for model in models:
+            document = model.document
+            signature = get_index_signature(document)
+            registered_keys.add(signature)
+            current = existing_by_key.get(signature)
+            if current is not None:
+                name, info = current
+                if any(info.get(option) != document.get(option) for option in INDEX_OPTIONS if option in document or option in info):
+                    conflicts.append(name)
+                continue
+
+            missing.append(document["name"])
+            if create:
+                try:
+                    collection.create_indexes([model])
+                    created.append(document["name"])
+                except OperationFailure as e:
+                    conflicts.append(f"{document['name']}: {e}")
+
+        usage = get_index_usage(collection)
+        report[collection_name] = {
+            "missing": missing,
+            "created": created,
+            "conflicts": conflicts,
+            "unmanaged": [
+                name for signature, (name, _) in existing_by_key.items()
+                if name != "_id_" and signature not in registered_keys
+            ],
+            "unused": None if usage is None else sorted(
+                name for name, ops in usage.items() if name != "_id_" and ops == 0
+            ),
+        }
+
+    return report
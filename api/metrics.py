@@ -0,0 +1,162 @@
+"""
+Medición de latencias por etapa del envío semanal (reserva, generación, envío y escritura).
+
+La instancia `metrics` es compartida por todo el proceso: el envío semanal, los proveedores de IA
+y de búsqueda y la caché registran en ella sus tiempos y contadores, y al final de cada ejecución
+se guarda su resumen en la colección maintenance_runs.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+# Límites superiores (en segundos) de los intervalos de los histogramas de latencia.
+# El último intervalo, sin límite, recoge el resto de medidas
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class StageMetrics:
+    """
+    Acumula las duraciones de cada etapa y calcula sus percentiles. Seguro entre hilos.
+    """
+
+    def __init__(self):
+        self._durations: Dict[str, List[float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._calls: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        """Registra una duración de la etapa indicada."""
+        with self._lock:
+            self._durations.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Mide la duración del bloque y la registra en la etapa, también si lanza una excepción."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        """Suma `amount` al contador indicado (ej. "cache_hits")."""
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def record_call(self, provider: str, error: bool = False) -> None:
+        """Registra una llamada a un proveedor externo y si ha fallado."""
+        with self._lock:
+            calls = self._calls.setdefault(provider, {"calls": 0, "errors": 0})
+            calls["calls"] += 1
+            if error:
+                calls["errors"] += 1
+
+    @contextmanager
+    def provider_call(self, provider: str) -> Iterator[None]:
+        """Registra la llamada del bloque al proveedor, como error si lanza una excepción."""
+        try:
+            yield
+        except Exception:
+            self.record_call(provider, error=True)
+            raise
+        self.record_call(provider)
+
+    def reset(self) -> None:
+        """Borra todas las medidas, para empezar una nueva ejecución."""
+        with self._lock:
+            self._durations = {}
+            self._counters = {}
+            self._calls = {}
+
+    def percentile(self, stage: str, percent: float) -> float:
+        """
+        Calcula el percentil de la etapa por el método del rango más cercano.
+
+        Returns:
+            float: Segundos del percentil, o 0 si la etapa no tiene medidas
+        """
+        with self._lock:
+            durations = sorted(self._durations.get(stage, []))
+        if not durations:
+            return 0.0
+        index = max(0, min(len(durations) - 1, math.ceil(percent / 100 * len(durations)) - 1))
+        return durations[index]
+
+    @staticmethod
+    def histogram(durations: List[float]) -> List[Dict[str, Any]]:
+        """
+        Reparte las duraciones en los intervalos de HISTOGRAM_BUCKETS.
+
+        Returns:
+            list: Por intervalo, su límite superior en segundos ("le", None en el último) y el
+            número de medidas que caen en él. Solo se incluyen los intervalos con medidas.
+        """
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for duration in durations:
+            index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if duration <= bound), len(HISTOGRAM_BUCKETS))
+            counts[index] += 1
+        bounds = list(HISTOGRAM_BUCKETS) + [None]
+        return [{"le": bound, "count": count} for bound, count in zip(bounds, counts) if count]
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtiene el resumen de todas las etapas.
+
+        Returns:
+            dict: Por etapa, número de medidas, tiempo total, p50, p95, p99, máximo en segundos
+            e histograma (ver histogram)
+        """
+        with self._lock:
+            stages = {stage: list(durations) for stage, durations in self._durations.items()}
+        return {
+            stage: {
+                "count": len(durations),
+                "total": round(sum(durations), 4),
+                "p50": round(self.percentile(stage, 50), 4),
+                "p95": round(self.percentile(stage, 95), 4),
+                "p99": round(self.percentile(stage, 99), 4),
+                "max": round(max(durations), 4),
+                "histogram": self.histogram(durations),
+            }
+            for stage, durations in stages.items()
+        }
+
+    @staticmethod
+    def hit_stats(counters: Dict[str, int], prefix: str) -> Dict[str, Any]:
+        """Obtiene los aciertos, fallos y tasa de acierto de los contadores `<prefix>_hits` y `<prefix>_misses`."""
+        hits = counters.get(f"{prefix}_hits", 0)
+        misses = counters.get(f"{prefix}_misses", 0)
+        return {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0}
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Obtiene el informe completo: resumen de las etapas, aciertos de la caché (en total y
+        por nivel: memoria y MongoDB), fallos de la caché resueltos con el cálculo de otro hilo o
+        proceso, bytes de las respuestas guardadas (sin comprimir y guardados) y tasa de error de
+        cada proveedor externo.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            calls = {provider: dict(stats) for provider, stats in self._calls.items()}
+
+        return {
+            "stages": self.summary(),
+            "cache": {
+                **self.hit_stats(counters, "cache"),
+                "coalesced": counters.get("cache_coalesced", 0),
+                "bytes": {"raw": counters.get("cache_raw_bytes", 0), "stored": counters.get("cache_stored_bytes", 0)},
+                "tiers": {tier: self.hit_stats(counters, f"cache_{tier}") for tier in ("memory", "mongo")},
+            },
+            "providers": {
+                provider: {**stats, "error_rate": round(stats["errors"] / stats["calls"], 4)}
+                for provider, stats in calls.items()
+            },
+            "counters": counters,
+        }
+
+
+# Métricas compartidas por todo el proceso
+metrics = StageMetrics()
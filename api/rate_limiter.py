@@ -0,0 +1,468 @@
+"""
+Limitador de peticiones por proveedor basado en token buckets.
+Todas las llamadas salientes (IA, búsqueda web, correo y pagos) pasan por aquí para
+respetar la cuota real de cada proveedor en lugar de usar un retraso global.
+
+Además de las peticiones por segundo, las llamadas del envío semanal limitan cuántas peticiones
+tiene en vuelo cada proveedor con un límite adaptativo (AIMD): sube mientras las llamadas van
+bien y se reduce a la mitad ante un 429, un 5xx o un timeout.
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Any, Iterator, List, Optional
+
+# Límites por defecto de cada proveedor: peticiones por segundo y tokens por minuto.
+# Un valor de 0 significa sin límite. Se pueden sobrescribir con las variables de entorno
+# RATE_LIMIT_<PROVEEDOR>_RPS y RATE_LIMIT_<PROVEEDOR>_TPM (por ejemplo RATE_LIMIT_GROQ_RPS)
+DEFAULT_RATE_LIMITS = {
+    "groq": {"rps": 0.5, "tpm": 12000},
+    "deepseek": {"rps": 0, "tpm": 0},
+    "openai": {"rps": 8, "tpm": 200000},
+    "tavily": {"rps": 1.5, "tpm": 0},
+    "serpapi": {"rps": 1, "tpm": 0},
+    "resend": {"rps": 2, "tpm": 0},
+    "stripe": {"rps": 25, "tpm": 0},
+}
+
+# Límite inicial y máximo de peticiones en vuelo de cada proveedor. Se pueden sobrescribir con
+# las variables de entorno CONCURRENCY_<PROVEEDOR>_INITIAL y CONCURRENCY_<PROVEEDOR>_MAX
+DEFAULT_CONCURRENCY_LIMITS = {
+    "groq": {"initial": 2, "max": 16},
+    "deepseek": {"initial": 4, "max": 64},
+    "openai": {"initial": 8, "max": 64},
+    "tavily": {"initial": 2, "max": 16},
+    "serpapi": {"initial": 2, "max": 16},
+    "resend": {"initial": 2, "max": 8},
+}
+# CONCURRENCY_BACKOFF: factor por el que se multiplica el límite tras un 429, un 5xx o un timeout
+CONCURRENCY_BACKOFF = float(os.environ.get("CONCURRENCY_BACKOFF", "0.5"))
+# Segundos entre comprobaciones de las corrutinas que esperan un hueco en el límite
+CONCURRENCY_ASYNC_POLL_SECONDS = 0.05
+
+
+class TokenBucket:
+    """
+    Token bucket seguro entre hilos.
+
+    Las reservas pueden dejar el saldo en negativo: quien reserva recibe el tiempo que debe
+    esperar y duerme fuera del lock, de modo que las peticiones se reparten en orden de llegada.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: Tokens que se recuperan por segundo
+            capacity: Tamaño máximo del bucket (ráfaga). Por defecto un segundo de tokens, mínimo 1
+        """
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Reserva `amount` tokens.
+
+        Returns:
+            Segundos que hay que esperar antes de usar los tokens reservados
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class ProviderRateLimiter:
+    """
+    Limitador de un proveedor, con un bucket de peticiones y otro opcional de tokens de LLM.
+    """
+
+    def __init__(self, name: str, rps: float = 0, tpm: float = 0):
+        self.name = name
+        self.requests = TokenBucket(rps) if rps > 0 else None
+        self.llm_tokens = TokenBucket(tpm / 60, capacity=tpm) if tpm > 0 else None
+        self.calls = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.stats_lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Reserva una petición y sus tokens y registra la espera en las métricas.
+
+        Returns:
+            Segundos que hay que esperar antes de hacer la petición
+        """
+        wait = 0.0
+        if self.requests:
+            wait = self.requests.reserve(1)
+        if self.llm_tokens and tokens:
+            wait = max(wait, self.llm_tokens.reserve(tokens))
+
+        with self.stats_lock:
+            self.calls += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+        return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Espera hasta que se pueda hacer una petición que consume `tokens` tokens.
+
+        Returns:
+            Segundos esperados
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """
+        Igual que acquire, pero espera sin bloquear el bucle de eventos.
+
+        Returns:
+            Segundos esperados
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, tokens: int) -> None:
+        """
+        Ajusta el bucket de tokens con la diferencia entre el consumo real y el estimado.
+        No espera: la deuda la pagan las siguientes peticiones.
+        """
+        if self.llm_tokens and tokens:
+            self.llm_tokens.reserve(tokens)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Límite de peticiones en vuelo de un proveedor con incremento aditivo y reducción
+    multiplicativa (AIMD), como el control de congestión de TCP.
+
+    Cada llamada correcta suma 1/límite, es decir, el límite sube en 1 por cada ronda completa
+    de llamadas correctas. Un 429, un 5xx o un timeout lo multiplica por `backoff`, una sola vez
+    por ronda: las llamadas que ya estaban en vuelo cuando se redujo no lo vuelven a reducir.
+    Los demás errores (ej. un 400) no lo modifican.
+    """
+
+    def __init__(self, name: str, initial: float, maximum: float, minimum: float = 1, backoff: float = CONCURRENCY_BACKOFF):
+        self.name = name
+        self.minimum = max(1.0, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.backoff = backoff
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def _take(self) -> float:
+        """Ocupa un hueco (con el lock tomado). Devuelve el instante de inicio de la llamada."""
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.monotonic()
+
+    def try_acquire(self) -> Optional[float]:
+        """
+        Ocupa un hueco si lo hay, sin esperar.
+
+        Returns:
+            Instante de inicio de la llamada, o None si el límite está completo
+        """
+        with self.condition:
+            if self.in_flight < int(self.limit):
+                return self._take()
+            return None
+
+    def acquire(self) -> float:
+        """
+        Espera a que haya un hueco y lo ocupa.
+
+        Returns:
+            Instante de inicio de la llamada, que hay que pasar a release
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            return self._take()
+
+    async def acquire_async(self) -> float:
+        """
+        Igual que acquire, pero espera sin bloquear el bucle de eventos.
+        """
+        while True:
+            started = self.try_acquire()
+            if started is not None:
+                return started
+            await asyncio.sleep(CONCURRENCY_ASYNC_POLL_SECONDS)
+
+    def release(self, started: float, error: Optional[Exception] = None) -> None:
+        """
+        Libera el hueco de una llamada y ajusta el límite según su resultado.
+
+        Args:
+            started: Instante de inicio devuelto por acquire
+            error: Excepción de la llamada, o None si ha ido bien
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if error is None:
+                previous = int(self.limit)
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                if int(self.limit) > previous:
+                    self.increases += 1
+            elif is_overload_error(error) and started >= self.last_decrease:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.last_decrease = time.monotonic()
+                self.decreases += 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Ejecuta el bloque ocupando un hueco del límite y lo ajusta según si lanza una excepción."""
+        started = self.acquire()
+        try:
+            yield
+        except Exception as e:
+            self.release(started, e)
+            raise
+        self.release(started)
+
+    @asynccontextmanager
+    async def slot_async(self) -> AsyncIterator[None]:
+        """Versión asíncrona de slot."""
+        started = await self.acquire_async()
+        try:
+            yield
+        except Exception as e:
+            self.release(started, e)
+            raise
+        self.release(started)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Obtiene el límite actual, las peticiones en vuelo y cuántas veces ha subido y bajado el límite."""
+        with self.condition:
+            return {
+                "limit": int(self.limit),
+                "max_limit": int(self.maximum),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+class RateLimiter:
+    """
+    Registro de limitadores por proveedor compartido por todo el proceso.
+    """
+
+    _limiters: Dict[str, ProviderRateLimiter] = {}
+    _concurrency: Dict[str, AdaptiveConcurrencyLimit] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, provider: str) -> ProviderRateLimiter:
+        """
+        Obtiene (o crea) el limitador de un proveedor con su configuración.
+        """
+        with cls._lock:
+            limiter = cls._limiters.get(provider)
+            if limiter is None:
+                defaults = DEFAULT_RATE_LIMITS.get(provider, {"rps": 0, "tpm": 0})
+                prefix = f"RATE_LIMIT_{provider.upper()}"
+                limiter = ProviderRateLimiter(
+                    provider,
+                    rps=float(os.environ.get(f"{prefix}_RPS", defaults["rps"])),
+                    tpm=float(os.environ.get(f"{prefix}_TPM", defaults["tpm"])),
+                )
+                cls._limiters[provider] = limiter
+            return limiter
+
+    @classmethod
+    def get_concurrency(cls, provider: str) -> AdaptiveConcurrencyLimit:
+        """
+        Obtiene (o crea) el límite adaptativo de peticiones en vuelo de un proveedor.
+        """
+        with cls._lock:
+            limit = cls._concurrency.get(provider)
+            if limit is None:
+                defaults = DEFAULT_CONCURRENCY_LIMITS.get(provider, {"initial": 4, "max": 32})
+                prefix = f"CONCURRENCY_{provider.upper()}"
+                limit = AdaptiveConcurrencyLimit(
+                    provider,
+                    initial=float(os.environ.get(f"{prefix}_INITIAL", defaults["initial"])),
+                    maximum=float(os.environ.get(f"{prefix}_MAX", defaults["max"])),
+                )
+                cls._concurrency[provider] = limit
+            return limit
+
+    @classmethod
+    def slot(cls, provider: str):
+        """
+        Gestor de contexto que ejecuta una llamada al proveedor dentro de su límite adaptativo
+        de peticiones en vuelo. Se usa después de acquire, que controla las peticiones por segundo.
+
+        Args:
+            provider: Nombre del proveedor (ej. "groq", "tavily", "resend")
+        """
+        return cls.get_concurrency(provider).slot()
+
+    @classmethod
+    def slot_async(cls, provider: str):
+        """
+        Versión asíncrona de slot, para usar con `async with`.
+        """
+        return cls.get_concurrency(provider).slot_async()
+
+    @classmethod
+    def acquire(cls, provider: str, tokens: int = 0) -> float:
+        """
+        Espera el turno para hacer una llamada al proveedor.
+
+        Args:
+            provider: Nombre del proveedor (ej. "groq", "tavily", "resend")
+            tokens: Tokens de LLM estimados para la llamada (opcional)
+
+        Returns:
+            Segundos esperados
+        """
+        return cls.get(provider).acquire(tokens)
+
+    @classmethod
+    async def acquire_async(cls, provider: str, tokens: int = 0) -> float:
+        """
+        Versión asíncrona de acquire para las llamadas hechas desde asyncio.
+        """
+        return await cls.get(provider).acquire_async(tokens)
+
+    @classmethod
+    def record_usage(cls, provider: str, tokens: int) -> None:
+        """
+        Registra la diferencia entre los tokens reales de una llamada y los estimados.
+        """
+        cls.get(provider).record_usage(tokens)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtiene las métricas de espera de cada proveedor.
+
+        Returns:
+            Diccionario por proveedor con número de llamadas, segundos esperados en total y espera máxima
+        """
+        with cls._lock:
+            limiters = list(cls._limiters.values())
+        return {
+            limiter.name: {
+                "calls": limiter.calls,
+                "wait_seconds": round(limiter.wait_seconds, 3),
+                "max_wait_seconds": round(limiter.max_wait_seconds, 3),
+            }
+            for limiter in limiters
+        }
+
+    @classmethod
+    def get_concurrency_stats(cls) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtiene el límite adaptativo actual de peticiones en vuelo de cada proveedor.
+
+        Returns:
+            Diccionario por proveedor con el límite actual y máximo, las peticiones en vuelo
+            (actuales y máximas) y cuántas veces ha subido y bajado el límite
+        """
+        with cls._lock:
+            limits = list(cls._concurrency.values())
+        return {limit.name: limit.get_stats() for limit in limits}
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """
+    Estima los tokens de una lista de mensajes de chat (unos 4 caracteres por token).
+    """
+    return sum(len(str(message.get("content") or "")) for message in messages) // 4
+
+
+def get_error_status(error: Exception) -> Optional[int]:
+    """
+    Obtiene el código HTTP de un error de un proveedor (openai, requests, httpx o Resend).
+
+    Returns:
+        El código HTTP, o None si el error no viene de una respuesta (ej. un fallo de red)
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None:
+        # Resend guarda el código HTTP en `code`
+        status = getattr(error, "code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Obtiene los segundos de espera indicados por la cabecera Retry-After de la respuesta del error,
+    en segundos o como fecha HTTP.
+
+    Returns:
+        Segundos de espera, o None si el error no trae la cabecera
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def is_timeout_error(error: Exception) -> bool:
+    """
+    Indica si el error es un timeout de la petición (requests, httpx, openai o de Python).
+    """
+    return isinstance(error, TimeoutError) or any("Timeout" in cls.__name__ for cls in type(error).__mro__)
+
+
+def is_overload_error(error: Exception) -> bool:
+    """
+    Indica si el error es una señal de que el proveedor está saturado: límite de peticiones (429),
+    errores del servidor (5xx) o timeouts (408 o de la propia petición). Son los errores que reducen el límite adaptativo.
+    """
+    status = get_error_status(error)
+    return is_timeout_error(error) or status in (408, 429) or (status is not None and status >= 500)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """
+    Indica si merece la pena reintentar una llamada que ha fallado con este error: límites de
+    peticiones (429), timeouts (408), errores del servidor (5xx) y fallos sin respuesta.
+    Los demás errores 4xx (datos no válidos, clave incorrecta...) volverían a fallar.
+    """
+    status = get_error_status(error)
+    return status is None or status in (408, 429) or status >= 500
@@ -1,5 +1,6 @@
 from flask import Blueprint, jsonify, request, session, redirect, url_for
 from api.database import users_collection
+from api.utils import get_email_query
 import bcrypt
 import jwt as PyJWT
 import os
@@ -32,7 +33,7 @@ def login():
     password = data['password']
     
     # Buscar el usuario por email
-    user = users_collection.find_one({'email': email})
+    user = users_collection.find_one(get_email_query(email))
     
     # Verificar si el usuario existe y tiene contraseña
     if not user or not user.get('password'):
@@ -12,6 +12,7 @@ from api.service.stripe_service import (
     handle_subscription_deleted
 )
 from api.auth import login_required
+from api.rate_limiter import RateLimiter
 
 subscription_routes = Blueprint('subscription_routes', __name__, url_prefix='/subscription')
 
@@ -60,6 +61,7 @@ def checkout_success():
         return jsonify({'success': False, 'error': 'Missing session_id parameter'}), 400
     try:
         # Retrieve the Stripe checkout session and process subscription
+        RateLimiter.acquire("stripe")
         checkout_session = stripe.checkout.Session.retrieve(session_id, expand=['subscription'])
         handle_checkout_session_completed({'object': checkout_session})
         # Redirect to dashboard after subscription is processed
@@ -2,12 +2,21 @@
 Este archivo contiene las rutas (endpoints) de la API.
 """
 
-from flask import Blueprint, jsonify, request, g
+from flask import Blueprint, jsonify, request, g, url_for
 from api.database import db, users_collection
 from flask_babel import gettext as _
 from api.auth import login_required
-from maintenance import process_pending_emails
+from maintenance import execute_send_run
+from api.service.maintenance_run_service import (
+    decode_continuation,
+    enqueue_run,
+    get_run,
+    record_continuation_trigger,
+    serialize_run,
+)
 import os
+import threading
+import requests
 
 from api.route.page_routes import page_bp
 from api.route.subscribe_routes import subscribe_bp
@@ -153,28 +162,153 @@ def reset_user_prompts():
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+def is_maintenance_request_authorized():
+    """
+    Comprueba que la petición trae la clave de API de mantenimiento en la cabecera X-API-Key.
+    """
+    api_key = request.headers.get('X-API-Key')
+    return bool(api_key) and api_key == os.environ.get('MAINTENANCE_API_KEY')
+
+def trigger_continuation(run_id, continuation):
+    """
+    Lanza la siguiente invocación de un envío por tramos llamando otra vez al endpoint.
+    No espera la respuesta: basta con que la petición llegue para que la nueva invocación
+    se ejecute, así que el tiempo de lectura se agota a propósito.
+
+    Después comprueba que la nueva invocación ha recogido la ejecución y guarda el resultado en
+    `continuation_trigger`. Si no ha empezado, la ejecución sigue en cola con su token: se puede
+    retomar enviándolo al endpoint o, pasados MAINTENANCE_RUN_STALE_SECONDS, con el worker.
+    """
+    status, error = "started", None
+    try:
+        response = requests.post(
+            url_for('api.trigger_weekly_emails', _external=True),
+            json={"continuation": continuation},
+            headers={"X-API-Key": os.environ.get('MAINTENANCE_API_KEY')},
+            timeout=(5, 1),
+        )
+        if response.status_code >= 400:
+            status, error = "failed", f"HTTP {response.status_code}"
+    except requests.exceptions.ReadTimeout:
+        pass
+    except requests.exceptions.RequestException as e:
+        status, error = "failed", str(e)
+
+    if status == "started":
+        run = get_run(str(run_id))
+        if run is not None and run["status"] == "queued" and run.get("continuation") == continuation:
+            status = "not_started"
+
+    if status != "started":
+        print(
+            f"El siguiente tramo del envío {run_id} no ha empezado ({error or 'sin recoger'}). "
+            f"Se puede retomar con su token de continuación o con `python maintenance.py worker`"
+        )
+    record_continuation_trigger(run_id, continuation, status, error)
+
 @api_bp.route('/maintenance/send-weekly-emails', methods=['POST'])
 def trigger_weekly_emails():
     """
     Endpoint para activar el envío de correos semanales.
     Debe estar protegido por una clave de API o token para evitar acceso no autorizado.
+
+    Encola una ejecución (o devuelve la que ya esté pendiente o en curso) y la ejecuta según
+    el campo "mode" del cuerpo JSON o MAINTENANCE_SEND_MODE. Por defecto, "chunked" en Vercel y
+    "worker" en el resto de entornos:
+
+    worker: solo la encola; la ejecuta `python maintenance.py worker`.
+
+    background: responde al momento con el ID y la ejecuta un hilo en segundo plano. Solo para
+    ejecuciones locales: en Vercel la función se congela al responder y el hilo se quedaría a
+    medias, así que allí se usa "chunked" en su lugar.
+
+    chunked: procesa dentro de la petición como mucho MAINTENANCE_CHUNK_MAX_USERS usuarios o
+    MAINTENANCE_CHUNK_MAX_SECONDS segundos (o "max_users" y "max_seconds" del cuerpo) y, si quedan
+    pendientes, devuelve un token "continuation" que hay que enviar en el cuerpo de la siguiente
+    llamada para retomarla. Con MAINTENANCE_CHUNK_SELF_TRIGGER el propio endpoint lanza esa llamada.
+    Pensado para entornos serverless, donde la duración de cada invocación está limitada.
     """
     # Verificar autenticación
-    api_key = request.headers.get('X-API-Key')
-    if not api_key or api_key != os.environ.get('MAINTENANCE_API_KEY'):
+    if not is_maintenance_request_authorized():
         return jsonify({"success": False, "message": "Unauthorized"}), 401
-    
+
+    data = request.get_json(silent=True) or {}
+    continuation = data.get("continuation")
+    serverless = os.environ.get("VERCEL") == "1"
+    mode = "chunked" if continuation else (
+        data.get("mode") or os.environ.get('MAINTENANCE_SEND_MODE') or ("chunked" if serverless else "worker")
+    )
+    if mode == "background" and serverless:
+        mode = "chunked"
+
     try:
-        # Procesar correos pendientes con un intervalo de 7 días
-        total, success, errors = process_pending_emails(days_interval=6)
-        
+        if continuation:
+            try:
+                run_id, _after = decode_continuation(continuation)
+            except ValueError as e:
+                return jsonify({"success": False, "message": str(e)}), 400
+            created = False
+        else:
+            run, created = enqueue_run("send_weekly_emails")
+            run_id = run["_id"]
+
+        status_url = url_for('api.get_weekly_emails_run', run_id=str(run_id))
+
+        if mode == "chunked":
+            result = execute_send_run(
+                run_id,
+                continuation=continuation,
+                max_users=int(data.get("max_users") or os.environ.get('MAINTENANCE_CHUNK_MAX_USERS', '200')),
+                max_seconds=float(data.get("max_seconds") or os.environ.get('MAINTENANCE_CHUNK_MAX_SECONDS', '45')),
+            )
+            if result is None:
+                # Otro proceso la está ejecutando, ya ha terminado o el token no es el último emitido
+                return jsonify({
+                    "success": False,
+                    "message": "La ejecución no está disponible para este tramo",
+                    "run_id": str(run_id),
+                    "status_url": status_url,
+                }), 409
+
+            if result["continuation"] and os.environ.get('MAINTENANCE_CHUNK_SELF_TRIGGER', 'false').lower() == 'true':
+                trigger_continuation(run_id, result["continuation"])
+
+            return jsonify({"success": True, **result, "status_url": status_url})
+
+        # Ejecutar en segundo plano; si otro proceso ya la ha recogido, el hilo no hace nada
+        if mode == "background" and run["status"] == "queued":
+            threading.Thread(
+                target=execute_send_run,
+                args=(run["_id"],),
+                name=f"send-run-{run['_id']}",
+                daemon=True,
+            ).start()
+
         return jsonify({
             "success": True,
-            "message": f"Proceso completado: {total} usuarios procesados, {success} éxitos, {errors} errores"
-        })
+            "message": "Envío encolado" if created else "Ya hay un envío pendiente o en curso",
+            "run_id": str(run["_id"]),
+            "status": run["status"],
+            "status_url": status_url,
+        }), 202
     except Exception as e:
         print(f"Error en el proceso de envío de correos: {str(e)}")
         return jsonify({
             "success": False, 
             "message": f"Error: {str(e)}"
         }), 500
+
+@api_bp.route('/maintenance/send-weekly-emails/<run_id>', methods=['GET'])
+def get_weekly_emails_run(run_id):
+    """
+    Endpoint para consultar el estado y los contadores de progreso de una ejecución
+    del envío semanal. Requiere la misma clave de API que el endpoint que la encola.
+    """
+    if not is_maintenance_request_authorized():
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    run = get_run(run_id)
+    if run is None:
+        return jsonify({"success": False, "message": "Run not found"}), 404
+
+    return jsonify({"success": True, "run": serialize_run(run)})
@@ -0,0 +1,141 @@
+"""
+Agrupación de usuarios en cohortes para generar el boletín semanal una sola vez
+por combinación de idioma, proveedor de IA, proveedor de búsqueda y prompt.
+"""
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from api.database import db
+from api.services import generate_digest_body, generate_digest_body_async
+from api.serviceAi.prompts import get_news_summary_prompt, get_email_template, get_fallback_content
+
+CohortKey = Tuple[str, str, str, str]
+
+
+@dataclass
+class DigestCohort:
+    """
+    Grupo de usuarios que reciben exactamente el mismo cuerpo de boletín.
+    """
+
+    language: str
+    ai_provider: str
+    search_provider: str
+    system_prompt: str
+    users: List[dict] = field(default_factory=list)
+    body: Optional[str] = None
+    """Cuerpo generado. None si aún no se ha generado o si la generación ha fallado."""
+
+    @property
+    def prompt_hash(self) -> str:
+        return hash_prompt(self.system_prompt)
+
+    @property
+    def key(self) -> CohortKey:
+        return (self.language, self.ai_provider, self.search_provider, self.prompt_hash)
+
+    @property
+    def cohort_id(self) -> str:
+        """Identificador estable de la cohorte, apto para usarse como clave en MongoDB."""
+        return hashlib.md5("|".join(self.key).encode()).hexdigest()
+
+
+def hash_prompt(prompt: str) -> str:
+    """Calcula el hash del prompt efectivo de una cohorte."""
+    return hashlib.md5(prompt.strip().encode()).hexdigest()
+
+
+def get_custom_prompts(users: List[dict]) -> Dict:
+    """
+    Obtiene en una sola consulta los documentos de prompts de los usuarios.
+
+    Args:
+        users: Lista de usuarios
+
+    Returns:
+        dict: Documentos de prompts indexados por su _id
+    """
+    prompt_ids = [user["prompts"] for user in users if user.get("prompts")]
+    if not prompt_ids:
+        return {}
+
+    projection = {"openai_prompt": 1, "groq_prompt": 1, "deepseek_prompt": 1}
+    return {doc["_id"]: doc for doc in db.prompts.find({"_id": {"$in": prompt_ids}}, projection)}
+
+
+def resolve_system_prompt(user: dict, prompts_by_id: Dict) -> str:
+    """
+    Obtiene el prompt efectivo del usuario: el personalizado para su proveedor
+    de IA si existe, o el predeterminado de su idioma.
+    """
+    language = user.get("language", "es")
+    provider = user.get("ai_provider", "groq")
+
+    prompts = prompts_by_id.get(user.get("prompts")) or {}
+    return prompts.get(f"{provider}_prompt") or get_news_summary_prompt(language)
+
+
+def group_users_into_cohorts(users: List[dict]) -> Dict[CohortKey, DigestCohort]:
+    """
+    Agrupa a los usuarios por idioma, proveedor de IA, proveedor de búsqueda y prompt.
+
+    Args:
+        users: Lista de usuarios pendientes de recibir el boletín
+
+    Returns:
+        dict: Cohortes indexadas por su clave
+    """
+    prompts_by_id = get_custom_prompts(users)
+    cohorts: Dict[CohortKey, DigestCohort] = {}
+
+    for user in users:
+        cohort = DigestCohort(
+            language=user.get("language", "es"),
+            ai_provider=user.get("ai_provider", "groq"),
+            search_provider=user.get("search_provider", "tavily"),
+            system_prompt=resolve_system_prompt(user, prompts_by_id),
+        )
+        cohorts.setdefault(cohort.key, cohort).users.append(user)
+
+    return cohorts
+
+
+def generate_cohort_digest(cohort: DigestCohort) -> Optional[str]:
+    """
+    Genera el cuerpo del boletín de una cohorte y lo guarda en `cohort.body`.
+
+    Returns:
+        str | None: Cuerpo generado o None si ha fallado
+    """
+    cohort.body = generate_digest_body(
+        cohort.language, cohort.ai_provider, cohort.search_provider, cohort.system_prompt
+    )
+    return cohort.body
+
+
+async def generate_cohort_digest_async(cohort: DigestCohort) -> Optional[str]:
+    """
+    Versión asíncrona de generate_cohort_digest.
+
+    Returns:
+        str | None: Cuerpo generado o None si ha fallado
+    """
+    cohort.body = await generate_digest_body_async(
+        cohort.language, cohort.ai_provider, cohort.search_provider, cohort.system_prompt
+    )
+    return cohort.body
+
+
+def render_digest_email(user: dict, body: Optional[str]) -> str:
+    """
+    Construye el email final de un usuario sustituyendo únicamente su nombre.
+    Si no hay cuerpo generado se usa el contenido de respaldo.
+    """
+    username = user["email"].split("@")[0]
+    language = user.get("language", "es")
+
+    if body is None:
+        return get_fallback_content(username, language)
+
+    return get_email_template(username, body, language)
@@ -0,0 +1,329 @@
+"""
+Cola de ejecuciones de las tareas de mantenimiento.
+
+El endpoint de mantenimiento solo crea un documento en `maintenance_runs` y responde con su ID.
+La ejecución la recoge después un hilo en segundo plano o `python maintenance.py worker`, que
+va guardando en el mismo documento los contadores de progreso que consulta el endpoint de estado.
+
+En entornos serverless la ejecución se puede hacer por tramos: cada invocación procesa un número
+acotado de usuarios, deja la ejecución otra vez en cola y devuelve un token de continuación
+que la siguiente invocación presenta para retomarla.
+"""
+import base64
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, ReturnDocument
+
+from api.database import db
+from api.index_registry import create_registered_indexes
+
+# Colección de las ejecuciones de mantenimiento
+maintenance_runs_collection = db["maintenance_runs"]
+
+# MAINTENANCE_RUN_STALE_SECONDS: segundos sin actualizar el progreso tras los que una ejecución
+# en curso se da por abandonada (por ejemplo, si el proceso murió) y otro proceso puede retomarla
+MAINTENANCE_RUN_STALE_SECONDS = int(os.environ.get("MAINTENANCE_RUN_STALE_SECONDS", "900"))
+
+
+def create_maintenance_run_indexes():
+    """
+    Crea los índices de la colección maintenance_runs (ver api/index_registry.py), para buscar las
+    ejecuciones pendientes de una tarea por orden de llegada.
+    Es idempotente, por lo que se puede ejecutar antes de cada consulta de la cola.
+    """
+    create_registered_indexes(maintenance_runs_collection)
+
+
+def get_stale_before(now: Optional[datetime] = None) -> datetime:
+    """Obtiene la fecha antes de la cual una ejecución en curso se considera abandonada."""
+    return (now or datetime.now(timezone.utc)) - timedelta(seconds=MAINTENANCE_RUN_STALE_SECONDS)
+
+
+def get_claimable_query(kind: str, now: Optional[datetime] = None) -> dict:
+    """
+    Consulta de las ejecuciones de una tarea que un proceso puede empezar: las encoladas y
+    las que están en curso pero llevan demasiado tiempo sin dar señales.
+    """
+    return {
+        "kind": kind,
+        "$or": [
+            {"status": "queued"},
+            {"status": "running", "updated_at": {"$lt": get_stale_before(now)}},
+        ],
+    }
+
+
+def enqueue_run(kind: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Encola una ejecución de la tarea, salvo que ya haya una pendiente o en curso.
+
+    Args:
+        kind (str): Tarea a ejecutar (ej. "send_weekly_emails")
+
+    Returns:
+        tuple: Documento de la ejecución y True si se ha creado, o False si ya existía
+    """
+    create_maintenance_run_indexes()
+    now = datetime.now(timezone.utc)
+
+    active = maintenance_runs_collection.find_one(
+        {
+            "kind": kind,
+            "$or": [
+                {"status": "queued"},
+                {"status": "running", "updated_at": {"$gte": get_stale_before(now)}},
+            ],
+        },
+        sort=[("created_at", ASCENDING)],
+    )
+    if active:
+        return active, False
+
+    run = {
+        "_id": ObjectId(),
+        "kind": kind,
+        "status": "queued",
+        "created_at": now,
+        "updated_at": now,
+        "progress": {"total": 0, "sent": 0, "errors": 0, "skipped": 0},
+    }
+    maintenance_runs_collection.insert_one(run)
+    return run, True
+
+
+def claim_run(
+    kind: str,
+    runner_id: str,
+    run_id: Optional[ObjectId] = None,
+    continuation: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Marca como en curso la ejecución más antigua disponible de la tarea (o la indicada).
+    La operación es atómica, por lo que una ejecución solo la recoge un proceso.
+
+    Args:
+        kind (str): Tarea de la ejecución
+        runner_id (str): Identificador del proceso que la va a ejecutar
+        run_id (ObjectId, optional): Ejecución concreta a recoger
+        continuation (str, optional): Token de continuación con el que se retoma la ejecución.
+            Solo se recoge si coincide con el último emitido, de forma que una continuación
+            repetida o caducada no vuelve a ejecutar un tramo. Sin token no se recogen las
+            ejecuciones por tramos en pausa, salvo que lleven MAINTENANCE_RUN_STALE_SECONDS sin
+            retomarse (la cadena de continuaciones se ha cortado).
+
+    Returns:
+        dict | None: Documento de la ejecución, o None si no hay ninguna disponible
+    """
+    now = datetime.now(timezone.utc)
+    query = get_claimable_query(kind, now)
+    if run_id is not None:
+        query["_id"] = run_id
+    if continuation is not None:
+        query["continuation"] = continuation
+    else:
+        query["$and"] = [{"$or": [{"continuation": None}, {"updated_at": {"$lt": get_stale_before(now)}}]}]
+
+    return maintenance_runs_collection.find_one_and_update(
+        query,
+        {
+            "$set": {"status": "running", "runner_id": runner_id, "updated_at": now},
+            "$min": {"started_at": now},
+            "$inc": {"invocations": 1},
+        },
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def save_run_slice_end(run_id: ObjectId, slice_end: datetime) -> None:
+    """
+    Guarda el final de la franja que procesa la ejecución, para que todos sus tramos
+    envíen a los mismos usuarios aunque se ejecuten en franjas distintas.
+    """
+    maintenance_runs_collection.update_one({"_id": run_id}, {"$set": {"slice_end": slice_end}})
+
+
+def pause_run(run_id: ObjectId, progress: Dict[str, Any], continuation: str) -> None:
+    """
+    Deja una ejecución por tramos otra vez en cola tras completar un tramo.
+
+    Args:
+        run_id (ObjectId): ID de la ejecución
+        progress (dict): Contadores acumulados hasta el momento
+        continuation (str): Token que debe presentar la invocación que la retome
+    """
+    maintenance_runs_collection.update_one(
+        {"_id": run_id},
+        {
+            "$set": {
+                "status": "queued",
+                "progress": progress,
+                "continuation": continuation,
+                "updated_at": datetime.now(timezone.utc),
+            }
+        },
+    )
+
+
+def record_continuation_trigger(run_id: ObjectId, continuation: str, status: str, error: Optional[str] = None) -> None:
+    """
+    Guarda en la ejecución el resultado de lanzar la invocación que retoma un tramo, para que el
+    endpoint de estado muestre si la cadena de continuaciones se ha cortado.
+
+    Args:
+        run_id (ObjectId): ID de la ejecución
+        continuation (str): Token enviado a la siguiente invocación
+        status (str): "started" si la ha recogido, "not_started" si aún no, o "failed" si la
+            petición ha fallado. En los dos últimos casos sigue en cola con el mismo token
+        error (str, optional): Error de la petición
+    """
+    maintenance_runs_collection.update_one(
+        {"_id": run_id},
+        {
+            "$set": {
+                "continuation_trigger": {
+                    "continuation": continuation,
+                    "status": status,
+                    "error": error,
+                    "at": datetime.now(timezone.utc),
+                }
+            }
+        },
+    )
+
+
+def encode_continuation(run_id: ObjectId, last_user_id: Optional[Any] = None) -> str:
+    """
+    Construye el token opaco de continuación de una ejecución por tramos a partir de su ID y
+    del último usuario procesado.
+    """
+    payload = {"run": str(run_id), "after": str(last_user_id) if last_user_id else None}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode()
+
+
+def decode_continuation(continuation: str) -> Tuple[ObjectId, Optional[ObjectId]]:
+    """
+    Interpreta un token de continuación.
+
+    Returns:
+        tuple: ID de la ejecución y del último usuario procesado (o None)
+
+    Raises:
+        ValueError: Si el token no es válido
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(continuation.encode()))
+        after = payload.get("after")
+        return ObjectId(payload["run"]), ObjectId(after) if after else None
+    except (ValueError, KeyError, TypeError, AttributeError, InvalidId) as e:
+        raise ValueError(f"Token de continuación no válido: {continuation}") from e
+
+
+def update_run_progress(run_id: ObjectId, progress: Dict[str, Any]) -> None:
+    """
+    Guarda los contadores de progreso de una ejecución. Sirve también de señal de vida.
+
+    Args:
+        run_id (ObjectId): ID de la ejecución
+        progress (dict): Contadores total, sent, errors y skipped, y el último usuario procesado
+    """
+    maintenance_runs_collection.update_one(
+        {"_id": run_id, "status": "running"},
+        {"$set": {"progress": progress, "updated_at": datetime.now(timezone.utc)}},
+    )
+
+
+def finish_run(run_id: ObjectId, progress: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+    """
+    Marca una ejecución como terminada ("completed") o fallida ("failed") si se indica un error.
+
+    Args:
+        run_id (ObjectId): ID de la ejecución
+        progress (dict, optional): Contadores finales
+        error (str, optional): Error que interrumpió la ejecución
+    """
+    now = datetime.now(timezone.utc)
+    update = {
+        "status": "failed" if error else "completed",
+        "finished_at": now,
+        "updated_at": now,
+        "error": error,
+        "continuation": None,
+    }
+    if progress is not None:
+        update["progress"] = progress
+    maintenance_runs_collection.update_one({"_id": run_id}, {"$set": update})
+
+
+def save_run_report(kind: str, report: Dict[str, Any], run_id: Optional[ObjectId] = None) -> ObjectId:
+    """
+    Guarda el informe de una ejecución (latencias por etapa, caché, errores de los proveedores).
+    Las ejecuciones por tramos acumulan un informe por tramo en `reports`.
+
+    Args:
+        kind (str): Tarea de la ejecución
+        report (dict): Informe a guardar, con "started_at", "finished_at" y "users"
+        run_id (ObjectId, optional): Ejecución encolada a la que pertenece. Si no se indica
+            (por ejemplo, al lanzar el envío desde la línea de comandos), se crea una ejecución
+            ya terminada con el informe.
+
+    Returns:
+        ObjectId: ID de la ejecución en la que se ha guardado
+    """
+    if run_id is not None:
+        maintenance_runs_collection.update_one(
+            {"_id": run_id},
+            {"$push": {"reports": report}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        )
+        return run_id
+
+    run_id = ObjectId()
+    maintenance_runs_collection.insert_one({
+        "_id": run_id,
+        "kind": kind,
+        "status": "completed",
+        "created_at": report["started_at"],
+        "started_at": report["started_at"],
+        "finished_at": report["finished_at"],
+        "updated_at": report["finished_at"],
+        "runner_id": report.get("runner_id"),
+        "invocations": 1,
+        "progress": dict(report["users"]),
+        "reports": [report],
+    })
+    return run_id
+
+
+def get_run(run_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Recupera una ejecución por su ID en texto.
+
+    Returns:
+        dict | None: Documento de la ejecución, o None si no existe o el ID no es válido
+    """
+    try:
+        return maintenance_runs_collection.find_one({"_id": ObjectId(run_id)})
+    except (InvalidId, TypeError):
+        return None
+
+
+def serialize_run(run: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convierte el documento de una ejecución en un diccionario serializable a JSON.
+    """
+    serialized = {"run_id": str(run["_id"])}
+    for key, value in run.items():
+        if key == "_id":
+            continue
+        if key == "reports":
+            value = [
+                {name: item.isoformat() if isinstance(item, datetime) else item for name, item in report.items()}
+                for report in value
+            ]
+        serialized[key] = value.isoformat() if isinstance(value, datetime) else value
+    return serialized
@@ -0,0 +1,310 @@
+"""
+Cola de reintentos del correo semanal.
+
+Cuando el proveedor rechaza un correo, se guarda en `email_retries` ya renderizado, de forma que
+el reintento no vuelve a llamar a la IA, con la fecha del siguiente intento calculada con backoff
+exponencial y jitter (o la indicada por el proveedor en Retry-After). Mientras tanto el envío
+normal no vuelve a procesar al usuario: su reserva se prolonga y, si caduca antes de que se
+reintente, el envío normal lo salta al reservarlo. Tras el último intento,
+o si el error no se puede reintentar, el correo pasa a `email_dead_letters` y el usuario se
+planifica para el envío de la semana siguiente.
+"""
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteOne, InsertOne, UpdateOne
+
+from api.database import db, users_collection
+from api.index_registry import create_registered_indexes
+from api.service.schedule_service import compute_next_send_at
+from api.service.send_ledger_service import get_sent_user_ids
+from models.email_dead_letter import EmailDeadLetter
+from models.email_retry import EmailRetry
+
+# Colecciones de la cola de reintentos
+email_retries_collection = db["email_retries"]
+email_dead_letters_collection = db["email_dead_letters"]
+
+# EMAIL_RETRY_MAX_ATTEMPTS: intentos de envío de un correo, incluido el original, antes de darlo por perdido
+EMAIL_RETRY_MAX_ATTEMPTS = int(os.environ.get("EMAIL_RETRY_MAX_ATTEMPTS", "5"))
+# EMAIL_RETRY_BASE_SECONDS: espera antes del primer reintento. Se duplica en cada intento
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get("EMAIL_RETRY_BASE_SECONDS", "60"))
+# EMAIL_RETRY_MAX_SECONDS: espera máxima entre dos intentos
+EMAIL_RETRY_MAX_SECONDS = float(os.environ.get("EMAIL_RETRY_MAX_SECONDS", "3600"))
+
+
+def create_retry_indexes():
+    """
+    Crea los índices de las colecciones email_retries y email_dead_letters (ver api/index_registry.py):
+    un solo reintento por usuario y semana y búsqueda de los reintentos cuyo siguiente intento ya toca.
+    Es idempotente, por lo que se puede ejecutar al inicio de cada envío.
+    """
+    create_registered_indexes(email_retries_collection)
+    create_registered_indexes(email_dead_letters_collection)
+
+
+def compute_retry_delay(attempts: int, retry_after: Optional[float] = None, rng: Optional[random.Random] = None) -> float:
+    """
+    Calcula la espera hasta el siguiente intento con backoff exponencial y jitter: la mitad de
+    la espera es fija y la otra mitad aleatoria, para que los reintentos de un mismo lote fallido
+    no vuelvan a llegar todos a la vez.
+
+    Args:
+        attempts (int): Intentos fallidos hasta el momento (1 tras el primer fallo)
+        retry_after (float, optional): Segundos indicados por el proveedor en Retry-After. Son la espera mínima.
+        rng (random.Random, optional): Generador aleatorio (para pruebas)
+
+    Returns:
+        float: Segundos de espera
+    """
+    delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    delay = delay / 2 + (rng or random).uniform(0, delay / 2)
+    return max(delay, retry_after or 0.0)
+
+
+def schedule_retries(run_week: str, failures: List[Dict[str, Any]], hold_seconds: float) -> Dict[str, int]:
+    """
+    Encola los correos del envío normal que han fallado, o los manda directamente a la cola de
+    perdidos si su error no se puede reintentar.
+
+    Args:
+        run_week (str): Semana del envío
+        failures (list): Un elemento por correo fallido con "user" (con _id y email), "subject",
+            "html", "error", "retryable" y "retry_after" (ver send_batch_emails)
+        hold_seconds (float): Margen tras el siguiente intento durante el que se mantiene
+            reservado al usuario. Si nadie procesa la cola en ese tiempo, el envío normal lo recupera.
+
+    Returns:
+        dict: Número de correos encolados ("queued") y perdidos ("dead")
+    """
+    now = datetime.now(timezone.utc)
+    retries = []
+    dead = []
+    for failure in failures:
+        user = failure["user"]
+        retry = EmailRetry(
+            _id=ObjectId(),
+            run_week=run_week,
+            user_id=user["_id"],
+            email=user["email"],
+            subject=failure["subject"],
+            html=failure["html"],
+            attempts=1,
+            next_attempt_at=now + timedelta(seconds=compute_retry_delay(1, failure.get("retry_after"))),
+            created_at=now,
+            updated_at=now,
+            last_error=failure.get("error"),
+        ).__dict__
+        if failure.get("retryable", True) and EMAIL_RETRY_MAX_ATTEMPTS > 1:
+            retries.append(retry)
+        else:
+            dead.append(retry)
+
+    if retries:
+        email_retries_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"run_week": run_week, "user_id": retry["user_id"]},
+                    {"$setOnInsert": retry},
+                    upsert=True,
+                )
+                for retry in retries
+            ],
+            ordered=False,
+        )
+        hold_users(retries, hold_seconds)
+
+    dead_letter(dead)
+    return {"queued": len(retries), "dead": len(dead)}
+
+
+def hold_users(retries: List[Dict[str, Any]], hold_seconds: float) -> None:
+    """
+    Prolonga la reserva de los usuarios con un reintento pendiente hasta después de su siguiente
+    intento, para que el envío normal no les genere y envíe otro correo mientras tanto.
+    """
+    if not retries:
+        return
+    users_collection.bulk_write(
+        [
+            UpdateOne(
+                {"_id": retry["user_id"]},
+                {"$set": {"send_lease.expires_at": retry["next_attempt_at"] + timedelta(seconds=hold_seconds)}},
+            )
+            for retry in retries
+        ],
+        ordered=False,
+    )
+
+
+def hold_pending_retries(user_ids: Iterable[ObjectId], hold_seconds: float) -> Set[ObjectId]:
+    """
+    Obtiene cuáles de los usuarios indicados tienen un reintento pendiente (de cualquier semana)
+    y vuelve a prolongar su reserva, para que el envío normal los salte aunque la reserva
+    anterior haya caducado. El correo les llegará con el reintento.
+
+    Args:
+        user_ids (iterable): Usuarios recién reservados por el envío normal
+        hold_seconds (float): Ver schedule_retries
+
+    Returns:
+        set: IDs de los usuarios con un reintento pendiente
+    """
+    retries = list(email_retries_collection.find(
+        {"user_id": {"$in": list(user_ids)}}, {"user_id": 1, "next_attempt_at": 1}
+    ))
+    # Si el reintento ya toca, la reserva se cuenta desde ahora
+    now = datetime.now(timezone.utc)
+    for retry in retries:
+        retry["next_attempt_at"] = max(retry["next_attempt_at"].replace(tzinfo=timezone.utc), now)
+    hold_users(retries, hold_seconds)
+    return {retry["user_id"] for retry in retries}
+
+
+def complete_user_retries(run_week: str, user_ids: Iterable[ObjectId]) -> None:
+    """Borra de la cola los reintentos de la semana de los usuarios que ya han recibido el correo."""
+    user_ids = list(user_ids)
+    if user_ids:
+        email_retries_collection.delete_many({"run_week": run_week, "user_id": {"$in": user_ids}})
+
+
+def claim_due_retries(limit: int, lock_seconds: float, due_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Reserva los reintentos cuyo siguiente intento ya toca, igual que claim_pending_users con los
+    usuarios, para que varios procesos puedan vaciar la cola sin enviar dos veces el mismo correo.
+    Los reintentos de usuarios que ya constan como enviados en el registro de la semana
+    (send_ledger) se borran en lugar de devolverse.
+
+    Args:
+        limit (int): Número máximo de reintentos a reservar
+        lock_seconds (float): Duración de la reserva
+        due_before (datetime, optional): Solo se reservan los reintentos que tocaban antes de
+            esta fecha. Por defecto, ahora.
+
+    Returns:
+        list: Reintentos reservados
+    """
+    now = datetime.now(timezone.utc)
+    due = {
+        "next_attempt_at": {"$lte": due_before or now},
+        "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}],
+    }
+    candidate_ids = [retry["_id"] for retry in email_retries_collection.find(due, {"_id": 1}, limit=limit)]
+    if not candidate_ids:
+        return []
+
+    token = ObjectId()
+    email_retries_collection.update_many(
+        {"$and": [due, {"_id": {"$in": candidate_ids}}]},
+        {"$set": {"locked_until": now + timedelta(seconds=lock_seconds), "lock_token": token}},
+    )
+    retries = list(email_retries_collection.find({"lock_token": token}))
+
+    sent = set()
+    for run_week in {retry["run_week"] for retry in retries}:
+        week_sent = get_sent_user_ids(run_week, [r["user_id"] for r in retries if r["run_week"] == run_week])
+        sent.update((run_week, user_id) for user_id in week_sent)
+    if sent:
+        complete_retries([retry for retry in retries if (retry["run_week"], retry["user_id"]) in sent])
+    return [retry for retry in retries if (retry["run_week"], retry["user_id"]) not in sent]
+
+
+def complete_retries(retries: List[Dict[str, Any]]) -> None:
+    """Borra de la cola los reintentos enviados correctamente."""
+    if retries:
+        email_retries_collection.delete_many({"_id": {"$in": [retry["_id"] for retry in retries]}})
+
+
+def reschedule_retries(failures: List[Dict[str, Any]], hold_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Registra un intento fallido de cada reintento: lo vuelve a planificar con una espera mayor o,
+    si ha agotado los intentos o el error no se puede reintentar, lo pasa a la cola de perdidos.
+
+    Args:
+        failures (list): Un elemento por reintento fallido con "retry" (el documento de la cola),
+            "error", "retryable" y "retry_after"
+        hold_seconds (float): Ver schedule_retries
+
+    Returns:
+        list: Reintentos que se han dado por perdidos
+    """
+    now = datetime.now(timezone.utc)
+    operations = []
+    rescheduled = []
+    dead = []
+    for failure in failures:
+        retry = dict(failure["retry"])
+        retry["attempts"] += 1
+        retry["last_error"] = failure.get("error")
+        retry["updated_at"] = now
+        if not failure.get("retryable", True) or retry["attempts"] >= EMAIL_RETRY_MAX_ATTEMPTS:
+            dead.append(retry)
+            continue
+
+        retry["next_attempt_at"] = now + timedelta(
+            seconds=compute_retry_delay(retry["attempts"], failure.get("retry_after"))
+        )
+        rescheduled.append(retry)
+        operations.append(UpdateOne(
+            {"_id": retry["_id"]},
+            {
+                "$set": {
+                    "attempts": retry["attempts"],
+                    "last_error": retry["last_error"],
+                    "next_attempt_at": retry["next_attempt_at"],
+                    "updated_at": now,
+                    "locked_until": None,
+                }
+            },
+        ))
+
+    if operations:
+        email_retries_collection.bulk_write(operations, ordered=False)
+    hold_users(rescheduled, hold_seconds)
+    dead_letter(dead)
+    return dead
+
+
+def dead_letter(retries: List[Dict[str, Any]]) -> None:
+    """
+    Pasa los correos a la cola de perdidos, los quita de la cola de reintentos y libera a sus
+    usuarios, planificando su próximo envío para la semana siguiente.
+    """
+    if not retries:
+        return
+
+    now = datetime.now(timezone.utc)
+    dead_letters = []
+    for retry in retries:
+        dead_letters.append(InsertOne(EmailDeadLetter(
+            _id=ObjectId(),
+            run_week=retry["run_week"],
+            user_id=retry["user_id"],
+            email=retry["email"],
+            subject=retry["subject"],
+            html=retry["html"],
+            attempts=retry["attempts"],
+            first_failed_at=retry["created_at"],
+            created_at=now,
+            last_error=retry.get("last_error"),
+        ).__dict__))
+    email_dead_letters_collection.bulk_write(dead_letters, ordered=False)
+
+    email_retries_collection.bulk_write(
+        [DeleteOne({"run_week": retry["run_week"], "user_id": retry["user_id"]}) for retry in retries],
+        ordered=False,
+    )
+
+    users_collection.bulk_write(
+        [
+            UpdateOne(
+                {"_id": retry["user_id"]},
+                {"$set": {"next_send_at": compute_next_send_at(retry["user_id"], now)}, "$unset": {"send_lease": ""}},
+            )
+            for retry in retries
+        ],
+        ordered=False,
+    )
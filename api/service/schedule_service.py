@@ -0,0 +1,182 @@
+"""
+Planificación escalonada del correo semanal.
+
+Cada usuario tiene un campo `next_send_at` indexado con la fecha de su próximo envío. La hora
+del día de ese envío es fija para cada usuario (se deriva de su _id), de forma que la carga se
+reparte a lo largo de todo el día en lugar de concentrarse en una sola ejecución del cron.
+
+Dentro de una franja, los usuarios se procesan por prioridad: primero el plan (`send_priority`),
+después los que fallaron en envíos anteriores (`send_failures`) y por último los más atrasados
+(`next_send_at`, que se calcula a partir de `last_email_sent`). Así, si una ejecución se corta
+por tiempo o por cuota, los envíos que quedan pendientes son los menos importantes.
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from api.database import users_collection
+from api.index_registry import create_registered_indexes
+
+# EMAIL_SEND_INTERVAL_DAYS: días entre dos correos semanales de un mismo usuario
+EMAIL_SEND_INTERVAL_DAYS = int(os.environ.get("EMAIL_SEND_INTERVAL_DAYS", "7"))
+# EMAIL_SCHEDULE_SLICE_MINUTES: duración de cada franja del planificador. Debe coincidir con
+# la frecuencia del cron, que en cada ejecución envía los correos de su franja
+EMAIL_SCHEDULE_SLICE_MINUTES = int(os.environ.get("EMAIL_SCHEDULE_SLICE_MINUTES", "60"))
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Prioridad de envío de cada rol. Los de mayor prioridad se procesan antes dentro de cada franja
+SEND_PRIORITY_BY_ROLE = {"paid": 2, "admin": 1, "free": 0}
+
+# Orden de procesamiento de los usuarios pendientes, servido por el índice de prioridad
+DUE_SORT = [("send_priority", DESCENDING), ("send_failures", DESCENDING), ("next_send_at", ASCENDING)]
+
+
+def create_schedule_indexes():
+    """
+    Crea los índices registrados de la colección users, entre ellos los de la planificación de
+    envíos: igualdad sobre account_status, orden por prioridad (DUE_SORT) y rango sobre next_send_at.
+    Es idempotente, por lo que se puede ejecutar al inicio de cada envío.
+    """
+    create_registered_indexes(users_collection)
+
+
+def get_send_priority(role: Optional[str]) -> int:
+    """Obtiene la prioridad de envío de un usuario según su rol."""
+    return SEND_PRIORITY_BY_ROLE.get(role or "free", 0)
+
+
+def get_send_slot(user_id: ObjectId) -> timedelta:
+    """
+    Obtiene la hora del día (desde las 00:00 UTC) a la que se envía el correo del usuario.
+    Es estable para cada usuario y está repartida de forma uniforme entre todos ellos.
+    """
+    digest = hashlib.md5(str(user_id).encode()).hexdigest()
+    return timedelta(seconds=int(digest, 16) % SECONDS_PER_DAY)
+
+
+def compute_next_send_at(user_id: ObjectId, sent_at: Optional[datetime] = None, interval_days: Optional[int] = None) -> datetime:
+    """
+    Calcula la fecha del próximo envío: `interval_days` días después del día de `sent_at`,
+    a la hora asignada al usuario.
+
+    Args:
+        user_id (ObjectId): ID del usuario
+        sent_at (datetime, optional): Fecha del último envío. Por defecto la actual en UTC.
+        interval_days (int, optional): Días entre envíos. Defaults to EMAIL_SEND_INTERVAL_DAYS.
+
+    Returns:
+        datetime: Fecha del próximo envío en UTC
+    """
+    sent_at = sent_at or datetime.now(timezone.utc)
+    if sent_at.tzinfo is None:
+        sent_at = sent_at.replace(tzinfo=timezone.utc)
+    day = sent_at.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    days = EMAIL_SEND_INTERVAL_DAYS if interval_days is None else interval_days
+    return day + timedelta(days=days) + get_send_slot(user_id)
+
+
+def get_slice_end(now: Optional[datetime] = None, slice_minutes: Optional[int] = None) -> datetime:
+    """
+    Obtiene el final de la franja del planificador que contiene `now`.
+
+    Returns:
+        datetime: Primer instante de la franja siguiente
+    """
+    now = now or datetime.now(timezone.utc)
+    slice_seconds = (slice_minutes or EMAIL_SCHEDULE_SLICE_MINUTES) * 60
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = int((now - day).total_seconds())
+    return day + timedelta(seconds=(elapsed // slice_seconds + 1) * slice_seconds)
+
+
+def get_due_query(slice_end: datetime) -> dict:
+    """
+    Consulta de usuarios activos cuyo envío toca antes del final de la franja.
+    Incluye a los atrasados de franjas anteriores (por ejemplo, si falló un envío).
+    """
+    return {"account_status": "active", "next_send_at": {"$lt": slice_end}}
+
+
+def build_sent_update(user_id: ObjectId, sent_at: datetime, interval_days: Optional[int] = None) -> UpdateOne:
+    """
+    Construye la actualización de un usuario tras enviarle el correo: guarda la fecha del envío,
+    planifica el siguiente, reinicia sus fallos y libera su reserva.
+    """
+    return UpdateOne(
+        {"_id": user_id},
+        {
+            "$set": {
+                "last_email_sent": sent_at,
+                "next_send_at": compute_next_send_at(user_id, sent_at, interval_days),
+                "send_failures": 0,
+            },
+            "$unset": {"send_lease": ""},
+        },
+    )
+
+
+def record_send_failures(user_ids: Iterable[ObjectId]) -> None:
+    """
+    Suma un fallo de envío a cada usuario, para que tenga más prioridad en los siguientes
+    envíos. El contador se reinicia con el primer envío correcto.
+    """
+    user_ids = list(user_ids)
+    if user_ids:
+        users_collection.update_many({"_id": {"$in": user_ids}}, {"$inc": {"send_failures": 1}})
+
+
+def backfill_send_priority() -> int:
+    """
+    Asigna `send_priority` y `send_failures` a los usuarios creados antes de que existieran
+    los campos. Solo procesa a los usuarios sin ellos, por lo que tras la primera vez no hace nada.
+    Las consultas no tienen índice, así que solo se ejecuta desde `python maintenance.py migrate`;
+    después, `send_priority` se actualiza con cada cambio de rol.
+
+    Returns:
+        int: Número de usuarios actualizados
+    """
+    updated = 0
+    for role, priority in SEND_PRIORITY_BY_ROLE.items():
+        updated += users_collection.update_many(
+            {"send_priority": {"$exists": False}, "role": role}, {"$set": {"send_priority": priority}}
+        ).modified_count
+    updated += users_collection.update_many(
+        {"send_priority": {"$exists": False}}, {"$set": {"send_priority": get_send_priority(None)}}
+    ).modified_count
+    users_collection.update_many({"send_failures": {"$exists": False}}, {"$set": {"send_failures": 0}})
+    return updated
+
+
+def backfill_next_send_at(batch_size: int = 500) -> int:
+    """
+    Asigna `next_send_at` a los usuarios creados antes de que existiera el campo, a partir de
+    su `last_email_sent`. Los que nunca han recibido un correo quedan pendientes desde ya.
+    Solo procesa a los usuarios sin el campo, por lo que tras la primera vez no hace nada.
+    La consulta no tiene índice, así que solo se ejecuta desde `python maintenance.py migrate`.
+
+    Returns:
+        int: Número de usuarios actualizados
+    """
+    now = datetime.now(timezone.utc)
+    cursor = users_collection.find(
+        {"next_send_at": {"$exists": False}}, {"_id": 1, "last_email_sent": 1}, batch_size=batch_size
+    )
+
+    updated = 0
+    operations = []
+    for user in cursor:
+        last_sent = user.get("last_email_sent")
+        next_send_at = compute_next_send_at(user["_id"], last_sent) if last_sent else now
+        operations.append(UpdateOne({"_id": user["_id"]}, {"$set": {"next_send_at": next_send_at}}))
+        if len(operations) >= batch_size:
+            updated += users_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += users_collection.bulk_write(operations, ordered=False).modified_count
+
+    return updated
@@ -0,0 +1,173 @@
+"""
+Registro del estado del envío semanal por usuario y semana.
+
+Guarda en `send_ledger` en qué estado está cada usuario (queued, generated, sent, failed)
+y en `send_runs` el contenido generado para cada cohorte, de forma que una ejecución
+reiniciada se salta a los usuarios ya enviados y reutiliza el contenido ya generado.
+"""
+import hashlib
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from api.database import db
+from api.index_registry import create_registered_indexes
+from models.send_ledger import SendLedgerEntry
+
+# Colecciones del registro de envíos
+send_runs_collection = db["send_runs"]
+send_ledger_collection = db["send_ledger"]
+
+
+def create_send_ledger_indexes():
+    """
+    Crea los índices de la colección send_ledger (ver api/index_registry.py): una sola entrada
+    por usuario y semana y usuarios por estado dentro de una semana.
+    Es idempotente, por lo que se puede ejecutar al inicio de cada envío.
+    """
+    create_registered_indexes(send_ledger_collection)
+
+
+def get_run_week(now: Optional[datetime] = None) -> str:
+    """
+    Obtiene el identificador de la semana ISO del envío, por ejemplo 2025-W17.
+
+    Args:
+        now (datetime, optional): Fecha de referencia. Por defecto la actual en UTC.
+
+    Returns:
+        str: Identificador de la semana
+    """
+    year, week, _ = (now or datetime.now(timezone.utc)).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def start_run(run_week: str) -> None:
+    """
+    Registra el inicio (o la reanudación) de la ejecución de una semana.
+
+    Args:
+        run_week (str): Semana del envío
+    """
+    now = datetime.now(timezone.utc)
+    send_runs_collection.update_one(
+        {"_id": run_week},
+        {
+            "$setOnInsert": {"started_at": now, "digests": {}},
+            "$set": {"updated_at": now},
+            "$inc": {"attempts": 1},
+        },
+        upsert=True,
+    )
+
+
+def get_run_digest(run_week: str, cohort_id: str) -> Optional[Dict]:
+    """
+    Recupera el contenido ya generado para una cohorte en la semana indicada.
+
+    Returns:
+        dict | None: Documento con "body" y "content_hash", o None si no existe
+    """
+    run = send_runs_collection.find_one(
+        {"_id": run_week, f"digests.{cohort_id}": {"$exists": True}},
+        {f"digests.{cohort_id}": 1},
+    )
+    return run["digests"][cohort_id] if run else None
+
+
+def save_run_digest(run_week: str, cohort_id: str, body: str) -> str:
+    """
+    Guarda el contenido generado para una cohorte para poder reutilizarlo si se reanuda la ejecución.
+
+    Returns:
+        str: Hash del contenido guardado
+    """
+    content_hash = hashlib.sha256(body.encode()).hexdigest()
+    send_runs_collection.update_one(
+        {"_id": run_week},
+        {
+            "$set": {
+                f"digests.{cohort_id}": {
+                    "body": body,
+                    "content_hash": content_hash,
+                    "generated_at": datetime.now(timezone.utc),
+                }
+            }
+        },
+        upsert=True,
+    )
+    return content_hash
+
+
+def get_sent_user_ids(run_week: str, user_ids: Iterable[ObjectId]) -> Set[ObjectId]:
+    """
+    Obtiene cuáles de los usuarios indicados ya han recibido el correo de la semana.
+
+    Returns:
+        set: IDs de los usuarios en estado "sent"
+    """
+    cursor = send_ledger_collection.find(
+        {"run_week": run_week, "user_id": {"$in": list(user_ids)}, "state": "sent"},
+        {"user_id": 1},
+    )
+    return {entry["user_id"] for entry in cursor}
+
+
+def mark_users(run_week: str, users: List[dict], state: str, cohort_id: Optional[str] = None, errors: Optional[Dict] = None) -> None:
+    """
+    Actualiza el estado de varios usuarios en una sola escritura.
+
+    Los usuarios que ya estaban en estado "sent" no se modifican, para que una
+    ejecución reanudada no pueda deshacer un envío confirmado.
+
+    Args:
+        run_week (str): Semana del envío
+        users (list): Usuarios a actualizar
+        state (str): Nuevo estado ("queued", "generated", "sent" o "failed")
+        cohort_id (str, optional): Cohorte de los usuarios
+        errors (dict, optional): Error de envío por ID de usuario
+    """
+    if not users:
+        return
+
+    now = datetime.now(timezone.utc)
+    errors = errors or {}
+    operations = []
+    for user in users:
+        entry = SendLedgerEntry(
+            _id=ObjectId(),
+            run_week=run_week,
+            user_id=user["_id"],
+            email=user["email"],
+            state=state,
+            created_at=now,
+            updated_at=now,
+            cohort_id=cohort_id,
+            error=errors.get(user["_id"]),
+        ).__dict__
+
+        # Campos que se actualizan siempre; el resto solo al crear la entrada
+        changes = {"state": state, "updated_at": now, "error": entry["error"]}
+        if cohort_id is not None:
+            changes["cohort_id"] = cohort_id
+        on_insert = {k: v for k, v in entry.items() if k not in changes and k not in ("run_week", "user_id")}
+
+        operations.append(UpdateOne(
+            {"run_week": run_week, "user_id": user["_id"], "state": {"$ne": "sent"}},
+            {"$set": changes, "$setOnInsert": on_insert},
+            upsert=True,
+        ))
+
+    try:
+        send_ledger_collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Un usuario ya enviado provoca un conflicto de clave única al intentar el upsert,
+        # que es justo lo que se busca: su estado no cambia
+        other_errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+        if other_errors:
+            print(f"Error actualizando el registro de envíos ({state}): {other_errors[0].get('errmsg')}")
+    except Exception as e:
+        print(f"Error actualizando el registro de envíos ({state}): {str(e)}")
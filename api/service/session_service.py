@@ -4,6 +4,7 @@ from bson import ObjectId
 import secrets
 from models.session import Session
 from api.database import db
+from api.index_registry import create_registered_indexes
 from api.utils import session_to_dict
 
 # Colección para las sesiones
@@ -12,17 +13,11 @@ sessions_collection = db["sessions"]
 # Crear índice TTL (Time To Live) para la expiración automática de sesiones
 def create_session_indexes():
     """
-    Crea un índice TTL en la colección de sesiones para la expiración automática.
+    Crea los índices registrados de la colección de sesiones (ver api/index_registry.py): un índice
+    TTL en expires_at para la expiración automática y búsquedas rápidas por token y por user_id.
     Debe ejecutarse una sola vez durante la inicialización de la aplicación.
     """
-    # Este índice eliminará automáticamente los documentos cuando expires_at sea alcanzado
-    sessions_collection.create_index("expires_at", expireAfterSeconds=0)
-    
-    # Índice para búsqueda rápida por token
-    sessions_collection.create_index("token", unique=True)
-    
-    # Índice para búsqueda rápida por user_id
-    sessions_collection.create_index("user_id")
+    create_registered_indexes(sessions_collection)
 
 def create_session(user_id, session_duration_minutes=300):
     """
@@ -6,6 +6,8 @@ from bson import ObjectId
 from api.database import users_collection
 from api.database import db
 from models.stripe_customer import StripeCustomer
+from api.rate_limiter import RateLimiter
+from api.service.schedule_service import get_send_priority
 
 # Initialize Stripe with your API keys
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
@@ -24,7 +26,9 @@ def get_subscription_prices() -> Dict[str, Optional[Dict[str, Any]]]:
     if MONTHLY_PRODUCT_ID is None or YEARLY_PRODUCT_ID is None:
         raise ValueError("Stripe product IDs are not set in environment variables.")
     # Fetch prices for our products
+    RateLimiter.acquire("stripe")
     monthly_prices = stripe.Price.list(product=MONTHLY_PRODUCT_ID)
+    RateLimiter.acquire("stripe")
     yearly_prices = stripe.Price.list(product=YEARLY_PRODUCT_ID)
     
     prices: Dict[str, Optional[Dict[str, Any]]] = {
@@ -56,6 +60,7 @@ def get_subscription_prices() -> Dict[str, Optional[Dict[str, Any]]]:
 def create_stripe_customer(user_id: ObjectId, email: str, name: str) -> str:
     """Create a new customer in Stripe and return the customer ID."""
     try:
+        RateLimiter.acquire("stripe")
         customer = stripe.Customer.create(
             email=email,
             name=name,
@@ -107,6 +112,7 @@ def create_checkout_session(user_id: ObjectId, price_id: str, success_url: str,
         
     # Create checkout session
     try:
+        RateLimiter.acquire("stripe")
         session = stripe.checkout.Session.create(
             customer=customer_id,
             payment_method_types=['card', 'paypal', 'revolut_pay', 'link', 'amazon_pay'],
@@ -147,6 +153,7 @@ def setup_custom_branding():
     """
     try:
         # Crea la configuración personalizada para el portal de facturación
+        RateLimiter.acquire("stripe")
         configuration = stripe.billing_portal.Configuration.create(
             business_profile={
                 "headline": "UpdateMe - Gestiona tu suscripción",
@@ -185,6 +192,7 @@ def create_portal_session(customer_id: str, return_url: str) -> str:
             session_params["configuration"] = configuration_id
             
         # Create billing portal session with explicit keyword args to satisfy type checker
+        RateLimiter.acquire("stripe")
         if "configuration" in session_params:
             session = stripe.billing_portal.Session.create(
                 customer=session_params["customer"],
@@ -212,6 +220,7 @@ def handle_checkout_session_completed(event_data):
         stripe_customers.update_one({'user_id': user_id}, {'$setOnInsert': {'stripe_customer_id': session.customer}}, upsert=True)
         # --- CORRECCIÓN: obtener SIEMPRE el id de la suscripción como string ---
         sub_id = session.subscription.id if hasattr(session.subscription, 'id') else session.subscription
+        RateLimiter.acquire("stripe")
         sub = stripe.Subscription.retrieve(sub_id, expand=['items.data', 'default_payment_method'])
         # Billing info
         items = sub.items.data if hasattr(sub, 'items') and sub.items and hasattr(sub.items, 'data') else []
@@ -236,7 +245,10 @@ def handle_checkout_session_completed(event_data):
         }
         sub_mongo = subscriptions_collection.insert_one(sub_doc).inserted_id
         # Update user role and subscription ref
-        users_collection.update_one({'_id': user_id}, {'$set': {'role': 'paid', 'subscription': sub_mongo}})
+        users_collection.update_one(
+            {'_id': user_id},
+            {'$set': {'role': 'paid', 'send_priority': get_send_priority('paid'), 'subscription': sub_mongo}}
+        )
         # Update customer record
         stripe_customers.update_one({'user_id': user_id}, {'$set': {'stripe_subscription_id': sub.id, 'default_payment_method': dpm_id}})
         # Record transaction
@@ -320,7 +332,7 @@ def handle_subscription_deleted(event_data):
     # Update user role back to free
     users_collection.update_one(
         {'_id': user_id},
-        {'$set': {'role': 'free'}}
+        {'$set': {'role': 'free', 'send_priority': get_send_priority('free')}}
     )
     
     # Remove subscription_id from stripe_customer
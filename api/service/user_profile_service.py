@@ -4,7 +4,7 @@ import resend
 from flask import jsonify, session
 from flask_babel import gettext as _
 from api.database import users_collection, db
-from api.utils import is_valid_email
+from api.utils import get_email_query, is_valid_email, normalize_email
 from api.service.session_service import invalidate_all_user_sessions
 
 def update_user_profile(user_id, username, email, language='es'):
@@ -35,7 +35,7 @@ def update_user_profile(user_id, username, email, language='es'):
         }), 400
     
     # Verificar si el correo electrónico ya existe para otro usuario
-    existing_user = users_collection.find_one({'email': email, '_id': {'$ne': user_id}})
+    existing_user = users_collection.find_one({**get_email_query(email), '_id': {'$ne': user_id}})
     if existing_user:
         return jsonify({
             'success': False,
@@ -49,6 +49,7 @@ def update_user_profile(user_id, username, email, language='es'):
             {'$set': {
                 'username': username,
                 'email': email,
+                'email_lower': normalize_email(email),
                 'language': language
             }}
         )
@@ -1,12 +1,15 @@
 from flask import session, g, jsonify
 from bson import ObjectId
 from datetime import datetime, timezone
+from pymongo import UpdateOne
 import re
 import bcrypt
 from flask_babel import gettext as _
 from api.database import users_collection, db
-from api.utils import is_valid_email
+from api.index_registry import create_registered_indexes
+from api.utils import get_email_query, is_valid_email, normalize_email
 from api.services import send_email, generate_news_summary, send_welcome_email
+from api.service.schedule_service import compute_next_send_at, get_send_priority
 from models.user import User
 from models.prompts import Prompts
 from api.serviceAi.prompts import get_news_summary_prompt, get_web_search_prompt, get_default_search_configs
@@ -22,7 +25,64 @@ def validate_email(email):
 
 def check_existing_email(email):
     """Verificar si un correo ya existe en la base de datos"""
-    return users_collection.find_one({"email": email})
+    return users_collection.find_one(get_email_query(email))
+
+def backfill_email_lower(collection=None, batch_size=500):
+    """
+    Migración que asigna `email_lower` a los usuarios creados antes de que existiera el campo.
+    Solo procesa a los usuarios sin él, por lo que tras la primera vez no hace nada.
+
+    Args:
+        collection: Colección de usuarios. Por defecto la de la aplicación
+        batch_size: Usuarios por escritura en bloque
+
+    Returns:
+        int: Número de usuarios actualizados
+    """
+    collection = users_collection if collection is None else collection
+    cursor = collection.find({"email_lower": {"$exists": False}}, {"_id": 1, "email": 1}, batch_size=batch_size)
+
+    updated = 0
+    operations = []
+    for user in cursor:
+        operations.append(UpdateOne({"_id": user["_id"]}, {"$set": {"email_lower": normalize_email(user.get("email"))}}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+
+    return updated
+
+def create_unique_email_index(collection=None):
+    """
+    Migración que convierte el índice de `email_lower` en único. Se ejecuta después de
+    backfill_email_lower. Si hay cuentas con el mismo email normalizado no se crea el índice;
+    hay que fusionarlas o borrarlas a mano y volver a ejecutar la migración.
+
+    Args:
+        collection: Colección de usuarios. Por defecto la de la aplicación
+
+    Returns:
+        list: Emails normalizados con más de una cuenta (vacía si se ha creado el índice)
+    """
+    collection = users_collection if collection is None else collection
+    duplicates = [
+        group["_id"] for group in collection.aggregate([
+            {"$match": {"email_lower": {"$type": "string"}}},
+            {"$group": {"_id": "$email_lower", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ])
+    ]
+    if duplicates:
+        return duplicates
+
+    # El índice anterior tiene las mismas claves, así que hay que borrarlo antes de crear el nuevo
+    current = collection.index_information().get("email_lower_1")
+    if current is not None and not current.get("unique"):
+        collection.drop_index("email_lower_1")
+    create_registered_indexes(collection)
+    return []
 
 def validate_password(password):
     """Validar que la contraseña cumpla con los requisitos de seguridad"""
@@ -95,11 +155,13 @@ def create_user_document(email, username=None, password=None):
     # Cuando se crea un usuario nuevo, establecemos la fecha actual como último envío
     # para que se le envíe el primer resumen regular después de una semana
     current_time = datetime.now(timezone.utc)
+    user_id = ObjectId()
     
     return User(
-        _id=ObjectId(),
+        _id=user_id,
         username=username,
         email=email,
+        email_lower=normalize_email(email),
         password=hashed_password,
         created_at=current_time,
         role="free",
@@ -113,7 +175,9 @@ def create_user_document(email, username=None, password=None):
         subscription=None,
         payment_methods=[],
         prompts=prompts_id,
-        last_email_sent=current_time
+        last_email_sent=current_time,
+        next_send_at=compute_next_send_at(user_id, current_time),
+        send_priority=get_send_priority("free")
     ).__dict__
 
 def create_prompts_document(user_id, prompts_id, language="es"):
@@ -222,12 +286,13 @@ def update_existing_user(user, username, password):
         current_language = get_current_language()
         
         users_collection.update_one(
-            {"email": user["email"]},
+            {"_id": user["_id"]},
             {
                 "$set": {
                     "username": username,
                     "password": hashed_password,
                     "role": user.get("role", "free"),
+                    "send_priority": get_send_priority(user.get("role", "free")),
                     "email_verified": user.get("email_verified", False),
                     "account_status": "active",
                     "language": current_language
@@ -2,7 +2,7 @@
 Módulo base que define las interfaces abstractas para los servicios de IA.
 """
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 
 class AIProvider(ABC):
@@ -36,12 +36,13 @@ class AIProvider(ABC):
         pass
     
     @abstractmethod
-    def search_web(self, query: str) -> Dict[str, Any]:
+    def search_web(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
         """
         Realiza una búsqueda web para obtener información actualizada.
         
         Args:
             query: La consulta de búsqueda
+            search_provider_type: Tipo de búsqueda a usar en esta llamada (opcional)
             
         Returns:
             Resultados de la búsqueda en formato de diccionario
@@ -60,6 +61,34 @@ class AIProvider(ABC):
             El resumen de noticias formateado como un email
         """
         pass
+    
+    @abstractmethod
+    async def generate_content_async(self, prompt: str, **kwargs) -> str:
+        """
+        Versión asíncrona de generate_content, para usarla desde asyncio.
+        """
+        pass
+    
+    @abstractmethod
+    async def search_web_async(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de search_web, para usarla desde asyncio.
+        
+        Args:
+            query: La consulta de búsqueda
+            search_provider_type: Tipo de búsqueda a usar en esta llamada (opcional)
+            
+        Returns:
+            Resultados de la búsqueda en formato de diccionario
+        """
+        pass
+    
+    @abstractmethod
+    async def generate_news_summary_async(self, email: str) -> str:
+        """
+        Versión asíncrona de generate_news_summary, para usarla desde asyncio.
+        """
+        pass
 
 
 class WebSearchProvider(ABC):
@@ -2,21 +2,29 @@
 Implementación base para proveedores de IA.
 Contiene código común a todos los proveedores para evitar duplicación.
 """
+import asyncio
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from abc import abstractmethod
-from bson.regex import Regex
 
 from .base import AIProvider
+from .serpapi_provider import SerpAPIProvider
+from .talivy_provider import TavilyProvider
 from .prompts import get_news_summary_prompt, get_email_template, get_fallback_content
 from ..database import db
+from ..utils import get_email_query
 from ..cache_manager import CacheManager
+from ..rate_limiter import RateLimiter, estimate_tokens
+from ..metrics import metrics
 
 
 class BaseAIProvider(AIProvider):
     """
     Clase base que implementa funcionalidad común para todos los proveedores de IA.
     """
+
+    provider_name = "generic"
+    """Nombre del proveedor, usado para aplicar su límite de peticiones."""
     
     def __init__(self, api_key: str, **kwargs):
         """
@@ -40,6 +48,104 @@ class BaseAIProvider(AIProvider):
         self.tavily_topic = kwargs.get("tavily_topic", "news")
         self.tavily_time_range = kwargs.get("tavily_time_range", "week")
         self.tavily_include_raw_content = kwargs.get("tavily_include_raw_content", True)
+
+        # Proveedores de búsqueda ya creados, por tipo
+        self._search_providers: Dict[str, Any] = {}
+    
+    def _get_search_provider(self, search_provider_type: str):
+        """
+        Obtiene el proveedor de búsqueda del tipo indicado, creándolo la primera vez.
+        
+        Args:
+            search_provider_type: Tipo de proveedor ('tavily' o 'serpapi')
+            
+        Returns:
+            El proveedor de búsqueda o None si no hay clave API para ese tipo
+        """
+        provider = self._search_providers.get(search_provider_type)
+        if provider is None:
+            if search_provider_type == "tavily" and self.tavily_key:
+                provider = TavilyProvider(
+                    self.tavily_key,
+                    search_depth=self.tavily_search_depth,
+                    topic=self.tavily_topic,
+                    time_range=self.tavily_time_range,
+                    include_raw_content=self.tavily_include_raw_content
+                )
+            elif search_provider_type == "serpapi" and self.serpapi_key:
+                provider = SerpAPIProvider(self.serpapi_key)
+            else:
+                return None
+            self._search_providers[search_provider_type] = provider
+        return provider
+    
+    async def aclose(self) -> None:
+        """Cierra los clientes HTTP asíncronos de los proveedores de búsqueda ya creados."""
+        for provider in self._search_providers.values():
+            aclose = getattr(provider, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    
+    def _resolve_search_provider_type(self, search_provider_pref: str) -> str:
+        """
+        Devuelve el tipo de búsqueda preferido si hay clave API para él, o el configurado por defecto.
+        """
+        if search_provider_pref == "tavily" and self.tavily_key:
+            return "tavily"
+        if search_provider_pref == "serpapi" and self.serpapi_key:
+            return "serpapi"
+        return self.search_provider_type
+    
+    def _create_chat_completion(self, metrics_stage: str = "llm", **kwargs):
+        """
+        Llama a la API de chat del proveedor respetando su límite de peticiones y tokens
+        y su límite adaptativo de peticiones en vuelo.
+        
+        Args:
+            metrics_stage: Etapa en la que se registra la duración de la llamada
+                ('keywords', 'summarize', 'search'...)
+            kwargs: Parámetros de `chat.completions.create`
+            
+        Returns:
+            La respuesta de la API
+        """
+        estimated_tokens = estimate_tokens(kwargs.get("messages", []))
+        RateLimiter.acquire(self.provider_name, estimated_tokens)
+        
+        with RateLimiter.slot(self.provider_name):
+            with metrics.time(metrics_stage), metrics.provider_call(self.provider_name):
+                response = self.client.chat.completions.create(**kwargs)
+        
+        # Corregir la estimación con el consumo real si el proveedor lo informa
+        usage = getattr(response, "usage", None)
+        if usage and getattr(usage, "total_tokens", None):
+            RateLimiter.record_usage(self.provider_name, usage.total_tokens - estimated_tokens)
+        
+        return response
+    
+    async def _create_chat_completion_async(self, metrics_stage: str = "llm", **kwargs):
+        """
+        Versión asíncrona de _create_chat_completion, usando el cliente `AsyncOpenAI` del proveedor.
+        
+        Args:
+            metrics_stage: Etapa en la que se registra la duración de la llamada
+            kwargs: Parámetros de `chat.completions.create`
+            
+        Returns:
+            La respuesta de la API
+        """
+        estimated_tokens = estimate_tokens(kwargs.get("messages", []))
+        await RateLimiter.acquire_async(self.provider_name, estimated_tokens)
+        
+        async with RateLimiter.slot_async(self.provider_name):
+            with metrics.time(metrics_stage), metrics.provider_call(self.provider_name):
+                response = await self.async_client.chat.completions.create(**kwargs)
+        
+        usage = getattr(response, "usage", None)
+        if usage and getattr(usage, "total_tokens", None):
+            RateLimiter.record_usage(self.provider_name, usage.total_tokens - estimated_tokens)
+        
+        return response
     
     @abstractmethod
     def generate_content(self, prompt: str, **kwargs) -> str:
@@ -49,12 +155,118 @@ class BaseAIProvider(AIProvider):
         pass
     
     @abstractmethod
-    def search_web(self, query: str) -> Dict[str, Any]:
+    def search_web(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Método abstracto que debe ser implementado por cada proveedor.
+        
+        El tipo de búsqueda se recibe como parámetro en lugar de cambiar el estado de la
+        instancia, ya que la comparten los hilos del envío semanal.
+        """
+        pass
+    
+    @abstractmethod
+    async def search_web_async(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
         """
         Método abstracto que debe ser implementado por cada proveedor.
+        
+        A diferencia de search_web, el tipo de búsqueda se recibe como parámetro en lugar de
+        cambiar el estado de la instancia, ya que varias corrutinas la usan a la vez.
         """
         pass
     
+    async def generate_content_async(self, prompt: str, **kwargs) -> str:
+        """
+        Versión asíncrona de generate_content. Usa la misma caché que la versión síncrona.
+        
+        Args:
+            prompt: El prompt para generar contenido
+            kwargs: Parámetros adicionales como temperatura y system_content
+            
+        Returns:
+            El contenido generado como string
+        """
+        provider_type = f"{self.provider_name}_content"
+        try:
+            temperature = kwargs.get("temperature", 0.7)
+            system_content = kwargs.get("system_content", "")
+
+            # Verificar caché
+            cache_params = {"system_content": system_content, "temperature": temperature}
+            cache_key = CacheManager.generate_cache_key(prompt, provider_type, cache_params)
+            cached_content = await asyncio.to_thread(CacheManager.get_from_cache, cache_key)
+
+            if cached_content:
+                print("Contenido recuperado de caché para prompt similar")
+                return str(cached_content)
+
+            async def generate() -> str:
+                messages = []
+                if system_content:
+                    messages.append({"role": "system", "content": system_content})
+
+                messages.append({"role": "user", "content": prompt})
+
+                response = await self._create_chat_completion_async(
+                    metrics_stage="summarize", model=self.model, messages=messages, temperature=temperature
+                )
+
+                content = response.choices[0].message.content
+                result = content if content is not None else ""
+
+                # Guardar en caché
+                await asyncio.to_thread(
+                    CacheManager.save_to_cache,
+                    cache_key=cache_key,
+                    response=result,
+                    provider_type=provider_type,
+                    query=prompt,
+                )
+
+                return result
+
+            # Si otra corrutina ya está generando el mismo contenido, esperar su resultado
+            return str(await CacheManager.single_flight_async(cache_key, generate))
+        except Exception as e:
+            print(f"Error generando contenido con {self.provider_name}: {str(e)}")
+            return f"Error: {str(e)}"
+    
+    async def _search_with_cache_async(self, search_provider, keyword: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Busca una keyword con el proveedor de búsqueda indicado, usando la caché compartida
+        con la versión síncrona.
+        
+        Returns:
+            Resultados de la búsqueda (o un diccionario con "error")
+        """
+        provider_cache_type = "tavily_search" if isinstance(search_provider, TavilyProvider) else "serpapi_search"
+        keyword_cache_key = CacheManager.generate_cache_key(keyword, provider_cache_type)
+        cached_search = await asyncio.to_thread(CacheManager.get_from_cache, keyword_cache_key)
+        if cached_search:
+            print(f"Resultado de búsqueda recuperado de caché para keyword: {keyword}")
+            return cached_search
+
+        async def search() -> Dict[str, Any]:
+            search_results = await search_provider.search_async(keyword, user_config)
+            if search_results and "error" not in search_results:
+                await asyncio.to_thread(
+                    CacheManager.save_to_cache,
+                    cache_key=keyword_cache_key,
+                    response=search_results,
+                    provider_type=provider_cache_type,
+                    query=keyword,
+                )
+            return search_results
+
+        return await CacheManager.single_flight_async(keyword_cache_key, search)
+    
+    def _process_results_for(self, search_provider, search_results: Dict[str, Any]) -> str:
+        """
+        Procesa los resultados según el tipo de proveedor de búsqueda que los ha generado.
+        """
+        if isinstance(search_provider, TavilyProvider):
+            return self._process_tavily_results(search_results)
+        return self._process_search_results(search_results)
+    
     def generate_news_summary(self, email: str) -> str:
         """
         Genera un resumen de noticias personalizado para el usuario.
@@ -70,46 +282,113 @@ class BaseAIProvider(AIProvider):
         username = email.split("@")[0]
         
         # Buscar al usuario en la base de datos
-        user_data = db.users.find_one({"email": Regex(f"^{email}$", "i")})
+        user_data = db.users.find_one(get_email_query(email))
         language = user_data.get("language", "es") if user_data else "es"
         
         # Obtener el proveedor de búsqueda preferido del usuario
         search_provider_pref = user_data.get("search_provider", "tavily") if user_data else "tavily"
         
-        # Crear consulta para buscar noticias de tecnología e IA
-        query = "Latest technology and AI news this week, top 5 most important news"
-        
         try:
-            # Si el usuario prefiere un proveedor de búsqueda específico, configurarlo temporalmente
-            original_search_provider = self.search_provider_type
-            if search_provider_pref == "tavily" and self.tavily_key:
-                self.search_provider_type = "tavily"
-            elif search_provider_pref == "serpapi" and self.serpapi_key:
-                self.search_provider_type = "serpapi"
-            
-            # Realizar la búsqueda web
-            search_result = self.search_web(query)
-            
-            # Restaurar el proveedor original
-            self.search_provider_type = original_search_provider
-            
-            if not search_result.get("success", False):
+            news_content = self.generate_digest(language, search_provider_pref)
+
+            if news_content is None:
                 return get_fallback_content(username, language)
             
-            # Procesar los resultados para generar un resumen bien formateado
-            system_prompt = get_news_summary_prompt(language)
+            # Formatear el email final con el contenido generado
+            return get_email_template(username, news_content, language)
             
-            news_content = self.generate_content(
+        except Exception as e:
+            print(f"Error al generar contenido: {str(e)}")
+            return get_fallback_content(username, language)
+
+    def generate_digest(self,
+                        language: str = "es",
+                        search_provider_pref: str = "tavily",
+                        system_prompt: Optional[str] = None) -> Optional[str]:
+        """
+        Genera el cuerpo del boletín semanal, sin saludo ni plantilla de email.
+        
+        No depende del usuario, por lo que el mismo cuerpo sirve para todos los
+        usuarios que comparten idioma, proveedores y prompt.
+        
+        Args:
+            language: Idioma del boletín ('es' o 'en')
+            search_provider_pref: Proveedor de búsqueda preferido ('tavily' o 'serpapi')
+            system_prompt: Prompt de sistema para el resumen (opcional, por defecto el del idioma)
+            
+        Returns:
+            El contenido del boletín o None si la búsqueda web ha fallado
+        """
+        # Crear consulta para buscar noticias de tecnología e IA
+        query = "Latest technology and AI news this week, top 5 most important news"
+        
+        # Realizar la búsqueda web con el proveedor preferido, si hay clave API para él
+        with metrics.time("search_web"):
+            search_result = self.search_web(query, self._resolve_search_provider_type(search_provider_pref))
+        
+        if not search_result.get("success", False):
+            return None
+        
+        # Procesar los resultados para generar un resumen bien formateado
+        with metrics.time("generate_content"):
+            return self.generate_content(
                 prompt=search_result.get("content", ""),
-                system_content=system_prompt
+                system_content=system_prompt or get_news_summary_prompt(language)
             )
+    
+    async def generate_news_summary_async(self, email: str) -> str:
+        """
+        Versión asíncrona de generate_news_summary.
+        
+        Args:
+            email: El email del usuario
+            
+        Returns:
+            El resumen de noticias formateado como un email
+        """
+        username = email.split("@")[0]
+        
+        user_data = await asyncio.to_thread(db.users.find_one, get_email_query(email))
+        language = user_data.get("language", "es") if user_data else "es"
+        search_provider_pref = user_data.get("search_provider", "tavily") if user_data else "tavily"
+        
+        try:
+            news_content = await self.generate_digest_async(language, search_provider_pref)
+
+            if news_content is None:
+                return get_fallback_content(username, language)
             
-            # Formatear el email final con el contenido generado
             return get_email_template(username, news_content, language)
             
         except Exception as e:
             print(f"Error al generar contenido: {str(e)}")
             return get_fallback_content(username, language)
+
+    async def generate_digest_async(self,
+                                    language: str = "es",
+                                    search_provider_pref: str = "tavily",
+                                    system_prompt: Optional[str] = None) -> Optional[str]:
+        """
+        Versión asíncrona de generate_digest. Como en la versión síncrona, el tipo de búsqueda se
+        pasa a search_web_async sin cambiar la instancia, así que varias corrutinas pueden usar
+        la misma instancia a la vez.
+        
+        Returns:
+            El contenido del boletín o None si la búsqueda web ha fallado
+        """
+        query = "Latest technology and AI news this week, top 5 most important news"
+        
+        with metrics.time("search_web"):
+            search_result = await self.search_web_async(query, self._resolve_search_provider_type(search_provider_pref))
+        
+        if not search_result.get("success", False):
+            return None
+        
+        with metrics.time("generate_content"):
+            return await self.generate_content_async(
+                prompt=search_result.get("content", ""),
+                system_content=system_prompt or get_news_summary_prompt(language)
+            )
     
     def _generate_fallback_content(self, email: str) -> str:
         """
@@ -124,7 +403,7 @@ class BaseAIProvider(AIProvider):
         username = email.split("@")[0]
         
         # Buscar al usuario en la base de datos
-        user_data = db.users.find_one({"email": Regex(f"^{email}$", "i")})
+        user_data = db.users.find_one(get_email_query(email))
         language = user_data.get("language", "es") if user_data else "es"
         
         return get_fallback_content(username, language)
@@ -139,7 +418,7 @@ class BaseAIProvider(AIProvider):
         Returns:
             str: Código de idioma ('es' o 'en')
         """
-        user_data = db.users.find_one({"email": Regex(f"^{email}$", "i")})
+        user_data = db.users.find_one(get_email_query(email))
         return user_data.get("language", "es") if user_data else "es"
     
     def _process_search_results(self, 
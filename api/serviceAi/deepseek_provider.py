@@ -2,12 +2,12 @@
 Implementación de DeepSeek como proveedor de IA.
 """
 
+import asyncio
 import json
-from typing import Dict, Any
-from openai import OpenAI
+from typing import Dict, Any, Optional
+from openai import AsyncOpenAI, OpenAI
 
 from .base_provider import BaseAIProvider
-from .serpapi_provider import SerpAPIProvider
 from .talivy_provider import TavilyProvider
 from .prompts import get_keyword_extraction_prompt
 from ..cache_manager import CacheManager
@@ -18,6 +18,8 @@ class DeepSeekProvider(BaseAIProvider):
     Implementación del proveedor de IA DeepSeek.
     """
 
+    provider_name = "deepseek"
+
     def __init__(self, api_key: str, **kwargs):
         """
         Inicializa el proveedor de IA DeepSeek.
@@ -31,21 +33,19 @@ class DeepSeekProvider(BaseAIProvider):
 
         # Configurar el proveedor de búsqueda seleccionado
         if self.search_provider_type.lower() == "tavily" and self.tavily_key:
-            self.search_provider = TavilyProvider(
-                self.tavily_key,
-                search_depth=self.tavily_search_depth,
-                topic=self.tavily_topic,
-                time_range=self.tavily_time_range,
-                include_raw_content=self.tavily_include_raw_content
-            )
+            self.search_provider = self._get_search_provider("tavily")
         elif self.serpapi_key:
-            self.search_provider = SerpAPIProvider(self.serpapi_key)
+            self.search_provider = self._get_search_provider("serpapi")
 
-        # Inicializar cliente de DeepSeek
+        # Inicializar clientes de DeepSeek (síncrono y asíncrono)
         self.client = OpenAI(
             api_key=self.api_key,
             base_url="https://api.deepseek.com",
         )
+        self.async_client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url="https://api.deepseek.com",
+        )
 
     def generate_content(self, prompt: str, **kwargs) -> str:
         """
@@ -76,55 +76,52 @@ class DeepSeekProvider(BaseAIProvider):
                 print("Contenido recuperado de caché para prompt similar")
                 return str(cached_content)
 
-            messages = []
-            if system_content:
-                messages.append({"role": "system", "content": system_content})
+            def generate() -> str:
+                messages = []
+                if system_content:
+                    messages.append({"role": "system", "content": system_content})
 
-            messages.append({"role": "user", "content": prompt})
+                messages.append({"role": "user", "content": prompt})
 
-            response = self.client.chat.completions.create(
-                model=self.model, messages=messages, temperature=temperature
-            )
+                response = self._create_chat_completion(
+                    metrics_stage="summarize", model=self.model, messages=messages, temperature=temperature
+                )
 
-            content = response.choices[0].message.content
-            result = content if content is not None else ""
+                content = response.choices[0].message.content
+                result = content if content is not None else ""
 
-            # Guardar en caché
-            CacheManager.save_to_cache(
-                cache_key=cache_key,
-                response=result,
-                provider_type="deepseek_content",
-                query=prompt,
-            )
+                # Guardar en caché
+                CacheManager.save_to_cache(
+                    cache_key=cache_key,
+                    response=result,
+                    provider_type="deepseek_content",
+                    query=prompt,
+                )
 
-            return result
+                return result
+
+            # Si otro hilo ya está generando el mismo contenido, esperar su resultado
+            return str(CacheManager.single_flight(cache_key, generate))
         except Exception as e:
             print(f"Error generando contenido con DeepSeek: {str(e)}")
             return f"Error: {str(e)}"
 
-    def search_web(self, query: str) -> Dict[str, Any]:
+    def search_web(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
         """
         Realiza una búsqueda web utilizando el proveedor configurado y procesa los resultados con DeepSeek.
 
         Args:
             query: La consulta de búsqueda
+            search_provider_type: Tipo de búsqueda ('tavily' o 'serpapi'). Por defecto el configurado
 
         Returns:
             Resultados procesados de la búsqueda
         """
-        # Inicializar el proveedor de búsqueda si no está configurado o si ha cambiado el tipo
-        if self.search_provider_type == "tavily" and self.tavily_key and not isinstance(self.search_provider, TavilyProvider):
-            self.search_provider = TavilyProvider(
-                self.tavily_key,
-                search_depth=self.tavily_search_depth,
-                topic=self.tavily_topic,
-                time_range=self.tavily_time_range,
-                include_raw_content=self.tavily_include_raw_content
-            )
-        elif self.search_provider_type == "serpapi" and self.serpapi_key and not isinstance(self.search_provider, SerpAPIProvider):
-            self.search_provider = SerpAPIProvider(self.serpapi_key)
+        # Usar el proveedor de búsqueda del tipo indicado, si hay clave API para él
+        search_provider_type = search_provider_type or self.search_provider_type
+        search_provider = self._get_search_provider(search_provider_type) or self.search_provider
         
-        if not self.search_provider:
+        if not search_provider:
             return {
                 "error": "No se ha configurado un proveedor de búsqueda",
                 "success": False,
@@ -137,11 +134,22 @@ class DeepSeekProvider(BaseAIProvider):
             print(f"Resultado recuperado de caché para: {query}")
             return cached_result
 
+        # Si otro hilo ya está haciendo la misma búsqueda, esperar su resultado
+        return CacheManager.single_flight(
+            cache_key, lambda: self._search_web_uncached(query, search_provider, search_provider_type, cache_key)
+        )
+
+    def _search_web_uncached(self, query: str, search_provider, search_provider_type: str, cache_key: str) -> Dict[str, Any]:
+        """
+        Parte de search_web que se ejecuta cuando la búsqueda no está en caché: busca, procesa
+        los resultados con DeepSeek y guarda el resultado en caché.
+        """
         try:
             # Primero obtenemos la keyword mediante DeepSeek
             system_prompt = get_keyword_extraction_prompt()
 
-            keyword_response = self.client.chat.completions.create(
+            keyword_response = self._create_chat_completion(
+                metrics_stage="keywords",
                 model=self.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -151,16 +159,10 @@ class DeepSeekProvider(BaseAIProvider):
             )
 
             # Extraer la keyword del JSON
-            content_str = keyword_response.choices[0].message.content or "{}"
-            try:
-                keyword_json = json.loads(content_str)
-                keyword = keyword_json.get("keyword", query)
-            except json.JSONDecodeError:
-                print(f"Error decodificando JSON de respuesta keyword: {content_str}")
-                keyword = query
+            keyword = self._parse_keyword(keyword_response.choices[0].message.content or "{}", query)
 
             # Determinar el tipo de proveedor para buscar en la caché
-            provider_cache_type = "tavily_search" if isinstance(self.search_provider, TavilyProvider) else "serpapi_search"
+            provider_cache_type = "tavily_search" if isinstance(search_provider, TavilyProvider) else "serpapi_search"
             
             # Verificar caché para la keyword específica
             keyword_cache_key = CacheManager.generate_cache_key(
@@ -176,7 +178,7 @@ class DeepSeekProvider(BaseAIProvider):
                 )
             else:
                 # Realizar búsqueda con el proveedor configurado
-                search_results = self.search_provider.search(keyword)
+                search_results = search_provider.search(keyword)
                 
                 # Guardar resultados de búsqueda en caché
                 if search_results and "error" not in search_results:
@@ -198,7 +200,7 @@ class DeepSeekProvider(BaseAIProvider):
                 return {"error": error_msg, "success": False}
 
             # Procesar los resultados según el tipo de proveedor
-            if isinstance(self.search_provider, TavilyProvider):
+            if isinstance(search_provider, TavilyProvider):
                 content_to_process = self._process_tavily_results(search_results)
             else:
                 content_to_process = self._process_search_results(search_results)
@@ -212,7 +214,8 @@ class DeepSeekProvider(BaseAIProvider):
             # Procesar los resultados con DeepSeek
             system_content = f"Answer the question from user with the provided search information: {content_to_process}"
 
-            final_response = self.client.chat.completions.create(
+            final_response = self._create_chat_completion(
+                metrics_stage="summarize",
                 model=self.model,
                 messages=[
                     {"role": "system", "content": system_content},
@@ -237,5 +240,123 @@ class DeepSeekProvider(BaseAIProvider):
             return result
 
         except Exception as e:
-            print(f"Error en búsqueda web con DeepSeek y {self.search_provider_type}: {str(e)}")
+            print(f"Error en búsqueda web con DeepSeek y {search_provider_type}: {str(e)}")
             return {"error": str(e), "success": False}
+
+    async def search_web_async(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de search_web.
+
+        Args:
+            query: La consulta de búsqueda
+            search_provider_type: Tipo de búsqueda ('tavily' o 'serpapi'). Por defecto el configurado
+
+        Returns:
+            Resultados procesados de la búsqueda
+        """
+        search_provider_type = search_provider_type or self.search_provider_type
+        search_provider = self._get_search_provider(search_provider_type) or self.search_provider
+
+        if not search_provider:
+            return {
+                "error": "No se ha configurado un proveedor de búsqueda",
+                "success": False,
+            }
+
+        # Verificar caché primero
+        cache_key = CacheManager.generate_cache_key(query, "deepseek_web_search")
+        cached_result = await asyncio.to_thread(CacheManager.get_from_cache, cache_key)
+        if cached_result:
+            print(f"Resultado recuperado de caché para: {query}")
+            return cached_result
+
+        # Si otra corrutina ya está haciendo la misma búsqueda, esperar su resultado
+        return await CacheManager.single_flight_async(
+            cache_key, lambda: self._search_web_uncached_async(query, search_provider, search_provider_type, cache_key)
+        )
+
+    async def _search_web_uncached_async(self, query: str, search_provider, search_provider_type: str, cache_key: str) -> Dict[str, Any]:
+        """
+        Versión asíncrona de _search_web_uncached.
+        """
+        try:
+            # Primero obtenemos la keyword mediante DeepSeek
+            keyword_response = await self._create_chat_completion_async(
+                metrics_stage="keywords",
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": get_keyword_extraction_prompt()},
+                    {"role": "user", "content": query},
+                ],
+                response_format={"type": "json_object"},
+            )
+            keyword = self._parse_keyword(keyword_response.choices[0].message.content or "{}", query)
+
+            search_results = await self._search_with_cache_async(search_provider, keyword)
+
+            if not search_results or "error" in search_results:
+                error_msg = (
+                    search_results.get("error", "Error desconocido en la búsqueda")
+                    if search_results
+                    else "No se obtuvieron resultados de búsqueda"
+                )
+                print(f"Error en búsqueda {search_provider_type}: {error_msg}")
+                return {"error": error_msg, "success": False}
+
+            content_to_process = self._process_results_for(search_provider, search_results)
+            if not content_to_process:
+                return {
+                    "error": "No se encontraron resultados relevantes",
+                    "success": False,
+                }
+
+            # Procesar los resultados con DeepSeek
+            system_content = f"Answer the question from user with the provided search information: {content_to_process}"
+
+            final_response = await self._create_chat_completion_async(
+                metrics_stage="summarize",
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": query},
+                ],
+            )
+
+            result = {
+                "content": final_response.choices[0].message.content,
+                "success": True,
+                "search_results": search_results,
+            }
+
+            # Guardar resultado final en caché
+            await asyncio.to_thread(
+                CacheManager.save_to_cache,
+                cache_key=cache_key,
+                response=result,
+                provider_type="deepseek_web_search",
+                query=query,
+            )
+
+            return result
+
+        except Exception as e:
+            print(f"Error en búsqueda web con DeepSeek y {search_provider_type}: {str(e)}")
+            return {"error": str(e), "success": False}
+
+    def _parse_keyword(self, content_str: str, query: str) -> str:
+        """
+        Extrae la keyword de la respuesta JSON del modelo.
+
+        Args:
+            content_str: Respuesta del modelo
+            query: Consulta original, que se usa si no se encuentra la keyword
+
+        Returns:
+            La keyword a buscar
+        """
+        try:
+            keyword_json = json.loads(content_str)
+            return keyword_json.get("keyword", query)
+        except json.JSONDecodeError:
+            print(f"Error decodificando JSON de respuesta keyword: {content_str}")
+            return query
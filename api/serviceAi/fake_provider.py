@@ -0,0 +1,130 @@
+"""
+Proveedores falsos de IA y de búsqueda para simular el envío semanal sin llamar a servicios externos.
+
+Las respuestas son deterministas y la latencia sigue una distribución log-normal configurable,
+de forma que `python maintenance.py --dry-run` permite dimensionar la concurrencia sin gastar
+cuota de los proveedores reales.
+"""
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from .base_provider import BaseAIProvider
+
+
+class LatencyModel:
+    """
+    Distribución log-normal de latencias definida por su mediana y su percentil 95.
+    Con la misma semilla genera siempre la misma secuencia.
+    """
+
+    def __init__(self, median: float, p95: Optional[float] = None, seed: int = 0):
+        """
+        Args:
+            median: Latencia mediana en segundos. Con 0 no hay latencia
+            p95: Percentil 95 en segundos (opcional, por defecto igual a la mediana: latencia fija)
+            seed: Semilla del generador
+        """
+        self.median = median
+        self.p95 = max(p95 or median, median)
+        self.sigma = math.log(self.p95 / median) / 1.645 if median > 0 else 0.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, value: str, seed: int = 0) -> "LatencyModel":
+        """
+        Crea el modelo a partir de "mediana" o "mediana,p95", por ejemplo "2.0,5.0".
+        """
+        parts = [float(part) for part in value.split(",")]
+        return cls(parts[0], parts[1] if len(parts) > 1 else None, seed)
+
+    def sample(self) -> float:
+        """Obtiene una latencia en segundos."""
+        if self.median <= 0:
+            return 0.0
+        with self._lock:
+            return self._random.lognormvariate(math.log(self.median), self.sigma)
+
+
+class FakeSearchProvider:
+    """
+    Proveedor de búsqueda falso con el formato de respuesta de SerpAPI.
+    """
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+
+    def _build_results(self, query: str) -> Dict[str, Any]:
+        return {
+            "organic_results": [
+                {"title": f"Noticia simulada {index + 1}", "snippet": f"Contenido simulado {index + 1} sobre {query}"}
+                for index in range(5)
+            ],
+        }
+
+    def search(self, query: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        time.sleep(self.latency.sample())
+        return self._build_results(query)
+
+    async def search_async(self, query: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency.sample())
+        return self._build_results(query)
+
+
+class FakeAIProvider(BaseAIProvider):
+    """
+    Proveedor de IA falso. No usa la caché ni el limitador de peticiones, para medir
+    únicamente la capacidad del propio proceso de envío.
+    """
+
+    def __init__(self, name: str, latency: LatencyModel, search_latency: LatencyModel):
+        """
+        Args:
+            name: Nombre del proveedor al que sustituye (ej. "groq")
+            latency: Latencia de cada llamada al modelo
+            search_latency: Latencia de cada búsqueda web
+        """
+        super().__init__("dry-run", tavily_key="dry-run", serpapi_key="dry-run", search_provider="tavily")
+        self.provider_name = name
+        self.model = f"{name}-dry-run"
+        self.latency = latency
+        self._search_providers = {
+            "tavily": FakeSearchProvider(search_latency),
+            "serpapi": FakeSearchProvider(search_latency),
+        }
+
+    def _build_content(self, prompt: str) -> str:
+        digest = hashlib.md5(prompt.encode()).hexdigest()[:8]
+        return f"<p>Contenido simulado de {self.provider_name} ({digest})</p>"
+
+    def _build_search_result(self, search_results: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "content": self._process_search_results(search_results),
+            "success": True,
+            "search_results": search_results,
+        }
+
+    def generate_content(self, prompt: str, **kwargs) -> str:
+        time.sleep(self.latency.sample())
+        return self._build_content(prompt)
+
+    def search_web(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
+        search_provider = self._get_search_provider(search_provider_type or self.search_provider_type)
+        search_results = search_provider.search(query)
+        time.sleep(self.latency.sample())
+        return self._build_search_result(search_results)
+
+    async def generate_content_async(self, prompt: str, **kwargs) -> str:
+        await asyncio.sleep(self.latency.sample())
+        return self._build_content(prompt)
+
+    async def search_web_async(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
+        search_provider = self._get_search_provider(search_provider_type or self.search_provider_type)
+        search_results = await search_provider.search_async(query)
+        await asyncio.sleep(self.latency.sample())
+        return self._build_search_result(search_results)
@@ -2,13 +2,13 @@
 Implementación de Groq como proveedor de IA.
 """
 
+import asyncio
 import json
 import re
-from typing import Dict, Any
-from openai import OpenAI
+from typing import Dict, Any, Optional
+from openai import AsyncOpenAI, OpenAI
 
 from .base_provider import BaseAIProvider
-from .serpapi_provider import SerpAPIProvider
 from .talivy_provider import TavilyProvider
 from .prompts import get_web_search_prompt, get_keyword_extraction_prompt
 from ..cache_manager import CacheManager
@@ -19,6 +19,8 @@ class GroqProvider(BaseAIProvider):
     Implementación del proveedor de IA Groq.
     """
 
+    provider_name = "groq"
+
     def __init__(self, api_key: str, **kwargs):
         """
         Inicializa el proveedor de IA Groq.
@@ -32,21 +34,19 @@ class GroqProvider(BaseAIProvider):
 
         # Configurar el proveedor de búsqueda seleccionado
         if self.search_provider_type.lower() == "tavily" and self.tavily_key:
-            self.search_provider = TavilyProvider(
-                self.tavily_key,
-                search_depth=self.tavily_search_depth,
-                topic=self.tavily_topic,
-                time_range=self.tavily_time_range,
-                include_raw_content=self.tavily_include_raw_content
-            )
+            self.search_provider = self._get_search_provider("tavily")
         elif self.serpapi_key:
-            self.search_provider = SerpAPIProvider(self.serpapi_key)
+            self.search_provider = self._get_search_provider("serpapi")
 
-        # Inicializar cliente de Groq
+        # Inicializar clientes de Groq (síncrono y asíncrono)
         self.client = OpenAI(
             api_key=self.api_key,
             base_url="https://api.groq.com/openai/v1",
         )
+        self.async_client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url="https://api.groq.com/openai/v1",
+        )
 
     def generate_content(self, prompt: str, **kwargs) -> str:
         """
@@ -75,60 +75,53 @@ class GroqProvider(BaseAIProvider):
             return str(cached_content)
 
         try:
-            messages = []
-            if system_content:
-                messages.append({"role": "system", "content": system_content})
+            def generate() -> str:
+                messages = []
+                if system_content:
+                    messages.append({"role": "system", "content": system_content})
 
-            messages.append({"role": "user", "content": prompt})
+                messages.append({"role": "user", "content": prompt})
 
-            response = self.client.chat.completions.create(
-                model=self.model, messages=messages, temperature=temperature
-            )
+                response = self._create_chat_completion(
+                    metrics_stage="summarize", model=self.model, messages=messages, temperature=temperature
+                )
 
-            content = response.choices[0].message.content
-            result = content if content is not None else ""
+                content = response.choices[0].message.content
+                result = content if content is not None else ""
 
-            # Guardar en caché
-            CacheManager.save_to_cache(
-                cache_key=cache_key,
-                response=result,
-                provider_type="groq_content",
-                query=prompt,
-            )
+                # Guardar en caché
+                CacheManager.save_to_cache(
+                    cache_key=cache_key,
+                    response=result,
+                    provider_type="groq_content",
+                    query=prompt,
+                )
 
-            return result
+                return result
+
+            # Si otro hilo ya está generando el mismo contenido, esperar su resultado
+            return str(CacheManager.single_flight(cache_key, generate))
         except Exception as e:
             print(f"Error generando contenido con Groq: {str(e)}")
             return f"Error: {str(e)}"
 
-    def search_web(self, query: str) -> Dict[str, Any]:
+    def search_web(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
         """
         Realiza una búsqueda web utilizando el proveedor configurado y procesa los resultados con Groq.
 
         Args:
             query: La consulta de búsqueda
+            search_provider_type: Tipo de búsqueda ('tavily' o 'serpapi'). Por defecto el configurado
 
         Returns:
             Resultados procesados de la búsqueda
         """
-        from api.database import db
-        from api.auth import get_current_user_id
-        from bson import ObjectId
-        
-        # Inicializar el proveedor de búsqueda si no está configurado o si ha cambiado el tipo
-        if self.search_provider_type == "tavily" and self.tavily_key and not isinstance(self.search_provider, TavilyProvider):
-            self.search_provider = TavilyProvider(
-                self.tavily_key,
-                search_depth=self.tavily_search_depth,
-                topic=self.tavily_topic,
-                time_range=self.tavily_time_range,
-                include_raw_content=self.tavily_include_raw_content
-            )
-        elif self.search_provider_type == "serpapi" and self.serpapi_key and not isinstance(self.search_provider, SerpAPIProvider):
-            self.search_provider = SerpAPIProvider(self.serpapi_key)
+        # Usar el proveedor de búsqueda del tipo indicado, si hay clave API para él
+        search_provider_type = search_provider_type or self.search_provider_type
+        search_provider = self._get_search_provider(search_provider_type) or self.search_provider
         
         # Si no tenemos proveedor de búsqueda, volvemos al método de simulación
-        if not self.search_provider:
+        if not search_provider:
             return self._simulate_web_search(query)
 
         # Verificar caché primero
@@ -138,6 +131,20 @@ class GroqProvider(BaseAIProvider):
             print(f"Resultado recuperado de caché para: {query}")
             return cached_result
 
+        # Si otro hilo ya está haciendo la misma búsqueda, esperar su resultado
+        return CacheManager.single_flight(
+            cache_key, lambda: self._search_web_uncached(query, search_provider, search_provider_type, cache_key)
+        )
+
+    def _search_web_uncached(self, query: str, search_provider, search_provider_type: str, cache_key: str) -> Dict[str, Any]:
+        """
+        Parte de search_web que se ejecuta cuando la búsqueda no está en caché: busca, procesa
+        los resultados con Groq y guarda el resultado en caché.
+        """
+        from api.database import db
+        from api.auth import get_current_user_id
+        from bson import ObjectId
+
         try:
             # Obtener la configuración personalizada del usuario si está disponible
             user_config = None
@@ -149,7 +156,7 @@ class GroqProvider(BaseAIProvider):
                     if user and "prompts" in user:
                         prompts = db.prompts.find_one({"_id": user["prompts"]})
                         if prompts:
-                            config_key = f"{self.search_provider_type}_config"
+                            config_key = f"{search_provider_type}_config"
                             if config_key in prompts and prompts[config_key]:
                                 user_config = prompts[config_key]
             except Exception as e:
@@ -158,7 +165,8 @@ class GroqProvider(BaseAIProvider):
             # Extraer la keyword con Groq
             system_prompt = get_keyword_extraction_prompt()
 
-            keyword_response = self.client.chat.completions.create(
+            keyword_response = self._create_chat_completion(
+                metrics_stage="keywords",
                 model=self.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -166,25 +174,10 @@ class GroqProvider(BaseAIProvider):
                 ],
             )
             content_str = keyword_response.choices[0].message.content or ""
-
-            # Extraer el JSON de la respuesta usando regex - puede contener texto antes o después
-            try:
-                # Buscar un objeto JSON válido en la cadena
-                json_match = re.search(r"\{[\s\S]*?\}", content_str)
-                if json_match:
-                    json_str = json_match.group(0)
-                    keyword_json = json.loads(json_str)
-                    keyword = keyword_json.get("keyword", query)
-                else:
-                    print(f"No se encontró un objeto JSON válido en: {content_str}")
-                    keyword = query
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"Error decodificando JSON de respuesta keyword: {content_str}")
-                print(f"Error detallado: {str(e)}")
-                keyword = query
+            keyword = self._parse_keyword(content_str, query)
 
             # Determinar el tipo de proveedor para buscar en la caché
-            provider_cache_type = "tavily_search" if isinstance(self.search_provider, TavilyProvider) else "serpapi_search"
+            provider_cache_type = "tavily_search" if isinstance(search_provider, TavilyProvider) else "serpapi_search"
             
             # Verificar caché para la keyword específica
             keyword_cache_key = CacheManager.generate_cache_key(
@@ -198,7 +191,7 @@ class GroqProvider(BaseAIProvider):
                 print(f"Resultado de búsqueda recuperado de caché para keyword: {keyword}")
             else:
                 # Realizar búsqueda con el proveedor configurado y la configuración del usuario
-                search_results = self.search_provider.search(keyword, user_config)
+                search_results = search_provider.search(keyword, user_config)
                 
                 # Guardar resultados de búsqueda en caché
                 if search_results and "error" not in search_results:
@@ -220,7 +213,7 @@ class GroqProvider(BaseAIProvider):
                 return {"error": error_msg, "success": False}
 
             # Procesar los resultados según el tipo de proveedor
-            if isinstance(self.search_provider, TavilyProvider):
+            if isinstance(search_provider, TavilyProvider):
                 content_to_process = self._process_tavily_results(search_results)
             else:
                 content_to_process = self._process_search_results(search_results)
@@ -239,7 +232,7 @@ class GroqProvider(BaseAIProvider):
                     if user and "prompts" in user:
                         prompts = db.prompts.find_one({"_id": user["prompts"]})
                         if prompts:
-                            prompt_key = f"{self.search_provider_type}_prompt"
+                            prompt_key = f"{search_provider_type}_prompt"
                             if prompt_key in prompts and prompts[prompt_key]:
                                 custom_prompt = prompts[prompt_key]
             except Exception as e:
@@ -259,7 +252,8 @@ class GroqProvider(BaseAIProvider):
             system_content = custom_prompt or get_web_search_prompt(language)
             system_content = f"{system_content}\n\nResultados de búsqueda:\n{content_to_process}"
 
-            final_response = self.client.chat.completions.create(
+            final_response = self._create_chat_completion(
+                metrics_stage="summarize",
                 model=self.model,
                 messages=[
                     {"role": "system", "content": system_content},
@@ -284,10 +278,134 @@ class GroqProvider(BaseAIProvider):
             return result
 
         except Exception as e:
-            print(f"Error en búsqueda web con Groq y {self.search_provider_type}: {str(e)}")
+            print(f"Error en búsqueda web con Groq y {search_provider_type}: {str(e)}")
             # Si falla la búsqueda, intentamos la simulación
             return self._simulate_web_search(query)
 
+    async def search_web_async(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de search_web.
+
+        Se usa en el envío semanal, donde no hay un usuario en sesión, por lo que se
+        aplican la configuración y el prompt de búsqueda por defecto.
+
+        Args:
+            query: La consulta de búsqueda
+            search_provider_type: Tipo de búsqueda ('tavily' o 'serpapi'). Por defecto el configurado
+
+        Returns:
+            Resultados procesados de la búsqueda
+        """
+        search_provider_type = search_provider_type or self.search_provider_type
+        search_provider = self._get_search_provider(search_provider_type) or self.search_provider
+
+        if not search_provider:
+            return await asyncio.to_thread(self._simulate_web_search, query)
+
+        # Verificar caché primero
+        cache_key = CacheManager.generate_cache_key(query, "groq_web_search")
+        cached_result = await asyncio.to_thread(CacheManager.get_from_cache, cache_key)
+        if cached_result:
+            print(f"Resultado recuperado de caché para: {query}")
+            return cached_result
+
+        # Si otra corrutina ya está haciendo la misma búsqueda, esperar su resultado
+        return await CacheManager.single_flight_async(
+            cache_key, lambda: self._search_web_uncached_async(query, search_provider, search_provider_type, cache_key)
+        )
+
+    async def _search_web_uncached_async(self, query: str, search_provider, search_provider_type: str, cache_key: str) -> Dict[str, Any]:
+        """
+        Versión asíncrona de _search_web_uncached.
+        """
+        try:
+            # Extraer la keyword con Groq
+            keyword_response = await self._create_chat_completion_async(
+                metrics_stage="keywords",
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": get_keyword_extraction_prompt()},
+                    {"role": "user", "content": query},
+                ],
+            )
+            keyword = self._parse_keyword(keyword_response.choices[0].message.content or "", query)
+
+            search_results = await self._search_with_cache_async(search_provider, keyword)
+
+            if not search_results or "error" in search_results:
+                error_msg = (
+                    search_results.get("error", "Error desconocido en la búsqueda")
+                    if search_results
+                    else "No se obtuvieron resultados de búsqueda"
+                )
+                print(f"Error en búsqueda {search_provider_type}: {error_msg}")
+                return {"error": error_msg, "success": False}
+
+            content_to_process = self._process_results_for(search_provider, search_results)
+            if not content_to_process:
+                return {
+                    "error": "No se encontraron resultados relevantes",
+                    "success": False,
+                }
+
+            system_content = f"{get_web_search_prompt('es')}\n\nResultados de búsqueda:\n{content_to_process}"
+
+            final_response = await self._create_chat_completion_async(
+                metrics_stage="summarize",
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": query},
+                ],
+            )
+
+            result = {
+                "content": final_response.choices[0].message.content,
+                "success": True,
+                "search_results": search_results,
+            }
+
+            # Guardar resultado final en caché
+            await asyncio.to_thread(
+                CacheManager.save_to_cache,
+                cache_key=cache_key,
+                response=result,
+                provider_type="groq_web_search",
+                query=query,
+            )
+
+            return result
+
+        except Exception as e:
+            print(f"Error en búsqueda web con Groq y {search_provider_type}: {str(e)}")
+            # Si falla la búsqueda, intentamos la simulación
+            return await asyncio.to_thread(self._simulate_web_search, query)
+
+    def _parse_keyword(self, content_str: str, query: str) -> str:
+        """
+        Extrae la keyword de la respuesta del modelo. Groq puede devolver texto antes o
+        después del JSON, así que se busca el primer objeto JSON de la respuesta.
+
+        Args:
+            content_str: Respuesta del modelo
+            query: Consulta original, que se usa si no se encuentra la keyword
+
+        Returns:
+            La keyword a buscar
+        """
+        try:
+            # Buscar un objeto JSON válido en la cadena
+            json_match = re.search(r"\{[\s\S]*?\}", content_str)
+            if json_match:
+                json_str = json_match.group(0)
+                keyword_json = json.loads(json_str)
+                return keyword_json.get("keyword", query)
+            print(f"No se encontró un objeto JSON válido en: {content_str}")
+        except (json.JSONDecodeError, ValueError) as e:
+            print(f"Error decodificando JSON de respuesta keyword: {content_str}")
+            print(f"Error detallado: {str(e)}")
+        return query
+
     def _simulate_web_search(self, query: str) -> Dict[str, Any]:
         """
         Método de respaldo que simula una búsqueda web cuando SerpAPI no está disponible.
@@ -308,7 +426,7 @@ class GroqProvider(BaseAIProvider):
         try:
             system_prompt = get_web_search_prompt()
 
-            response = self.client.chat.completions.create(
+            response = self._create_chat_completion(
                 model=self.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
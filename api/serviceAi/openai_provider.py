@@ -2,9 +2,9 @@
 Implementación de OpenAI como proveedor de IA.
 """
 
-from bson import Regex
+import asyncio
 import openai
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from .prompts import (
     get_email_template,
@@ -15,6 +15,7 @@ from .prompts import (
 from .base_provider import BaseAIProvider
 from ..cache_manager import CacheManager
 from ..database import db
+from ..utils import get_email_query
 
 
 class OpenAIProvider(BaseAIProvider):
@@ -22,6 +23,8 @@ class OpenAIProvider(BaseAIProvider):
     Implementación del proveedor de IA OpenAI.
     """
 
+    provider_name = "openai"
+
     def __init__(self, api_key: str, **kwargs):
         """
         Inicializa el proveedor de IA OpenAI.
@@ -34,6 +37,10 @@ class OpenAIProvider(BaseAIProvider):
         openai.api_key = api_key
         self.model = kwargs.get("model", "gpt-4o-mini")
 
+        # Inicializar clientes de OpenAI (síncrono y asíncrono)
+        self.client = openai.OpenAI(api_key=self.api_key)
+        self.async_client = openai.AsyncOpenAI(api_key=self.api_key)
+
     def generate_content(self, prompt: str, **kwargs) -> str:
         """
         Genera contenido utilizando la API de OpenAI.
@@ -63,38 +70,43 @@ class OpenAIProvider(BaseAIProvider):
                 print("Contenido recuperado de caché para prompt similar")
                 return str(cached_content)
 
-            messages = []
-            if system_content:
-                messages.append({"role": "system", "content": system_content})
+            def generate() -> str:
+                messages = []
+                if system_content:
+                    messages.append({"role": "system", "content": system_content})
 
-            messages.append({"role": "user", "content": prompt})
+                messages.append({"role": "user", "content": prompt})
 
-            response = openai.chat.completions.create(
-                model=self.model, messages=messages, temperature=temperature
-            )
+                response = self._create_chat_completion(
+                    metrics_stage="summarize", model=self.model, messages=messages, temperature=temperature
+                )
 
-            content = response.choices[0].message.content
-            result = content if content is not None else ""
+                content = response.choices[0].message.content
+                result = content if content is not None else ""
 
-            # Guardar en caché
-            CacheManager.save_to_cache(
-                cache_key=cache_key,
-                response=result,
-                provider_type="openai_content",
-                query=prompt,
-            )
+                # Guardar en caché
+                CacheManager.save_to_cache(
+                    cache_key=cache_key,
+                    response=result,
+                    provider_type="openai_content",
+                    query=prompt,
+                )
 
-            return result
+                return result
+
+            # Si otro hilo ya está generando el mismo contenido, esperar su resultado
+            return str(CacheManager.single_flight(cache_key, generate))
         except Exception as e:
             print(f"Error generando contenido con OpenAI: {str(e)}")
             return f"Error: {str(e)}"
 
-    def search_web(self, query: str) -> Dict[str, Any]:
+    def search_web(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
         """
         Realiza una búsqueda web utilizando las capacidades integradas de OpenAI.
 
         Args:
             query: La consulta de búsqueda
+            search_provider_type: Ignorado, OpenAI usa su propia búsqueda
 
         Returns:
             Resultados procesados de la búsqueda
@@ -107,25 +119,16 @@ class OpenAIProvider(BaseAIProvider):
             print(f"Resultado recuperado de caché para: {query}")
             return cached_result
 
+        # Si otro hilo ya está haciendo la misma búsqueda, esperar su resultado
+        return CacheManager.single_flight(cache_key, lambda: self._search_web_uncached(query, cache_key))
+
+    def _search_web_uncached(self, query: str, cache_key: str) -> Dict[str, Any]:
+        """
+        Parte de search_web que se ejecuta cuando la búsqueda no está en caché: busca, procesa
+        los resultados con OpenAI y guarda el resultado en caché.
+        """
         try:
-            response = openai.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": query}],
-                tools=[
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "web_search",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {"query": {"type": "string"}},
-                                "required": ["query"],
-                            },
-                        },
-                    }
-                ],
-                tool_choice="auto",
-            )
+            response = self._create_chat_completion(metrics_stage="search", **self._get_web_search_params(query))
 
             result = {"content": response.choices[0].message.content, "success": True}
 
@@ -142,6 +145,75 @@ class OpenAIProvider(BaseAIProvider):
             print(f"Error en búsqueda web con OpenAI: {str(e)}")
             return {"error": str(e), "success": False}
 
+    def _get_web_search_params(self, query: str) -> Dict[str, Any]:
+        """
+        Parámetros de la llamada de búsqueda web, compartidos por la versión síncrona y la asíncrona.
+        """
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": query}],
+            "tools": [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": "web_search",
+                        "parameters": {
+                            "type": "object",
+                            "properties": {"query": {"type": "string"}},
+                            "required": ["query"],
+                        },
+                    },
+                }
+            ],
+            "tool_choice": "auto",
+        }
+
+    async def search_web_async(self, query: str, search_provider_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de search_web. OpenAI usa su propia búsqueda, por lo que
+        `search_provider_type` no se utiliza.
+
+        Args:
+            query: La consulta de búsqueda
+            search_provider_type: Ignorado
+
+        Returns:
+            Resultados procesados de la búsqueda
+        """
+        cache_key = CacheManager.generate_cache_key(query, "openai_web_search")
+        cached_result = await asyncio.to_thread(CacheManager.get_from_cache, cache_key)
+
+        if cached_result:
+            print(f"Resultado recuperado de caché para: {query}")
+            return cached_result
+
+        # Si otra corrutina ya está haciendo la misma búsqueda, esperar su resultado
+        return await CacheManager.single_flight_async(
+            cache_key, lambda: self._search_web_uncached_async(query, cache_key)
+        )
+
+    async def _search_web_uncached_async(self, query: str, cache_key: str) -> Dict[str, Any]:
+        """
+        Versión asíncrona de _search_web_uncached.
+        """
+        try:
+            response = await self._create_chat_completion_async(metrics_stage="search", **self._get_web_search_params(query))
+
+            result = {"content": response.choices[0].message.content, "success": True}
+
+            await asyncio.to_thread(
+                CacheManager.save_to_cache,
+                cache_key=cache_key,
+                response=result,
+                provider_type="openai_web_search",
+                query=query,
+            )
+
+            return result
+        except Exception as e:
+            print(f"Error en búsqueda web con OpenAI: {str(e)}")
+            return {"error": str(e), "success": False}
+
     def generate_news_summary(self, email: str) -> str:
         """
         Genera un resumen de noticias personalizado para el usuario.
@@ -157,7 +229,7 @@ class OpenAIProvider(BaseAIProvider):
         username = email.split("@")[0]
 
         # Buscar al usuario en la base de datos
-        user_data = db.users.find_one({"email": Regex(f"^{email}$", "i")})
+        user_data = db.users.find_one(get_email_query(email))
         language = user_data.get("language", "es") if user_data else "es"
 
         # Crear consulta para buscar noticias de tecnología e IA
@@ -199,7 +271,7 @@ class OpenAIProvider(BaseAIProvider):
         username = email.split("@")[0]
 
         # Buscar al usuario en la base de datos
-        user_data = db.users.find_one({"email": Regex(f"^{email}$", "i")})
+        user_data = db.users.find_one(get_email_query(email))
         language = user_data.get("language", "es") if user_data else "es"
 
         return get_fallback_content(username, language)
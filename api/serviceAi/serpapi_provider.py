@@ -2,10 +2,20 @@
 Implementación del proveedor SerpAPI para búsquedas web.
 """
 
+import asyncio
+import os
 import requests
+import httpx
 import json
 from typing import Dict, Any, Optional
 
+from ..rate_limiter import RateLimiter
+from ..metrics import metrics
+
+# SEARCH_TIMEOUT_SECONDS: segundos máximos de cada búsqueda, síncrona o asíncrona. Un timeout
+# cuenta como sobrecarga y reduce el límite adaptativo de peticiones en vuelo de SerpAPI
+SEARCH_TIMEOUT_SECONDS = float(os.environ.get("SEARCH_TIMEOUT_SECONDS", "60"))
+
 class SerpAPIProvider:
     """
     Proveedor de servicio de búsqueda web usando la API de SerpAPI.
@@ -25,6 +35,80 @@ class SerpAPIProvider:
         self.api_key = api_key
         self.base_url = "https://serpapi.com/search"
         self.engine = engine
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def _build_params(self, query: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Construye los parámetros de la petición a SerpAPI.
+        
+        Args:
+            query: Consulta de búsqueda
+            user_config: Configuración personalizada opcional (sobreescribe los valores por defecto)
+            
+        Returns:
+            dict: Parámetros de la petición
+        """
+        # Configuración base
+        config = {
+            "max_results": 5,
+            "search_type": "news",
+            "safe_search": "off",
+            "time_range": "week",
+            "include_domains": [],
+            "exclude_domains": []
+        }
+        
+        # Aplicar configuración personalizada del usuario si existe
+        if user_config:
+            config.update({k: v for k, v in user_config.items() if k in config})
+        
+        # Convertir configuración a parámetros de SerpAPI
+        search_type = config["search_type"]
+        tbm = "nws" if search_type == "news" else "isch" if search_type == "images" else "vid" if search_type == "videos" else None
+            
+        # Convertir el rango de tiempo al formato que espera SerpAPI
+        time_map = {
+            "day": "d",
+            "week": "w",
+            "month": "m",
+            "year": "y"
+        }
+        tbs = f"qdr:{time_map.get(config['time_range'], 'w')}" if config['time_range'] in time_map else None
+        
+        # Construir los parámetros de la solicitud
+        params = {
+            "engine": self.engine,
+            "q": query,
+            "api_key": self.api_key,
+            "gl": "es",       # Región geográfica (España)
+            "hl": "es",       # Idioma de la interfaz
+            "num": config["max_results"],  # Número de resultados
+            "safe": config["safe_search"]  # Filtro de contenido
+        }
+        
+        # Añadir tbm si se ha especificado un tipo de búsqueda
+        if tbm:
+            params["tbm"] = tbm
+            
+        # Añadir tbs si se ha especificado un rango de tiempo
+        if tbs:
+            params["tbs"] = tbs
+            
+        # Construir filtros de dominio si existen
+        domain_filters = []
+        if config["include_domains"]:
+            for domain in config["include_domains"]:
+                domain_filters.append(f"site:{domain}")
+        if config["exclude_domains"]:
+            for domain in config["exclude_domains"]:
+                domain_filters.append(f"-site:{domain}")
+                
+        # Añadir filtros de dominio a la consulta si existen
+        if domain_filters:
+            params["q"] = f"{query} {' '.join(domain_filters)}"
+        
+        return params
     
     def search(self, query: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -38,74 +122,69 @@ class SerpAPIProvider:
             dict: Resultados de búsqueda
         """
         try:
-            # Configuración base
-            config = {
-                "max_results": 5,
-                "search_type": "news",
-                "safe_search": "off",
-                "time_range": "week",
-                "include_domains": [],
-                "exclude_domains": []
-            }
+            params = self._build_params(query, user_config)
             
-            # Aplicar configuración personalizada del usuario si existe
-            if user_config:
-                config.update({k: v for k, v in user_config.items() if k in config})
+            # Realizar la solicitud respetando el límite de peticiones de SerpAPI
+            RateLimiter.acquire("serpapi")
+            with RateLimiter.slot("serpapi"), metrics.time("search"), metrics.provider_call("serpapi"):
+                response = requests.get(self.base_url, params=params, timeout=SEARCH_TIMEOUT_SECONDS)
+                response.raise_for_status()
             
-            # Convertir configuración a parámetros de SerpAPI
-            search_type = config["search_type"]
-            tbm = "nws" if search_type == "news" else "isch" if search_type == "images" else "vid" if search_type == "videos" else None
-                
-            # Convertir el rango de tiempo al formato que espera SerpAPI
-            time_map = {
-                "day": "d",
-                "week": "w",
-                "month": "m",
-                "year": "y"
-            }
-            tbs = f"qdr:{time_map.get(config['time_range'], 'w')}" if config['time_range'] in time_map else None
+            return response.json()
+            
+        except requests.exceptions.RequestException as e:
+            print(f"Error en la solicitud a SerpAPI: {str(e)}")
+            return {"error": str(e), "results": [], "success": False}
+        except json.JSONDecodeError:
+            print("Error decodificando la respuesta JSON de SerpAPI")
+            return {"error": "Error decodificando respuesta", "results": [], "success": False}
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        Obtiene el cliente HTTP asíncrono de la instancia, que reutiliza las conexiones con SerpAPI
+        entre búsquedas. Un cliente solo sirve en el bucle de eventos en el que se crea, así que
+        se crea otro si la búsqueda se hace en un bucle distinto.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client.is_closed or self._async_client_loop is not loop:
+            self._async_client = httpx.AsyncClient(timeout=SEARCH_TIMEOUT_SECONDS)
+            self._async_client_loop = loop
+        return self._async_client
+    
+    async def aclose(self) -> None:
+        """Cierra el cliente HTTP asíncrono. Se llama al terminar la ejecución que lo ha usado."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_client_loop = None
+    
+    async def search_async(self, query: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de search, que no bloquea el bucle de eventos durante la petición.
+        
+        Args:
+            query: Consulta de búsqueda
+            user_config: Configuración personalizada opcional (sobreescribe los valores por defecto)
             
-            # Construir los parámetros de la solicitud
-            params = {
-                "engine": self.engine,
-                "q": query,
-                "api_key": self.api_key,
-                "gl": "es",       # Región geográfica (España)
-                "hl": "es",       # Idioma de la interfaz
-                "num": config["max_results"],  # Número de resultados
-                "safe": config["safe_search"]  # Filtro de contenido
-            }
+        Returns:
+            dict: Resultados de búsqueda
+        """
+        try:
+            params = self._build_params(query, user_config)
             
-            # Añadir tbm si se ha especificado un tipo de búsqueda
-            if tbm:
-                params["tbm"] = tbm
-                
-            # Añadir tbs si se ha especificado un rango de tiempo
-            if tbs:
-                params["tbs"] = tbs
-                
-            # Construir filtros de dominio si existen
-            domain_filters = []
-            if config["include_domains"]:
-                for domain in config["include_domains"]:
-                    domain_filters.append(f"site:{domain}")
-            if config["exclude_domains"]:
-                for domain in config["exclude_domains"]:
-                    domain_filters.append(f"-site:{domain}")
-                    
-            # Añadir filtros de dominio a la consulta si existen
-            if domain_filters:
-                params["q"] = f"{query} {' '.join(domain_filters)}"
-                
-            # Realizar la solicitud
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()
+            # Realizar la solicitud respetando el límite de peticiones de SerpAPI
+            await RateLimiter.acquire_async("serpapi")
+            async with RateLimiter.slot_async("serpapi"):
+                with metrics.time("search"), metrics.provider_call("serpapi"):
+                    client = self._get_async_client()
+                    response = await client.get(self.base_url, params=params)
+                    response.raise_for_status()
             
             return response.json()
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             print(f"Error en la solicitud a SerpAPI: {str(e)}")
             return {"error": str(e), "results": [], "success": False}
         except json.JSONDecodeError:
             print("Error decodificando la respuesta JSON de SerpAPI")
-            return {"error": "Error decodificando respuesta", "results": [], "success": False}
\ No newline at end of file
+            return {"error": "Error decodificando respuesta", "results": [], "success": False}
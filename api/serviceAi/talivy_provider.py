@@ -2,10 +2,20 @@
 Implementación del proveedor Tavily para búsquedas web.
 """
 
+import asyncio
+import os
 import requests
+import httpx
 import json
 from typing import Dict, Any, Optional
 
+from ..rate_limiter import RateLimiter
+from ..metrics import metrics
+
+# SEARCH_TIMEOUT_SECONDS: segundos máximos de cada búsqueda, síncrona o asíncrona. Un timeout
+# cuenta como sobrecarga y reduce el límite adaptativo de peticiones en vuelo de Tavily
+SEARCH_TIMEOUT_SECONDS = float(os.environ.get("SEARCH_TIMEOUT_SECONDS", "60"))
+
 class TavilyProvider:
     """
     Proveedor de servicio de búsqueda web usando la API de Tavily.
@@ -38,6 +48,53 @@ class TavilyProvider:
         self.topic = topic
         self.time_range = time_range
         self.include_raw_content = include_raw_content
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def _build_params(self, query: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Construye el cuerpo de la petición a Tavily.
+        
+        Args:
+            query: Consulta de búsqueda
+            user_config: Configuración personalizada opcional (sobreescribe los valores por defecto)
+            
+        Returns:
+            dict: Parámetros de la petición
+        """
+        # Configuración base
+        config = {
+            "max_results": 5,
+            "search_depth": self.search_depth,
+            "topic": self.topic,
+            "time_range": self.time_range,
+            "include_raw_content": self.include_raw_content,
+            "include_domains": [],
+            "exclude_domains": []
+        }
+        
+        # Aplicar configuración personalizada del usuario si existe
+        if user_config:
+            config.update({k: v for k, v in user_config.items() if k in config})
+            
+        # Construir los parámetros de la solicitud
+        params = {
+            "api_key": self.api_key,
+            "query": query,
+            "search_depth": config["search_depth"],
+            "topic": config["topic"],
+            "max_results": config["max_results"],
+            "include_raw_content": config["include_raw_content"],
+            "time_range": config["time_range"]
+        }
+        
+        # Añadir dominios para incluir/excluir si están presentes
+        if config["include_domains"]:
+            params["include_domains"] = config["include_domains"]
+        if config["exclude_domains"]:
+            params["exclude_domains"] = config["exclude_domains"]
+        
+        return params
     
     def search(self, query: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -51,47 +108,69 @@ class TavilyProvider:
             dict: Resultados de búsqueda
         """
         try:
-            # Configuración base
-            config = {
-                "max_results": 5,
-                "search_depth": self.search_depth,
-                "topic": self.topic,
-                "time_range": self.time_range,
-                "include_raw_content": self.include_raw_content,
-                "include_domains": [],
-                "exclude_domains": []
-            }
+            params = self._build_params(query, user_config)
             
-            # Aplicar configuración personalizada del usuario si existe
-            if user_config:
-                config.update({k: v for k, v in user_config.items() if k in config})
-                
-            # Construir los parámetros de la solicitud
-            params = {
-                "api_key": self.api_key,
-                "query": query,
-                "search_depth": config["search_depth"],
-                "topic": config["topic"],
-                "max_results": config["max_results"],
-                "include_raw_content": config["include_raw_content"],
-                "time_range": config["time_range"]
-            }
+            # Realizar la solicitud respetando el límite de peticiones de Tavily
+            RateLimiter.acquire("tavily")
+            with RateLimiter.slot("tavily"), metrics.time("search"), metrics.provider_call("tavily"):
+                response = requests.post(self.base_url, json=params, timeout=SEARCH_TIMEOUT_SECONDS)
+                response.raise_for_status()
+            
+            return response.json()
+            
+        except requests.exceptions.RequestException as e:
+            print(f"Error en la solicitud a Tavily: {str(e)}")
+            return {"error": str(e), "results": [], "success": False}
+        except json.JSONDecodeError:
+            print("Error decodificando la respuesta JSON de Tavily")
+            return {"error": "Error decodificando respuesta", "results": [], "success": False}
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        Obtiene el cliente HTTP asíncrono de la instancia, que reutiliza las conexiones con Tavily
+        entre búsquedas. Un cliente solo sirve en el bucle de eventos en el que se crea, así que
+        se crea otro si la búsqueda se hace en un bucle distinto.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client.is_closed or self._async_client_loop is not loop:
+            self._async_client = httpx.AsyncClient(timeout=SEARCH_TIMEOUT_SECONDS)
+            self._async_client_loop = loop
+        return self._async_client
+    
+    async def aclose(self) -> None:
+        """Cierra el cliente HTTP asíncrono. Se llama al terminar la ejecución que lo ha usado."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_client_loop = None
+    
+    async def search_async(self, query: str, user_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de search, que no bloquea el bucle de eventos durante la petición.
+        
+        Args:
+            query: Consulta de búsqueda
+            user_config: Configuración personalizada opcional (sobreescribe los valores por defecto)
             
-            # Añadir dominios para incluir/excluir si están presentes
-            if config["include_domains"]:
-                params["include_domains"] = config["include_domains"]
-            if config["exclude_domains"]:
-                params["exclude_domains"] = config["exclude_domains"]
+        Returns:
+            dict: Resultados de búsqueda
+        """
+        try:
+            params = self._build_params(query, user_config)
             
-            # Realizar la solicitud
-            response = requests.post(self.base_url, json=params)
-            response.raise_for_status()
+            # Realizar la solicitud respetando el límite de peticiones de Tavily
+            await RateLimiter.acquire_async("tavily")
+            async with RateLimiter.slot_async("tavily"):
+                with metrics.time("search"), metrics.provider_call("tavily"):
+                    client = self._get_async_client()
+                    response = await client.post(self.base_url, json=params)
+                    response.raise_for_status()
             
             return response.json()
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             print(f"Error en la solicitud a Tavily: {str(e)}")
             return {"error": str(e), "results": [], "success": False}
         except json.JSONDecodeError:
             print("Error decodificando la respuesta JSON de Tavily")
-            return {"error": "Error decodificando respuesta", "results": [], "success": False}
\ No newline at end of file
+            return {"error": "Error decodificando respuesta", "results": [], "success": False}
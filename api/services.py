@@ -1,12 +1,17 @@
 """
 Este archivo contiene funciones para interactuar con servicios externos como Resend (email) y APIs de IA.
 """
+import asyncio
 import os
+import threading
+import time
 import resend
 from dotenv import load_dotenv
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 from .cache_manager import CacheManager
+from .rate_limiter import RateLimiter, get_retry_after, is_retryable_error
+from .metrics import metrics
 from .serviceAi.prompts import get_fallback_content
 
 # Importar proveedores de IA
@@ -16,6 +21,7 @@ from .serviceAi.groq_provider import GroqProvider
 from .serviceAi.base import AIProvider
 from .serviceAi.prompts import get_welcome_email_template, get_email_template
 from .database import db
+from .utils import get_email_query
 
 # Cargar variables de entorno si no se han cargado
 load_dotenv()
@@ -23,6 +29,9 @@ load_dotenv()
 # Configuración Resend
 resend.api_key = os.environ.get("RESEND_API_KEY")
 
+# Número máximo de correos que acepta Resend en una sola llamada al endpoint batch
+RESEND_BATCH_LIMIT = 100
+
 # Claves API para servicios de IA y búsqueda
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
@@ -70,6 +79,21 @@ if GROQ_API_KEY:
         )
 
 
+async def close_async_clients():
+    """
+    Cierra los clientes HTTP asíncronos que los proveedores mantienen abiertos para reutilizar
+    las conexiones. Se llama al terminar cada ejecución asíncrona del envío.
+    """
+    for name, ai_provider in ai_providers.items():
+        aclose = getattr(ai_provider, "aclose", None)
+        if aclose is None:
+            continue
+        try:
+            await aclose()
+        except Exception as e:
+            print(f"Error cerrando los clientes de {name}: {str(e)}")
+
+
 def get_ai_provider(provider_name: str) -> Optional[AIProvider]:
     """
     Obtiene una instancia del proveedor de IA solicitado.
@@ -106,7 +130,129 @@ def send_email(to_email, subject, content):
         "html": content,
     }
     
-    return resend.Emails.send(params)
+    RateLimiter.acquire("resend")
+    with RateLimiter.slot("resend"), metrics.provider_call("resend"):
+        return resend.Emails.send(params)
+
+
+class ResendTransport:
+    """
+    Transporte de correo que utiliza el endpoint batch de Resend.
+    """
+
+    def send_batch(self, params: List[resend.Emails.SendParams]) -> List[Dict]:
+        """
+        Envía un lote de correos en una sola llamada HTTP.
+        
+        Args:
+            params: Lista de correos con el formato de Resend (máximo RESEND_BATCH_LIMIT)
+            
+        Returns:
+            list: Un elemento por correo aceptado, en el mismo orden, con su id
+            
+        Raises:
+            Exception: Si Resend rechaza el lote
+        """
+        RateLimiter.acquire("resend")
+        with RateLimiter.slot("resend"), metrics.provider_call("resend"):
+            response = resend.Batch.send(params)
+        return response.get("data", [])
+
+
+class LocalEmailTransport:
+    """
+    Transporte local que sustituye a Resend para ejecutar el envío sin conexión.
+    
+    Guarda los correos en memoria y permite simular destinatarios rechazados. Igual que
+    Resend, si un lote contiene un destinatario rechazado se rechaza el lote completo.
+    """
+
+    def __init__(self, rejected_emails: Optional[List[str]] = None, latency: Optional[Callable[[], float]] = None, keep_outbox: bool = True):
+        """
+        Inicializa el transporte local.
+        
+        Args:
+            rejected_emails: Destinatarios cuyo lote se rechazará (opcional)
+            latency: Función que devuelve los segundos que tarda cada lote (opcional)
+            keep_outbox: Si se guardan los correos enviados. Las simulaciones grandes lo desactivan
+        """
+        self.rejected_emails = set(rejected_emails or [])
+        self.latency = latency
+        self.keep_outbox = keep_outbox
+        self.outbox: List[resend.Emails.SendParams] = []
+        self.sent = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def send_batch(self, params: List[resend.Emails.SendParams]) -> List[Dict]:
+        if self.latency:
+            time.sleep(self.latency())
+        rejected = [to for message in params for to in message["to"] if to in self.rejected_emails]
+        if rejected:
+            raise Exception(f"Destinatarios rechazados: {', '.join(rejected)}")
+
+        with self._lock:
+            self.batches += 1
+            first_id = self.sent
+            self.sent += len(params)
+            if self.keep_outbox:
+                self.outbox.extend(params)
+        return [{"id": f"local-{first_id + i}"} for i in range(len(params))]
+
+
+# Transporte utilizado por send_batch_emails si no se indica otro
+email_transport = ResendTransport()
+
+
+def send_batch_emails(messages: List[Tuple[str, str, str]], transport=None) -> List[Dict]:
+    """
+    Envía varios correos agrupándolos en lotes de hasta RESEND_BATCH_LIMIT por llamada.
+    
+    Args:
+        messages: Lista de tuplas (destinatario, asunto, html)
+        transport: Transporte a utilizar (opcional, por defecto email_transport)
+        
+    Returns:
+        list: Resultado por destinatario, en el mismo orden que `messages`, con las claves
+        "to", "success" y "id" (si se aceptó) o, si se rechazó, "error", "retryable" (si
+        merece la pena reintentarlo) y "retry_after" (segundos indicados por el proveedor o None)
+    """
+    transport = transport or email_transport
+    results = []
+    
+    for start in range(0, len(messages), RESEND_BATCH_LIMIT):
+        chunk = messages[start:start + RESEND_BATCH_LIMIT]
+        params: List[resend.Emails.SendParams] = [
+            {
+                "from": "UpdateMe <newsletter@updateme.dev>",
+                "to": [to_email],
+                "subject": subject,
+                "html": content,
+            }
+            for to_email, subject, content in chunk
+        ]
+        
+        try:
+            data = transport.send_batch(params)
+        except Exception as e:
+            print(f"Error enviando lote de {len(chunk)} correos: {str(e)}")
+            failure = {"success": False, "error": str(e), "retryable": is_retryable_error(e), "retry_after": get_retry_after(e)}
+            results.extend({"to": to_email, **failure} for to_email, _, _ in chunk)
+            continue
+        
+        for index, (to_email, _, _) in enumerate(chunk):
+            if index < len(data):
+                results.append({"to": to_email, "success": True, "id": data[index].get("id")})
+            else:
+                results.append({
+                    "to": to_email,
+                    "success": False,
+                    "error": "Sin respuesta del proveedor",
+                    "retryable": True,
+                    "retry_after": None,
+                })
+    
+    return results
 
 
 def send_welcome_email(to_email):
@@ -125,7 +271,7 @@ def send_welcome_email(to_email):
     username = to_email.split("@")[0]
     
     # Obtener el idioma del usuario de la base de datos
-    user_data = db.users.find_one({"email": to_email})
+    user_data = db.users.find_one(get_email_query(to_email))
     language = user_data.get("language", "es") if user_data else "es"
     
     # Obtener plantilla de bienvenida (contenido estático)
@@ -141,6 +287,7 @@ def send_welcome_email(to_email):
         "audience_id": "d9811e04-dd4c-4843-8ae4-27d3ac0524e5",
     }
 
+    RateLimiter.acquire("resend")
     resend.Contacts.create(contact_params)
 
     params: resend.Emails.SendParams = {
@@ -150,6 +297,7 @@ def send_welcome_email(to_email):
         "html": content,
     }
 
+    RateLimiter.acquire("resend")
     return resend.Emails.send(params)
 
 
@@ -167,7 +315,7 @@ def generate_news_summary(email, provider=None):
     """
     
     # Buscar al usuario en la base de datos para obtener su proveedor de IA preferido
-    user_data = db.users.find_one({"email": email})
+    user_data = db.users.find_one(get_email_query(email))
     
     # Extraer username e idioma para fallback
     username = email.split("@")[0]
@@ -198,6 +346,50 @@ def generate_news_summary(email, provider=None):
             continue
     
     # Si llegamos aquí, ningún proveedor funcionó
+    return _get_cached_news_summary(username, language, provider, providers_to_try)
+
+
+async def generate_news_summary_async(email, provider=None):
+    """
+    Versión asíncrona de generate_news_summary, que usa los clientes asíncronos de los proveedores.
+    
+    Args:
+        email: Email del usuario (para personalizar el mensaje)
+        provider: Proveedor de IA a utilizar (opcional, si no se especifica se usa el del usuario)
+        
+    Returns:
+        str: Texto con el resumen de noticias
+    """
+    user_data = await asyncio.to_thread(db.users.find_one, get_email_query(email))
+    
+    username = email.split("@")[0]
+    language = user_data.get("language", "es") if user_data else "es"
+    
+    if not provider:
+        provider = user_data.get("ai_provider", "groq") if user_data else "groq"
+    
+    providers_to_try = [provider] + [p for p in ai_providers if p != provider]
+    
+    for current_provider in providers_to_try:
+        try:
+            ai_provider = ai_providers.get(current_provider)
+            if ai_provider:
+                return await ai_provider.generate_news_summary_async(email)
+        except Exception as e:
+            print(f"Error con proveedor {current_provider}: {str(e)}")
+            continue
+    
+    return await asyncio.to_thread(_get_cached_news_summary, username, language, provider, providers_to_try)
+
+
+def _get_cached_news_summary(username, language, provider, providers_to_try):
+    """
+    Construye el resumen a partir de la caché de los últimos días cuando ningún proveedor
+    ha podido generarlo, empezando por el proveedor preferido del usuario.
+    
+    Returns:
+        str: Email con el contenido en caché o el contenido de respaldo
+    """
     # Buscar en la caché de días anteriores (hasta 2 días)
     
     # Obtener fechas de hoy, ayer y anteayer
@@ -227,3 +419,95 @@ def generate_news_summary(email, provider=None):
     
     # Si no hay resultados en caché, usar fallback
     return get_fallback_content(username, language)
+
+
+def is_valid_digest_body(body):
+    """
+    Comprueba que un cuerpo de boletín se puede enviar: no está vacío ni es el texto de error
+    ("Error: ...") que devuelven los proveedores cuando falla la llamada al modelo.
+    
+    Args:
+        body: Cuerpo generado por el proveedor
+        
+    Returns:
+        bool: True si el cuerpo es válido
+    """
+    return isinstance(body, str) and bool(body.strip()) and not body.startswith("Error:")
+
+
+def generate_digest_body(language="es", provider="groq", search_provider="tavily", system_prompt=None):
+    """
+    Genera el cuerpo del boletín semanal (sin saludo ni plantilla) para un grupo de usuarios.
+    A diferencia de generate_news_summary no depende del email, por lo que se puede generar
+    una sola vez y reutilizar para todos los usuarios que comparten la misma configuración.
+    
+    Args:
+        language: Idioma del boletín ('es' o 'en')
+        provider: Proveedor de IA preferido
+        search_provider: Proveedor de búsqueda preferido ('tavily' o 'serpapi')
+        system_prompt: Prompt de sistema para el resumen (opcional)
+        
+    Returns:
+        str | None: Cuerpo del boletín o None si no se ha podido generar ni recuperar de caché
+    """
+    # Lista de proveedores a intentar, comenzando por el preferido
+    providers_to_try = [provider] + [p for p in ai_providers if p != provider]
+    
+    for current_provider in providers_to_try:
+        try:
+            ai_provider = ai_providers.get(current_provider)
+            if ai_provider:
+                body = ai_provider.generate_digest(language, search_provider, system_prompt)
+                if is_valid_digest_body(body):
+                    return body
+                print(f"El proveedor {current_provider} no ha generado el boletín: {body}")
+        except Exception as e:
+            print(f"Error con proveedor {current_provider}: {str(e)}")
+            continue
+    
+    return _get_cached_digest_body(providers_to_try)
+
+
+async def generate_digest_body_async(language="es", provider="groq", search_provider="tavily", system_prompt=None):
+    """
+    Versión asíncrona de generate_digest_body. Mientras espera a los proveedores no ocupa
+    ningún hilo, por lo que se pueden generar muchas cohortes a la vez.
+    
+    Returns:
+        str | None: Cuerpo del boletín o None si no se ha podido generar ni recuperar de caché
+    """
+    providers_to_try = [provider] + [p for p in ai_providers if p != provider]
+    
+    for current_provider in providers_to_try:
+        try:
+            ai_provider = ai_providers.get(current_provider)
+            if ai_provider:
+                body = await ai_provider.generate_digest_async(language, search_provider, system_prompt)
+                if is_valid_digest_body(body):
+                    return body
+                print(f"El proveedor {current_provider} no ha generado el boletín: {body}")
+        except Exception as e:
+            print(f"Error con proveedor {current_provider}: {str(e)}")
+            continue
+    
+    return await asyncio.to_thread(_get_cached_digest_body, providers_to_try)
+
+
+def _get_cached_digest_body(providers_to_try):
+    """
+    Busca un cuerpo de boletín generado en los últimos días cuando ningún proveedor ha funcionado.
+    
+    Returns:
+        str | None: Contenido en caché o None si no hay
+    """
+    today = datetime.now()
+    dates_to_check = [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(3)]
+    
+    for current_provider in providers_to_try:
+        for date in dates_to_check:
+            cached_items = list(CacheManager.get_provider_cache_by_date(f"{current_provider}_content", date))
+            if cached_items and is_valid_digest_body(cached_items[0]["response"]):
+                print(f"Usando caché del {date} para proveedor {current_provider}")
+                return cached_items[0]["response"]
+    
+    return None
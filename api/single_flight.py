@@ -0,0 +1,161 @@
+"""
+Agrupación de cálculos concurrentes con la misma clave ("single flight").
+
+Cuando varios hilos o corrutinas necesitan a la vez un mismo valor que no está en caché (por
+ejemplo, la búsqueda web de los usuarios de un mismo idioma el primer día de la semana), solo el
+primero lo calcula y el resto espera su resultado, en lugar de llamar todos a los proveedores.
+
+SingleFlight agrupa las llamadas dentro de un proceso. DistributedLock añade un bloqueo con
+caducidad en MongoDB para que, entre procesos, solo uno calcule cada clave mientras los demás
+esperan a encontrar el resultado en la caché.
+"""
+import asyncio
+import copy
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+
+class _Call:
+    """Cálculo en curso de una clave en SingleFlight, compartido por quienes lo esperan."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Ejecuta una sola vez a la vez el cálculo de cada clave. Seguro entre hilos.
+
+    Las llamadas síncronas se agrupan entre todos los hilos del proceso y las asíncronas entre las
+    corrutinas de un mismo bucle de eventos. Quienes esperan reciben una copia del resultado del
+    primero, o su misma excepción si el cálculo falla.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[Tuple[int, str], "asyncio.Future[Any]"] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Calcula el valor de la clave o, si otro hilo ya lo está calculando, espera su resultado.
+
+        Args:
+            key: Clave del cálculo
+            compute: Función que calcula el valor
+
+        Returns:
+            tuple: El valor y si se ha compartido el cálculo de otro hilo
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.value), True
+
+        try:
+            call.value = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    async def do_async(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Versión asíncrona de do. Si se cancela la corrutina que calcula el valor, la primera de
+        las que esperan pasa a calcularlo.
+
+        Args:
+            key: Clave del cálculo
+            compute: Función que devuelve la corrutina que calcula el valor
+
+        Returns:
+            tuple: El valor y si se ha compartido el cálculo de otra corrutina
+        """
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        while True:
+            future = self._async_calls.get(call_key)
+            if future is None:
+                break
+            try:
+                value = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+            return copy.deepcopy(value), True
+
+        future = self._async_calls[call_key] = loop.create_future()
+        try:
+            value = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            # Marcar la excepción como recuperada por si nadie más la estaba esperando
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelación: quienes esperan vuelven a intentarlo
+            future.cancel()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            del self._async_calls[call_key]
+        return value, False
+
+
+class DistributedLock:
+    """
+    Bloqueo con caducidad guardado en MongoDB, un documento por clave.
+
+    Si el proceso que tiene el bloqueo termina sin liberarlo, otro puede tomarlo cuando caduca.
+    El índice TTL de la colección (ver api/index_registry.py) borra después los bloqueos caducados.
+    """
+
+    def __init__(self, collection: Collection, ttl_seconds: float):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def acquire(self, key: str, owner: Any) -> bool:
+        """
+        Intenta tomar el bloqueo de la clave sin esperar.
+
+        Args:
+            key: Clave del bloqueo
+            owner: Identificador de quien lo toma, necesario para liberarlo
+
+        Returns:
+            bool: Si se ha tomado el bloqueo
+        """
+        now = datetime.now(timezone.utc)
+        lock = {"owner": owner, "expires_at": now + timedelta(seconds=self.ttl_seconds)}
+        try:
+            self.collection.insert_one({"_id": key, **lock})
+            return True
+        except DuplicateKeyError:
+            pass
+
+        # Tomar el bloqueo si ha caducado sin que su dueño lo liberase
+        result = self.collection.update_one({"_id": key, "expires_at": {"$lt": now}}, {"$set": lock})
+        return result.modified_count == 1
+
+    def release(self, key: str, owner: Any) -> None:
+        """Libera el bloqueo de la clave si sigue siendo de `owner`."""
+        self.collection.delete_one({"_id": key, "owner": owner})
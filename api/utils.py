@@ -10,6 +10,17 @@ def is_valid_email(email):
     """Valida que un string tenga formato de email válido."""
     return EMAIL_REGEX.match(email) is not None
 
+def normalize_email(email):
+    """
+    Normaliza un email para buscar usuarios sin distinguir mayúsculas ni espacios.
+    Es el valor que se guarda en el campo indexado `email_lower` de cada usuario.
+    """
+    return (email or "").strip().lower()
+
+def get_email_query(email):
+    """Construye la consulta de un usuario por email, servida por el índice de `email_lower`."""
+    return {"email_lower": normalize_email(email)}
+
 # --- Utilidades para conversión de dataclasses a diccionarios ---
 def dataclass_to_dict(obj):
     """
@@ -4,19 +4,106 @@ los correos semanales a los usuarios.
 
 Este script debe ejecutarse periódicamente (una vez al día o más) para
 garantizar que todos los usuarios reciban su resumen semanal.
+
+Uso:
+    python maintenance.py               Envía los correos planificados en la franja actual
+    python maintenance.py send --async  Igual, pero generando los resúmenes con asyncio
+    python maintenance.py --dry-run --users 5000
+                                        Simula el envío con usuarios y proveedores falsos
+    python maintenance.py pregenerate   Genera y guarda por adelantado los resúmenes de la semana
+    python maintenance.py worker        Ejecuta los envíos encolados desde el endpoint de mantenimiento
+    python maintenance.py retry         Reintenta los correos fallidos cuyo siguiente intento ya toca
+    python maintenance.py indexes       Crea los índices del registro e informa de los que faltan o no se usan
+    python maintenance.py indexes --check
+                                        Solo informa, sin crear nada
+    python maintenance.py migrate       Completa los campos nuevos de los usuarios existentes (email_lower...)
 """
 
 #!/usr/bin/env python3
 
 
 import os
-import time
+import argparse
+import asyncio
 import logging
+import random
+import socket
 import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
-from api.services import generate_news_summary, send_email
+from api.services import (
+    RESEND_BATCH_LIMIT,
+    close_async_clients,
+    is_valid_digest_body,
+    send_batch_emails,
+)
+from api.service.digest_service import (
+    CohortKey,
+    DigestCohort,
+    group_users_into_cohorts,
+    generate_cohort_digest,
+    generate_cohort_digest_async,
+    render_digest_email,
+)
+from api.service.send_ledger_service import (
+    create_send_ledger_indexes,
+    get_run_digest,
+    get_run_week,
+    get_sent_user_ids,
+    mark_users,
+    save_run_digest,
+    start_run,
+)
+from api.service.schedule_service import (
+    DUE_SORT,
+    backfill_next_send_at,
+    backfill_send_priority,
+    build_sent_update,
+    create_schedule_indexes,
+    get_send_priority,
+    get_due_query,
+    get_slice_end,
+    record_send_failures,
+)
+from api.service.maintenance_run_service import (
+    claim_run,
+    encode_continuation,
+    finish_run,
+    pause_run,
+    save_run_report,
+    save_run_slice_end,
+    update_run_progress,
+)
+import api.services as services
+import api.service.schedule_service as schedule_service
+import api.service.send_ledger_service as send_ledger_service
+from api.service.user_services import backfill_email_lower, create_unique_email_index
+from api.service.retry_queue_service import (
+    claim_due_retries,
+    complete_retries,
+    complete_user_retries,
+    create_retry_indexes,
+    hold_pending_retries,
+    reschedule_retries,
+    schedule_retries,
+)
+import api.service.maintenance_run_service as maintenance_run_service
+import api.service.retry_queue_service as retry_queue_service
+from api.serviceAi.fake_provider import FakeAIProvider, LatencyModel
+from api.rate_limiter import RateLimiter
+from api.metrics import metrics
+from api.index_registry import apply_index_registry
+from api.cache_manager import CacheManager
 
 # Configuración de logging
 # Verificar si estamos en Vercel (entorno de producción)
@@ -47,107 +134,1456 @@ client = MongoClient(MONGODB_URI)
 db = client["updateme"]
 users_collection = db["users"]
 
+# Configuración de concurrencia del envío semanal
+# EMAIL_WORKERS: número de hilos que procesan usuarios en paralelo
+# EMAIL_GENERATION_CONCURRENCY: generaciones con IA simultáneas como máximo
+# EMAIL_SEND_CONCURRENCY: envíos a Resend simultáneos como máximo
+EMAIL_WORKERS = int(os.environ.get("EMAIL_WORKERS", "8"))
+EMAIL_GENERATION_CONCURRENCY = int(os.environ.get("EMAIL_GENERATION_CONCURRENCY", "4"))
+EMAIL_SEND_CONCURRENCY = int(os.environ.get("EMAIL_SEND_CONCURRENCY", "4"))
+# EMAIL_CURSOR_BATCH_SIZE: usuarios que se leen de MongoDB y se procesan por tanda
+EMAIL_CURSOR_BATCH_SIZE = int(os.environ.get("EMAIL_CURSOR_BATCH_SIZE", "500"))
+# EMAIL_WRITE_BATCH_SIZE / EMAIL_WRITE_FLUSH_SECONDS: cada cuántos usuarios o segundos
+# se escriben en bloque las fechas de último envío
+EMAIL_WRITE_BATCH_SIZE = int(os.environ.get("EMAIL_WRITE_BATCH_SIZE", "500"))
+EMAIL_WRITE_FLUSH_SECONDS = float(os.environ.get("EMAIL_WRITE_FLUSH_SECONDS", "5"))
+# EMAIL_LEASE_SECONDS: duración de la reserva de una tanda de usuarios. Debe cubrir de sobra
+# la generación y el envío de una tanda; si el proceso muere, sus usuarios vuelven a estar
+# disponibles para otros procesos cuando caduca la reserva
+EMAIL_LEASE_SECONDS = int(os.environ.get("EMAIL_LEASE_SECONDS", "900"))
+
+# EMAIL_PREGENERATE_HORIZON_HOURS: horas hacia delante cuyos envíos prepara la pregeneración
+EMAIL_PREGENERATE_HORIZON_HOURS = int(os.environ.get("EMAIL_PREGENERATE_HORIZON_HOURS", "24"))
+# EMAIL_GENERATE_ON_SEND: si el envío genera los resúmenes que no se hayan pregenerado.
+# Con "false" el envío solo lee los resúmenes guardados y usa el contenido de respaldo si falta alguno
+EMAIL_GENERATE_ON_SEND = os.environ.get("EMAIL_GENERATE_ON_SEND", "true").lower() == "true"
+# EMAIL_ASYNC_GENERATION_CONCURRENCY: generaciones simultáneas en el envío con asyncio (--async).
+# Al no ocupar un hilo cada una, puede ser mucho mayor que EMAIL_GENERATION_CONCURRENCY
+EMAIL_ASYNC_GENERATION_CONCURRENCY = int(os.environ.get("EMAIL_ASYNC_GENERATION_CONCURRENCY", "100"))
+
+# Identificador de este proceso para las reservas de usuarios
+RUNNER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+
+# Campos del usuario que necesita el envío semanal. Evita cargar en memoria
+# contraseñas, métodos de pago o datos de facturación
+USER_PROJECTION = {
+    "_id": 1,
+    "email": 1,
+    "language": 1,
+    "ai_provider": 1,
+    "search_provider": 1,
+    "prompts": 1,
+}
+
+
+class LastSentWriter:
+    """Acumula las actualizaciones de `last_email_sent` (y del `next_send_at` que se planifica
+    a partir de él) y las escribe con un `bulk_write` desordenado cada `batch_size` usuarios o
+    cada `flush_seconds` segundos.
+
+    Lleva la cuenta exacta de las escrituras confirmadas y fallidas. Se puede usar desde
+    varios hilos y como gestor de contexto, que garantiza la escritura final al salir.
+    """
 
-def send_weekly_email(user: dict) -> bool:
-    """Envía un correo electrónico con el resumen semanal de noticias para un usuario específico.
+    def __init__(
+        self,
+        collection=None,
+        batch_size: Optional[int] = None,
+        flush_seconds: Optional[float] = None,
+        interval_days: Optional[int] = None,
+    ):
+        self.collection = collection if collection is not None else users_collection
+        self.interval_days = interval_days
+        self.batch_size = max(1, batch_size or EMAIL_WRITE_BATCH_SIZE)
+        self.flush_seconds = flush_seconds if flush_seconds is not None else EMAIL_WRITE_FLUSH_SECONDS
+        self.written = 0
+        self.failed = 0
+        self._pending: List[UpdateOne] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, user_id, sent_at: Optional[datetime] = None) -> None:
+        """Registra un envío aceptado y escribe el bloque si se ha alcanzado el tamaño o el tiempo."""
+        operation = build_sent_update(user_id, sent_at or datetime.now(timezone.utc), self.interval_days)
+        with self._lock:
+            self._pending.append(operation)
+        self.flush_if_due()
+
+    def flush_if_due(self) -> None:
+        """Escribe el bloque pendiente si se ha superado el tamaño o el tiempo máximo."""
+        with self._lock:
+            due = len(self._pending) >= self.batch_size or (
+                bool(self._pending) and time.monotonic() - self._last_flush >= self.flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Escribe todas las actualizaciones pendientes en una sola operación."""
+        with self._lock:
+            operations, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+            if not operations:
+                return
+
+            try:
+                with metrics.time("write"):
+                    self.collection.bulk_write(operations, ordered=False)
+                self.written += len(operations)
+            except BulkWriteError as e:
+                # Con ordered=False el resto de operaciones se aplican igualmente
+                failed = len(e.details.get("writeErrors", []))
+                self.written += len(operations) - failed
+                self.failed += failed
+                logger.error(f"Error en {failed} de {len(operations)} actualizaciones de last_email_sent")
+            except Exception as e:
+                self.failed += len(operations)
+                logger.error(f"Error escribiendo {len(operations)} actualizaciones de last_email_sent: {str(e)}")
+
+    def __enter__(self) -> "LastSentWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.flush()
+
+
+def get_weekly_subject(language: str) -> str:
+    """Devuelve el asunto del correo semanal según el idioma del usuario."""
+    return (
+        "Your Weekly Tech Update - UpdateMe"
+        if language == "en"
+        else "UpdateMe: Tu resumen semanal de tecnología e IA"
+    )
+
+
+def send_weekly_batch(
+    entries: List[Tuple[dict, DigestCohort]],
+    limits: Optional[Dict[str, threading.Semaphore]] = None,
+    writer: Optional[LastSentWriter] = None,
+    run_week: Optional[str] = None,
+) -> Tuple[int, int]:
+    """Envía el correo semanal a un lote de usuarios con una sola llamada al proveedor de correo.
+
+    Solo se actualiza `last_email_sent` de los usuarios cuyo correo ha sido aceptado.
 
     Args:
-        user (dict): Diccionario que contiene la información del usuario, incluyendo su correo electrónico y preferencias.
+        entries (list): Pares (usuario, cohorte) con el cuerpo de la cohorte ya generado.
+            Como mucho RESEND_BATCH_LIMIT elementos para que se envíen en una sola llamada.
+        limits (dict, optional): Semáforos por etapa ("generation" y "send") que limitan
+            cuántos hilos pueden estar en cada etapa a la vez. Si no se indica, no hay límite.
+        writer (LastSentWriter, optional): Buffer compartido para escribir `last_email_sent`.
+            Si se indica, las escrituras quedan pendientes y sus resultados se cuentan en el
+            propio writer. Si no, se escriben al terminar el lote.
+        run_week (str, optional): Semana del envío. Si se indica, el resultado de cada
+            usuario se guarda en el registro de envíos (send_ledger) y los correos rechazados
+            se encolan ya renderizados en la cola de reintentos.
 
     Returns:
-        bool: True si el correo se envió correctamente, False en caso contrario.
+        tuple: Número de correos aceptados y número de errores del lote. Con un writer
+        compartido, los aceptados aún no se han confirmado en la base de datos.
     """
-    try:
-        email = user["email"]
-        language = user.get("language", "es")
-        provider = user.get("ai_provider", "groq")
-
-        # Generar el resumen personalizado para el usuario
-        logger.info(f"Generando resumen para {email} usando proveedor {provider}")
-        summary_content = generate_news_summary(email, provider)
-
-        # Determinar el asunto según el idioma
-        subject = (
-            "Your Weekly Tech Update - UpdateMe"
-            if language == "en"
-            else "UpdateMe: Tu resumen semanal de tecnología e IA"
+    limits = limits or {}
+    error_count = 0
+
+    if writer is None:
+        with LastSentWriter() as batch_writer:
+            _, error_count = send_weekly_batch(entries, limits, batch_writer, run_week)
+        return batch_writer.written, error_count + batch_writer.failed
+
+    # Construir los correos; un fallo al renderizar solo afecta a ese usuario
+    recipients = []
+    messages = []
+    with metrics.time("render"):
+        for user, cohort in entries:
+            try:
+                subject = get_weekly_subject(user.get("language", "es"))
+                messages.append((user["email"], subject, render_digest_email(user, cohort.body)))
+                recipients.append(user)
+            except Exception as e:
+                logger.error(f"Error preparando correo para {user['email']}: {str(e)}")
+                error_count += 1
+
+    if not messages:
+        return 0, error_count
+
+    logger.info(f"Enviando lote de {len(messages)} correos")
+    with limits.get("send", nullcontext()):
+        with metrics.time("send"):
+            results = send_batch_emails(messages)
+
+    accepted = []
+    failed_errors = {}
+    failures = []
+    for user, (_, subject, html), result in zip(recipients, messages, results):
+        if not result["success"]:
+            logger.error(f"Error enviando correo a {user['email']}: {result['error']}")
+            failed_errors[user["_id"]] = result["error"]
+            failures.append({
+                "user": user,
+                "subject": subject,
+                "html": html,
+                "error": result["error"],
+                "retryable": result.get("retryable", True),
+                "retry_after": result.get("retry_after"),
+            })
+            error_count += 1
+            continue
+
+        # Registrar la fecha del último correo enviado
+        writer.add(user["_id"])
+        accepted.append(user)
+    accepted_count = len(accepted)
+
+    if failed_errors:
+        # Dar más prioridad a los usuarios fallidos en los siguientes envíos
+        try:
+            record_send_failures(failed_errors)
+        except Exception as e:
+            logger.error(f"Error registrando los fallos de {len(failed_errors)} usuarios: {str(e)}")
+
+    if run_week:
+        # Marcar a los usuarios en el registro para no volver a enviarles el correo esta semana
+        with metrics.time("ledger"):
+            mark_users(run_week, accepted, "sent")
+            mark_users(run_week, [u for u in recipients if u["_id"] in failed_errors], "failed", errors=failed_errors)
+            # Un reintento de la semana encolado por otro proceso ya no debe enviarse
+            complete_user_retries(run_week, [user["_id"] for user in accepted])
+
+        # Reintentar más tarde los rechazados sin volver a generar su correo
+        if failures:
+            try:
+                queued = schedule_retries(run_week, failures, EMAIL_LEASE_SECONDS)
+                metrics.increment("retries_queued", queued["queued"])
+                metrics.increment("dead_letters", queued["dead"])
+            except Exception as e:
+                logger.error(f"Error encolando {len(failures)} correos para reintentar: {str(e)}")
+
+    logger.info(f"Lote enviado: {accepted_count} aceptados, {error_count} errores")
+    return accepted_count, error_count
+
+
+def load_or_generate_digest(
+    run_week: str,
+    cohort: DigestCohort,
+    limits: Optional[Dict[str, threading.Semaphore]] = None,
+    generate_missing: bool = True,
+) -> str:
+    """Carga el resumen guardado de una cohorte para la semana o, si no existe, lo genera y lo guarda.
+
+    Args:
+        run_week (str): Semana del envío.
+        cohort (DigestCohort): Cohorte cuyo resumen se necesita. Se rellena `cohort.body`.
+        limits (dict, optional): Semáforos por etapa, ver send_weekly_batch.
+        generate_missing (bool, optional): Si es False y no hay resumen guardado, no se llama a la IA.
+
+    Returns:
+        str: "stored" si se ha reutilizado, "generated" si se ha generado, "failed" si la
+        generación ha fallado y "missing" si no existía y no se ha generado. Un resumen
+        guardado que no es válido se trata como inexistente y nunca se guarda uno fallido.
+    """
+    limits = limits or {}
+
+    with metrics.time("digest_load"):
+        stored = get_run_digest(run_week, cohort.cohort_id)
+    if stored and is_valid_digest_body(stored.get("body")):
+        cohort.body = stored["body"]
+        return "stored"
+
+    if not generate_missing:
+        return "missing"
+
+    logger.info(
+        f"Generando resumen para la cohorte "
+        f"({cohort.language}, {cohort.ai_provider}, {cohort.search_provider})"
+    )
+    with limits.get("generation", nullcontext()):
+        with metrics.time("generation"):
+            generate_cohort_digest(cohort)
+
+    # Un resultado de error no se guarda: se volvería a usar al reanudar el envío
+    if not is_valid_digest_body(cohort.body):
+        cohort.body = None
+        return "failed"
+
+    save_run_digest(run_week, cohort.cohort_id, cohort.body)
+    return "generated"
+
+
+def pregenerate_digests(
+    horizon_hours: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    generation_concurrency: Optional[int] = None,
+    batch_size: Optional[int] = None,
+) -> Dict[str, int]:
+    """Genera y guarda por adelantado los resúmenes de los usuarios cuyo envío toca en las
+    próximas `horizon_hours` horas.
+
+    Se ejecuta antes de la ventana de envío, de forma que process_pending_emails solo tenga
+    que leer el contenido guardado en `send_runs` y la duración del envío no dependa de la
+    latencia de los proveedores de IA. Los resúmenes se guardan por cohorte y semana de envío
+    junto con el hash de su contenido; los que ya existen no se vuelven a generar.
+
+    Args:
+        horizon_hours (int, optional): Horas hacia delante a preparar. Defaults to EMAIL_PREGENERATE_HORIZON_HOURS.
+        max_workers (int, optional): Número de hilos del pool. Defaults to EMAIL_WORKERS.
+        generation_concurrency (int, optional): Generaciones simultáneas como máximo. Defaults to EMAIL_GENERATION_CONCURRENCY.
+        batch_size (int, optional): Usuarios leídos por tanda. Defaults to EMAIL_CURSOR_BATCH_SIZE.
+
+    Returns:
+        dict: Número de cohortes por resultado ("stored", "generated" y "failed")
+    """
+    max_workers = max(1, max_workers or EMAIL_WORKERS)
+    batch_size = max(1, batch_size or EMAIL_CURSOR_BATCH_SIZE)
+    limits = {
+        "generation": threading.BoundedSemaphore(max(1, generation_concurrency or EMAIL_GENERATION_CONCURRENCY)),
+    }
+
+    now = datetime.now(timezone.utc)
+    horizon_end = now + timedelta(hours=horizon_hours or EMAIL_PREGENERATE_HORIZON_HOURS)
+    create_schedule_indexes()
+    create_send_ledger_indexes()
+
+    # Cohortes distintas por semana de envío. No se guardan los usuarios, solo la clave
+    cohorts: Dict[Tuple[str, CohortKey], DigestCohort] = {}
+    cursor = users_collection.find(
+        get_due_query(horizon_end), {**USER_PROJECTION, "next_send_at": 1}, batch_size=batch_size
+    )
+
+    def add_chunk(chunk: List[dict]) -> None:
+        by_week: Dict[str, List[dict]] = {}
+        for user in chunk:
+            send_at = user.get("next_send_at") or now
+            if send_at.tzinfo is None:
+                send_at = send_at.replace(tzinfo=timezone.utc)
+            by_week.setdefault(get_run_week(max(send_at, now)), []).append(user)
+        for run_week, users in by_week.items():
+            for key, cohort in group_users_into_cohorts(users).items():
+                cohort.users = []
+                cohorts.setdefault((run_week, key), cohort)
+
+    chunk: List[dict] = []
+    for user in cursor:
+        chunk.append(user)
+        if len(chunk) >= batch_size:
+            add_chunk(chunk)
+            chunk = []
+    if chunk:
+        add_chunk(chunk)
+
+    logger.info(f"Pregenerando {len(cohorts)} cohortes para los envíos hasta {horizon_end.isoformat()}")
+
+    results = {"stored": 0, "generated": 0, "failed": 0}
+    for run_week in {run_week for run_week, _ in cohorts}:
+        start_run(run_week)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pregenerate") as executor:
+        futures = {
+            executor.submit(load_or_generate_digest, run_week, cohort, limits): cohort
+            for (run_week, _), cohort in cohorts.items()
+        }
+        for future in futures:
+            try:
+                results[future.result()] += 1
+            except Exception as e:
+                logger.error(f"Error generando resumen de cohorte: {str(e)}")
+                results["failed"] += 1
+
+    logger.info(
+        f"Pregeneración completada: {results['generated']} generados, "
+        f"{results['stored']} ya existentes, {results['failed']} fallidos"
+    )
+    return results
+
+
+def get_claimable_query(query: dict, now: datetime) -> dict:
+    """Añade a la consulta de pendientes la condición de no tener una reserva vigente."""
+    return {
+        "$and": [
+            query,
+            {"$or": [{"send_lease": None}, {"send_lease.expires_at": {"$lte": now}}]},
+        ]
+    }
+
+
+def claim_pending_users(query: dict, limit: int, lease_seconds: Optional[int] = None, runner_id: str = RUNNER_ID) -> List[dict]:
+    """Reserva de forma atómica una tanda de usuarios pendientes para este proceso.
+
+    Los usuarios se reservan en orden de prioridad (DUE_SORT): primero los de pago, después
+    los que fallaron en envíos anteriores y por último los más atrasados.
+
+    Cada usuario reservado recibe un campo `send_lease` con el proceso propietario y la
+    fecha de caducidad. Otros procesos solo pueden reservar usuarios sin reserva o con la
+    reserva caducada, por lo que varios procesos (o el cron y el endpoint a la vez) pueden
+    vaciar la cola en paralelo sin enviar dos veces al mismo usuario.
+
+    Args:
+        query (dict): Consulta de usuarios pendientes.
+        limit (int): Número máximo de usuarios a reservar.
+        lease_seconds (int, optional): Duración de la reserva. Defaults to EMAIL_LEASE_SECONDS.
+        runner_id (str, optional): Identificador del proceso. Defaults to RUNNER_ID.
+
+    Returns:
+        list: Usuarios reservados (con la proyección USER_PROJECTION). Puede estar vacía
+        aunque queden usuarios si otro proceso se ha adelantado.
+    """
+    now = datetime.now(timezone.utc)
+    claimable = get_claimable_query(query, now)
+
+    candidate_ids = [user["_id"] for user in users_collection.find(claimable, {"_id": 1}, sort=DUE_SORT, limit=limit)]
+    if not candidate_ids:
+        return []
+
+    # La condición se vuelve a evaluar por documento, así que si otro proceso reserva
+    # alguno de los candidatos entre medias, no se sobrescribe su reserva
+    token = ObjectId()
+    users_collection.update_many(
+        {"$and": [claimable, {"_id": {"$in": candidate_ids}}]},
+        {
+            "$set": {
+                "send_lease": {
+                    "owner": runner_id,
+                    "token": token,
+                    "expires_at": now + timedelta(seconds=lease_seconds or EMAIL_LEASE_SECONDS),
+                }
+            }
+        },
+    )
+
+    return list(users_collection.find({"send_lease.token": token}, USER_PROJECTION))
+
+
+def has_claimable_users(query: dict) -> bool:
+    """Comprueba si queda algún usuario pendiente sin reserva (o con la reserva caducada)."""
+    return users_collection.find_one(get_claimable_query(query, datetime.now(timezone.utc)), {"_id": 1}) is not None
+
+
+def iter_claimed_chunks(
+    query: dict,
+    size: int,
+    max_users: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> Iterator[List[dict]]:
+    """Reserva y devuelve tandas de usuarios pendientes hasta que no quede ninguno disponible,
+    se hayan reservado `max_users` usuarios o se alcance `deadline` (segundos de time.monotonic)."""
+    claimed = 0
+    while True:
+        limit = size if max_users is None else min(size, max_users - claimed)
+        if limit <= 0 or (deadline is not None and time.monotonic() >= deadline):
+            return
+        with metrics.time("claim"):
+            chunk = claim_pending_users(query, limit)
+        if chunk:
+            claimed += len(chunk)
+            yield chunk
+        elif not has_claimable_users(query):
+            return
+
+
+def start_send_run(slice_end: Optional[datetime] = None) -> Tuple[str, datetime, dict]:
+    """Prepara una ejecución del envío: calcula la consulta de la franja actual (o de la
+    indicada en `slice_end`, al retomar una ejecución por tramos) y registra (o reanuda) la
+    ejecución de la semana.
+
+    Los usuarios sin `next_send_at` no se procesan, los que no tienen `send_priority` se
+    ordenan como los gratuitos y los que no tienen `email_lower` no pueden iniciar sesión hasta
+    que se ejecuta `python maintenance.py migrate` (run_migrations), que se hace una sola vez
+    al desplegar.
+
+    Returns:
+        tuple: Semana del envío, final de la franja y consulta de usuarios pendientes
+    """
+    metrics.reset()
+
+    create_schedule_indexes()
+
+    # Buscar usuarios activos cuyo envío toca en esta franja o en una anterior
+    slice_end = slice_end or get_slice_end()
+    query = get_due_query(slice_end)
+
+    # Registrar la ejecución de la semana (o reanudarla si ya se había iniciado)
+    run_week = get_run_week()
+    create_send_ledger_indexes()
+    create_retry_indexes()
+    start_run(run_week)
+
+    return run_week, slice_end, query
+
+
+def skip_already_sent(run_week: str, chunk: List[dict], interval_days: Optional[int] = None) -> Tuple[List[dict], int]:
+    """Quita de la tanda a los usuarios que ya recibieron el correo en una ejecución anterior
+    de la semana y completa su last_email_sent, que pudo quedarse sin escribir.
+
+    Returns:
+        tuple: Usuarios pendientes de la tanda y número de usuarios saltados
+    """
+    sent_ids = get_sent_user_ids(run_week, [user["_id"] for user in chunk])
+    if not sent_ids:
+        return chunk, 0
+
+    sent_at = datetime.now(timezone.utc)
+    users_collection.bulk_write(
+        [build_sent_update(user_id, sent_at, interval_days) for user_id in sent_ids], ordered=False
+    )
+    return [user for user in chunk if user["_id"] not in sent_ids], len(sent_ids)
+
+
+def skip_pending_retries(chunk: List[dict]) -> List[dict]:
+    """Quita de la tanda a los usuarios con un correo en la cola de reintentos, que les llegará
+    con el reintento, y mantiene su reserva hasta entonces."""
+    retry_ids = hold_pending_retries([user["_id"] for user in chunk], EMAIL_LEASE_SECONDS)
+    if not retry_ids:
+        return chunk
+    return [user for user in chunk if user["_id"] not in retry_ids]
+
+
+def queue_cohorts(run_week: str, chunk: List[dict]) -> Dict[CohortKey, DigestCohort]:
+    """Agrupa la tanda en cohortes que comparten el mismo boletín y las marca como "queued"."""
+    cohorts = group_users_into_cohorts(chunk)
+    for cohort in cohorts.values():
+        mark_users(run_week, cohort.users, "queued", cohort.cohort_id)
+    return cohorts
+
+
+def apply_cohort_bodies(
+    run_week: str,
+    cohorts: Dict[CohortKey, DigestCohort],
+    new_cohorts: List[DigestCohort],
+    bodies: Dict[CohortKey, Optional[str]],
+) -> None:
+    """Guarda en `bodies` los cuerpos recién generados, asigna a cada cohorte de la tanda el
+    suyo y marca como "generated" a los usuarios de las cohortes con contenido."""
+    for cohort in new_cohorts:
+        bodies[cohort.key] = cohort.body
+    for key, cohort in cohorts.items():
+        cohort.body = bodies[key]
+        if cohort.body is not None:
+            mark_users(run_week, cohort.users, "generated", cohort.cohort_id)
+
+
+def split_send_batches(cohorts: Dict[CohortKey, DigestCohort]) -> List[List[Tuple[dict, DigestCohort]]]:
+    """Reparte los usuarios de las cohortes en lotes de RESEND_BATCH_LIMIT."""
+    entries = [(user, cohort) for cohort in cohorts.values() for user in cohort.users]
+    return [entries[start:start + RESEND_BATCH_LIMIT] for start in range(0, len(entries), RESEND_BATCH_LIMIT)]
+
+
+def log_digest_result(cohort: DigestCohort, result: str) -> None:
+    """Avisa de las cohortes cuyo resumen no estaba pregenerado."""
+    if result == "missing":
+        logger.warning(f"La cohorte {cohort.cohort_id} no tiene resumen pregenerado, se usará el contenido de respaldo")
+    elif result == "generated":
+        logger.warning(f"La cohorte {cohort.cohort_id} no tenía resumen pregenerado, se ha generado durante el envío")
+
+
+def process_retry_queue(
+    limits: Optional[Dict[str, threading.Semaphore]] = None,
+    batch_size: Optional[int] = None,
+    writer: Optional[LastSentWriter] = None,
+) -> Tuple[int, int]:
+    """Reintenta los correos de la cola de reintentos cuyo siguiente intento ya toca.
+
+    Los correos se reenvían tal y como se generaron, en lotes de RESEND_BATCH_LIMIT. Los aceptados
+    se quitan de la cola y actualizan `last_email_sent` como un envío normal; los rechazados se
+    vuelven a planificar con una espera mayor o, si han agotado EMAIL_RETRY_MAX_ATTEMPTS intentos,
+    pasan a la cola de perdidos (email_dead_letters).
+
+    Args:
+        limits (dict, optional): Semáforos por etapa, ver send_weekly_batch.
+        batch_size (int, optional): Reintentos a reservar por tanda. Defaults to EMAIL_CURSOR_BATCH_SIZE.
+        writer (LastSentWriter, optional): Buffer compartido para escribir `last_email_sent`.
+            Si no se indica, se escriben al terminar.
+
+    Returns:
+        tuple: Número de correos reenviados y número de correos que han vuelto a fallar.
+    """
+    limits = limits or {}
+    if writer is None:
+        with LastSentWriter() as retry_writer:
+            return process_retry_queue(limits, batch_size, retry_writer)
+
+    batch_size = max(1, batch_size or EMAIL_CURSOR_BATCH_SIZE)
+    sent_count = 0
+    failed_count = 0
+    # Los que vuelven a fallar se planifican para después de `started_at`, así que cada
+    # reintento se intenta como mucho una vez por llamada
+    started_at = datetime.now(timezone.utc)
+    while True:
+        retries = claim_due_retries(batch_size, EMAIL_LEASE_SECONDS, started_at)
+        if not retries:
+            break
+
+        for start in range(0, len(retries), RESEND_BATCH_LIMIT):
+            batch = retries[start:start + RESEND_BATCH_LIMIT]
+            with limits.get("send", nullcontext()):
+                with metrics.time("retry"):
+                    results = send_batch_emails([(retry["email"], retry["subject"], retry["html"]) for retry in batch])
+
+            sent = []
+            failures = []
+            for retry, result in zip(batch, results):
+                if result["success"]:
+                    writer.add(retry["user_id"])
+                    sent.append(retry)
+                else:
+                    failures.append({
+                        "retry": retry,
+                        "error": result["error"],
+                        "retryable": result.get("retryable", True),
+                        "retry_after": result.get("retry_after"),
+                    })
+
+            complete_retries(sent)
+            dead = reschedule_retries(failures, EMAIL_LEASE_SECONDS)
+            for week in {retry["run_week"] for retry in batch}:
+                mark_users(week, [{"_id": r["user_id"], "email": r["email"]} for r in sent if r["run_week"] == week], "sent")
+
+            sent_count += len(sent)
+            failed_count += len(failures)
+            metrics.increment("retries_sent", len(sent))
+            metrics.increment("dead_letters", len(dead))
+            for retry in dead:
+                logger.error(
+                    f"El correo a {retry['email']} se da por perdido tras {retry['attempts']} intentos: {retry['last_error']}"
+                )
+
+    if sent_count or failed_count:
+        logger.info(f"Reintentos: {sent_count} reenviados, {failed_count} fallidos de nuevo")
+    return sent_count, failed_count
+
+
+def build_run_report(
+    started_at: datetime,
+    total_users: int,
+    success_count: int,
+    error_count: int,
+    skipped_count: int,
+    cohort_count: int,
+) -> Dict[str, Any]:
+    """Construye el informe de una ejecución: contadores, latencias e histogramas por etapa,
+    aciertos de la caché, tasa de error de cada proveedor, esperas de los limitadores y
+    límite adaptativo de peticiones en vuelo de cada proveedor."""
+    finished_at = datetime.now(timezone.utc)
+    return {
+        "runner_id": RUNNER_ID,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "seconds": round((finished_at - started_at).total_seconds(), 3),
+        "users": {"total": total_users, "sent": success_count, "errors": error_count, "skipped": skipped_count},
+        "cohorts": cohort_count,
+        **metrics.report(),
+        "rate_limits": RateLimiter.get_stats(),
+        "concurrency": RateLimiter.get_concurrency_stats(),
+    }
+
+
+def log_run_summary(report: Dict[str, Any]) -> None:
+    """Registra el resumen de una ejecución, el p95 de cada etapa, la caché, los errores de
+    los proveedores y las esperas de cada limitador de peticiones."""
+    users = report["users"]
+    logger.info(
+        f"Se procesaron {users['total']} usuarios en {report['cohorts']} cohortes "
+        f"({users['skipped']} ya enviados en una ejecución anterior) en {report['seconds']}s"
+    )
+
+    for stage, stats in report["stages"].items():
+        logger.info(f"Etapa {stage}: {stats['count']} medidas, p50 {stats['p50']}s, p95 {stats['p95']}s, total {stats['total']}s")
+
+    cache = report["cache"]
+    tiers = ", ".join(f"{tier} {stats['hits']}/{stats['hits'] + stats['misses']}" for tier, stats in cache["tiers"].items())
+    logger.info(
+        f"Caché: {cache['hits']} aciertos, {cache['misses']} fallos, {cache['coalesced']} compartidos "
+        f"(aciertos por nivel: {tiers}); guardados {cache['bytes']['stored']} de {cache['bytes']['raw']} bytes"
+    )
+
+    counters = report["counters"]
+    if counters.get("retries_queued") or counters.get("retries_sent") or counters.get("dead_letters"):
+        logger.info(
+            f"Reintentos: {counters.get('retries_queued', 0)} encolados, {counters.get('retries_sent', 0)} reenviados, "
+            f"{counters.get('dead_letters', 0)} perdidos"
         )
 
-        # Enviar el correo
-        logger.info(f"Enviando correo a {email}")
-        send_email(email, subject, summary_content)
+    for provider, stats in report["providers"].items():
+        logger.info(f"Proveedor {provider}: {stats['calls']} llamadas, {stats['errors']} errores")
 
-        # Actualizar la fecha del último correo enviado
-        users_collection.update_one(
-            {"_id": user["_id"]},
-            {"$set": {"last_email_sent": datetime.now(timezone.utc)}},
+    for provider, stats in report["rate_limits"].items():
+        logger.info(
+            f"Limitador {provider}: {stats['calls']} llamadas, "
+            f"{stats['wait_seconds']}s de espera (máximo {stats['max_wait_seconds']}s)"
+        )
+
+    for provider, stats in report["concurrency"].items():
+        logger.info(
+            f"Concurrencia {provider}: límite {stats['limit']} de {stats['max_limit']} "
+            f"(máximo en vuelo {stats['peak_in_flight']}, {stats['increases']} subidas, {stats['decreases']} bajadas)"
         )
 
-        logger.info(f"Correo enviado exitosamente a {email}")
-        return True
 
+def finish_send_run(
+    started_at: datetime,
+    total_users: int,
+    success_count: int,
+    error_count: int,
+    skipped_count: int,
+    cohort_count: int,
+    run_id: Optional[ObjectId] = None,
+) -> None:
+    """Registra el informe de la ejecución en el log y lo guarda en maintenance_runs, en la
+    ejecución encolada `run_id` o, si se ha lanzado directamente, en un documento nuevo."""
+    report = build_run_report(started_at, total_users, success_count, error_count, skipped_count, cohort_count)
+    log_run_summary(report)
+    try:
+        save_run_report("send_weekly_emails", report, run_id)
     except Exception as e:
-        logger.error(f"Error enviando correo a {user['email']}: {str(e)}")
-        return False
+        logger.error(f"Error guardando el informe de la ejecución: {str(e)}")
+
+
+def build_progress(
+    total_users: int,
+    skipped_count: int,
+    error_count: int,
+    writer: "LastSentWriter",
+    last_user_id: Optional[ObjectId] = None,
+) -> Dict[str, Any]:
+    """Construye los contadores de progreso de una ejecución. Los enviados son los ya
+    confirmados por el writer, por lo que pueden ir por detrás de los lotes aceptados."""
+    return {
+        "total": total_users,
+        "sent": writer.written,
+        "errors": error_count + writer.failed,
+        "skipped": skipped_count,
+        "last_user_id": str(last_user_id) if last_user_id else None,
+    }
 
 
-def process_pending_emails(days_interval: int = 6) -> tuple:
+def process_pending_emails(
+    interval_days: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    generation_concurrency: Optional[int] = None,
+    send_concurrency: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    generate_missing: Optional[bool] = None,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    slice_end: Optional[datetime] = None,
+    max_users: Optional[int] = None,
+    max_seconds: Optional[float] = None,
+    run_id: Optional[ObjectId] = None,
+) -> tuple:
     """Procesa los correos pendientes de los usuarios, enviándolos si es necesario.
     Si no hay correos pendientes, no hace nada.
 
-    Por defecto son 6 ya que el mensaje puede tardar en enviarse, haciendo que el usuario tarde más de 7 días en recibirlo.
+    Solo se procesan los usuarios cuyo `next_send_at` cae antes del final de la franja actual
+    del planificador (EMAIL_SCHEDULE_SLICE_MINUTES), con un recorrido por rango del índice, y en
+    orden de prioridad (plan, fallos anteriores y retraso), de forma que si la ejecución se corta
+    por tiempo o por cuota los usuarios de pago ya tienen su correo.
+
+    Como cada usuario tiene su propia hora de envío, ejecutar el proceso en cada franja reparte
+    los envíos a lo largo del día. Tras cada envío se planifica el siguiente `interval_days`
+    días después, a la misma hora.
+
+    Al terminar se reintentan los correos de la cola de reintentos que ya tocan (ver
+    process_retry_queue). Los reenviados cuentan como usuarios procesados y como enviados, y
+    los que vuelven a fallar como errores.
+
+    Los usuarios se reservan con claim_pending_users en tandas de `batch_size`, por lo que la
+    memoria no depende del número de usuarios pendientes y varios procesos pueden repartirse
+    el trabajo sin duplicados.
+
+    El estado de cada usuario se guarda en el registro de la semana (send_ledger), de forma que
+    si la ejecución se interrumpe, la siguiente se salta a los usuarios ya enviados y reutiliza
+    el contenido ya generado.
+
+    Cada tanda se agrupa en cohortes (idioma, proveedor de IA, proveedor de búsqueda y prompt) y
+    el boletín se genera una sola vez por cohorte durante toda la ejecución. Los correos se
+    envían en lotes de RESEND_BATCH_LIMIT por llamada y las fechas de último envío se escriben
+    en bloque con LastSentWriter.
+
+    Tanto las generaciones como los envíos se ejecutan en un pool de hilos acotado, de forma que
+    el tiempo total depende del proveedor más lento y no de la suma de todos los usuarios.
+    Además, cada etapa (generación y envío) tiene su propio límite de concurrencia.
 
     Args:
-        days_interval (int, optional): Número de días para considerar un correo como pendiente. Defaults to 6.
+        interval_days (int, optional): Días hasta el siguiente envío de cada usuario. Defaults to EMAIL_SEND_INTERVAL_DAYS.
+            Sustituye a `days_interval`, que eran los días sin correo tras los que un usuario
+            pasaba a estar pendiente (6 por defecto). Los pendientes ahora son los que tienen
+            `next_send_at` dentro de la franja, y este valor solo planifica el siguiente envío.
+        max_workers (int, optional): Número de hilos del pool. Defaults to EMAIL_WORKERS.
+        generation_concurrency (int, optional): Generaciones simultáneas como máximo. Defaults to EMAIL_GENERATION_CONCURRENCY.
+        send_concurrency (int, optional): Envíos simultáneos como máximo. Defaults to EMAIL_SEND_CONCURRENCY.
+        batch_size (int, optional): Usuarios por tanda reservada. Defaults to EMAIL_CURSOR_BATCH_SIZE.
+        generate_missing (bool, optional): Si se generan los resúmenes que no se hayan pregenerado
+            con pregenerate_digests. Defaults to EMAIL_GENERATE_ON_SEND.
+        on_progress (callable, optional): Función que recibe los contadores de progreso
+            (total, sent, errors, skipped) y el último usuario procesado tras cada tanda y al terminar.
+        slice_end (datetime, optional): Final de la franja a procesar. Por defecto el de la franja actual.
+        max_users (int, optional): Usuarios a reservar como máximo en esta llamada. Sin límite por defecto.
+        max_seconds (float, optional): Segundos tras los que no se reservan más tandas. Los lotes
+            ya reservados se terminan de enviar, así que conviene dejar margen hasta el límite real.
+        run_id (ObjectId, optional): Ejecución encolada en maintenance_runs a la que se añade el
+            informe final (latencias por etapa, caché y errores de los proveedores). Si no se indica,
+            el informe se guarda en un documento nuevo.
 
     Returns:
         tuple: Contiene el número total de usuarios procesados, el número de correos enviados exitosamente y el número de errores.
     """
-    # Calcular la fecha límite (ahora - intervalo de días)
-    cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_interval)
-
-    # Buscar usuarios que no han recibido un correo en el intervalo especificado
-    # o que nunca han recibido un correo (last_email_sent es null)
-    query = {
-        "$or": [{"last_email_sent": {"$lt": cutoff_date}}, {"last_email_sent": None}],
-        "account_status": "active",  # Solo usuarios activos
+    max_workers = max(1, max_workers or EMAIL_WORKERS)
+    batch_size = max(1, batch_size or EMAIL_CURSOR_BATCH_SIZE)
+    limits = {
+        "generation": threading.BoundedSemaphore(max(1, generation_concurrency or EMAIL_GENERATION_CONCURRENCY)),
+        "send": threading.BoundedSemaphore(max(1, send_concurrency or EMAIL_SEND_CONCURRENCY)),
     }
 
-    # Obtener la lista de usuarios que necesitan recibir correo
-    users_to_process = list(users_collection.find(query))
-    total_users = len(users_to_process)
+    started_at = datetime.now(timezone.utc)
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    run_week, slice_end, query = start_send_run(slice_end)
 
-    logger.info(f"Se encontraron {total_users} usuarios para procesar")
+    logger.info(
+        f"Procesando usuarios pendientes hasta {slice_end.isoformat()} (semana {run_week}) en tandas de {batch_size} "
+        f"con {max_workers} hilos (proceso {RUNNER_ID})"
+    )
 
-    success_count = 0
+    total_users = 0
+    skipped_count = 0
     error_count = 0
+    last_user_id = None
 
-    # Procesar cada usuario
-    for user in users_to_process:
+    # Cuerpos ya generados por clave de cohorte, compartidos entre tandas
+    bodies: Dict[CohortKey, Optional[str]] = {}
+
+    if generate_missing is None:
+        generate_missing = EMAIL_GENERATE_ON_SEND
+
+    def generate(cohort: DigestCohort) -> None:
+        # Reutilizar el contenido pregenerado o generado en una ejecución anterior de la semana
+        log_digest_result(cohort, load_or_generate_digest(run_week, cohort, limits, generate_missing))
+
+    def collect(done_futures) -> None:
+        nonlocal error_count
+        for future in done_futures:
+            batch = in_flight.pop(future)
+            try:
+                # Los aceptados se cuentan como éxitos cuando el writer los confirma
+                _, batch_errors = future.result()
+                error_count += batch_errors
+            except Exception as e:
+                logger.error(f"Error procesando lote de {len(batch)} usuarios: {str(e)}")
+                error_count += len(batch)
+        writer.flush_if_due()
+
+    in_flight = {}
+    writer = LastSentWriter(interval_days=interval_days)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="email") as executor:
         try:
-            # Añadir un pequeño retraso para evitar sobrecargar el sistema
-            time.sleep(1)
+            for chunk in iter_claimed_chunks(query, batch_size, max_users, deadline):
+                last_user_id = max(user["_id"] for user in chunk)
+                chunk, skipped = skip_already_sent(run_week, chunk, interval_days)
+                chunk = skip_pending_retries(chunk)
+                skipped_count += skipped
+                total_users += len(chunk)
 
-            result = send_weekly_email(user)
-            if result:
-                success_count += 1
-            else:
-                error_count += 1
-        except Exception as e:
-            logger.error(f"Error procesando usuario {user['email']}: {str(e)}")
-            error_count += 1
+                cohorts = queue_cohorts(run_week, chunk)
+
+                # Generar en paralelo solo las cohortes que no se han visto en tandas anteriores
+                new_cohorts = [cohort for key, cohort in cohorts.items() if key not in bodies]
+                generations = [executor.submit(generate, cohort) for cohort in new_cohorts]
+                for future in generations:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        # Los usuarios de la cohorte recibirán el contenido de respaldo
+                        logger.error(f"Error generando resumen de cohorte: {str(e)}")
+                apply_cohort_bodies(run_week, cohorts, new_cohorts, bodies)
+
+                # Enviar los correos en lotes de RESEND_BATCH_LIMIT manteniendo
+                # como mucho 2 * max_workers lotes en vuelo
+                for batch in split_send_batches(cohorts):
+                    if len(in_flight) >= max_workers * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    in_flight[executor.submit(send_weekly_batch, batch, limits, writer, run_week)] = batch
+
+                if on_progress:
+                    on_progress(build_progress(total_users, skipped_count, error_count, writer, last_user_id))
+
+            collect(wait(in_flight).done)
+        finally:
+            # Escribir siempre las actualizaciones pendientes, también si la ejecución se interrumpe
+            wait(in_flight)
+            writer.flush()
+
+    try:
+        # Con el mismo writer los reenviados se cuentan como enviados de la ejecución
+        retry_sent, retry_failed = process_retry_queue(limits, batch_size, writer)
+        total_users += retry_sent + retry_failed
+        error_count += retry_failed
+    except Exception as e:
+        logger.error(f"Error procesando la cola de reintentos: {str(e)}")
+    finally:
+        writer.flush()
+
+    if on_progress:
+        on_progress(build_progress(total_users, skipped_count, error_count, writer, last_user_id))
+
+    success_count = writer.written
+    error_count += writer.failed
+
+    finish_send_run(started_at, total_users, success_count, error_count, skipped_count, len(bodies), run_id)
 
     return total_users, success_count, error_count
 
 
+async def load_or_generate_digest_async(run_week: str, cohort: DigestCohort, generate_missing: bool = True) -> str:
+    """Versión asíncrona de load_or_generate_digest. Los accesos a MongoDB se hacen en un hilo
+    aparte y la generación usa los clientes asíncronos de los proveedores.
+
+    Returns:
+        str: "stored", "generated", "failed" o "missing", ver load_or_generate_digest.
+    """
+    with metrics.time("digest_load"):
+        stored = await asyncio.to_thread(get_run_digest, run_week, cohort.cohort_id)
+    if stored and is_valid_digest_body(stored.get("body")):
+        cohort.body = stored["body"]
+        return "stored"
+
+    if not generate_missing:
+        return "missing"
+
+    logger.info(
+        f"Generando resumen para la cohorte "
+        f"({cohort.language}, {cohort.ai_provider}, {cohort.search_provider})"
+    )
+    with metrics.time("generation"):
+        await generate_cohort_digest_async(cohort)
+
+    if not is_valid_digest_body(cohort.body):
+        cohort.body = None
+        return "failed"
+
+    await asyncio.to_thread(save_run_digest, run_week, cohort.cohort_id, cohort.body)
+    return "generated"
+
+
+async def process_pending_emails_async(
+    interval_days: Optional[int] = None,
+    generation_concurrency: Optional[int] = None,
+    send_concurrency: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    generate_missing: Optional[bool] = None,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    slice_end: Optional[datetime] = None,
+    max_users: Optional[int] = None,
+    max_seconds: Optional[float] = None,
+    run_id: Optional[ObjectId] = None,
+) -> tuple:
+    """Versión asíncrona de process_pending_emails.
+
+    Las generaciones de las cohortes se ejecutan como corrutinas con los clientes asíncronos
+    de los proveedores (AsyncOpenAI y httpx), de forma que un solo proceso puede mantener
+    cientos de llamadas en vuelo sin un hilo por llamada. Las operaciones de MongoDB y los
+    lotes de Resend, que son pocos y rápidos, se delegan a hilos con asyncio.to_thread.
+    La reserva de usuarios, el registro de envíos y la escritura de fechas son los mismos
+    que en la versión síncrona.
+
+    Args:
+        interval_days (int, optional): Días hasta el siguiente envío de cada usuario. Defaults to EMAIL_SEND_INTERVAL_DAYS.
+        generation_concurrency (int, optional): Generaciones simultáneas como máximo. Defaults to EMAIL_ASYNC_GENERATION_CONCURRENCY.
+        send_concurrency (int, optional): Lotes de envío simultáneos como máximo. Defaults to EMAIL_SEND_CONCURRENCY.
+        batch_size (int, optional): Usuarios por tanda reservada. Defaults to EMAIL_CURSOR_BATCH_SIZE.
+        generate_missing (bool, optional): Si se generan los resúmenes que no se hayan pregenerado.
+            Defaults to EMAIL_GENERATE_ON_SEND.
+        on_progress (callable, optional): Función que recibe los contadores de progreso, ver process_pending_emails.
+        slice_end, max_users, max_seconds, run_id: Ver process_pending_emails.
+
+    Returns:
+        tuple: Número total de usuarios procesados, correos enviados y errores.
+    """
+    batch_size = max(1, batch_size or EMAIL_CURSOR_BATCH_SIZE)
+    send_concurrency = max(1, send_concurrency or EMAIL_SEND_CONCURRENCY)
+    generation_limit = asyncio.Semaphore(max(1, generation_concurrency or EMAIL_ASYNC_GENERATION_CONCURRENCY))
+    send_limit = asyncio.Semaphore(send_concurrency)
+    if generate_missing is None:
+        generate_missing = EMAIL_GENERATE_ON_SEND
+
+    started_at = datetime.now(timezone.utc)
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    run_week, slice_end, query = await asyncio.to_thread(start_send_run, slice_end)
+
+    logger.info(
+        f"Procesando usuarios pendientes hasta {slice_end.isoformat()} (semana {run_week}) en tandas de {batch_size} "
+        f"con asyncio (proceso {RUNNER_ID})"
+    )
+
+    total_users = 0
+    skipped_count = 0
+    error_count = 0
+    last_user_id = None
+    bodies: Dict[CohortKey, Optional[str]] = {}
+
+    async def generate(cohort: DigestCohort) -> None:
+        async with generation_limit:
+            log_digest_result(cohort, await load_or_generate_digest_async(run_week, cohort, generate_missing))
+
+    async def send(batch: List[Tuple[dict, DigestCohort]]) -> Tuple[int, int]:
+        async with send_limit:
+            return await asyncio.to_thread(send_weekly_batch, batch, None, writer, run_week)
+
+    def collect(done_tasks) -> None:
+        nonlocal error_count
+        for task in done_tasks:
+            batch = in_flight.pop(task)
+            try:
+                _, batch_errors = task.result()
+                error_count += batch_errors
+            except Exception as e:
+                logger.error(f"Error procesando lote de {len(batch)} usuarios: {str(e)}")
+                error_count += len(batch)
+        writer.flush_if_due()
+
+    in_flight: Dict[asyncio.Task, List[Tuple[dict, DigestCohort]]] = {}
+    writer = LastSentWriter(interval_days=interval_days)
+    chunks = iter_claimed_chunks(query, batch_size, max_users, deadline)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            last_user_id = max(user["_id"] for user in chunk)
+
+            chunk, skipped = await asyncio.to_thread(skip_already_sent, run_week, chunk, interval_days)
+            chunk = await asyncio.to_thread(skip_pending_retries, chunk)
+            skipped_count += skipped
+            total_users += len(chunk)
+
+            cohorts = await asyncio.to_thread(queue_cohorts, run_week, chunk)
+
+            new_cohorts = [cohort for key, cohort in cohorts.items() if key not in bodies]
+            results = await asyncio.gather(*(generate(cohort) for cohort in new_cohorts), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Error generando resumen de cohorte: {str(result)}")
+            await asyncio.to_thread(apply_cohort_bodies, run_week, cohorts, new_cohorts, bodies)
+
+            for batch in split_send_batches(cohorts):
+                if len(in_flight) >= send_concurrency * 2:
+                    done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    collect(done)
+                in_flight[asyncio.create_task(send(batch))] = batch
+
+            if on_progress:
+                await asyncio.to_thread(on_progress, build_progress(total_users, skipped_count, error_count, writer, last_user_id))
+
+        if in_flight:
+            done, _ = await asyncio.wait(in_flight)
+            collect(done)
+    finally:
+        if in_flight:
+            await asyncio.wait(in_flight)
+        await asyncio.to_thread(writer.flush)
+        # Los clientes están ligados a este bucle de eventos, que termina con la ejecución
+        await close_async_clients()
+
+    try:
+        retry_sent, retry_failed = await asyncio.to_thread(process_retry_queue, None, batch_size, writer)
+        total_users += retry_sent + retry_failed
+        error_count += retry_failed
+    except Exception as e:
+        logger.error(f"Error procesando la cola de reintentos: {str(e)}")
+    finally:
+        await asyncio.to_thread(writer.flush)
+
+    if on_progress:
+        await asyncio.to_thread(on_progress, build_progress(total_users, skipped_count, error_count, writer, last_user_id))
+
+    success_count = writer.written
+    error_count += writer.failed
+
+    await asyncio.to_thread(
+        finish_send_run, started_at, total_users, success_count, error_count, skipped_count, len(bodies), run_id
+    )
+
+    return total_users, success_count, error_count
+
+
+def merge_progress(previous: Dict[str, Any], counters: Dict[str, Any]) -> Dict[str, Any]:
+    """Suma los contadores de un tramo a los acumulados por los tramos anteriores de la ejecución."""
+    merged = dict(previous)
+    for key, value in counters.items():
+        if key == "last_user_id":
+            merged[key] = value or previous.get(key)
+        else:
+            merged[key] = previous.get(key, 0) + value
+    return merged
+
+
+def execute_send_run(
+    run_id: Optional[ObjectId] = None,
+    use_async: bool = False,
+    continuation: Optional[str] = None,
+    max_users: Optional[int] = None,
+    max_seconds: Optional[float] = None,
+    **options,
+) -> Optional[Dict[str, Any]]:
+    """Recoge una ejecución encolada del envío semanal (la indicada o la más antigua), la
+    ejecuta guardando su progreso en `maintenance_runs` y la marca como terminada o fallida.
+
+    Con `max_users` o `max_seconds` solo se ejecuta un tramo: si al terminarlo quedan usuarios
+    pendientes, la ejecución vuelve a la cola con un token de continuación que hay que presentar
+    para retomarla. Todos los tramos procesan la franja del planificador del primero y acumulan
+    sus contadores en la misma ejecución.
+
+    Args:
+        run_id (ObjectId, optional): Ejecución concreta a ejecutar, por ejemplo la recién encolada por el endpoint.
+        use_async (bool): Si se usa process_pending_emails_async en lugar de la versión con hilos.
+        continuation (str, optional): Token devuelto por el tramo anterior.
+        max_users (int, optional): Usuarios a procesar como máximo en este tramo.
+        max_seconds (float, optional): Segundos tras los que el tramo deja de reservar usuarios.
+        **options: Parámetros de concurrencia que se pasan al proceso de envío.
+
+    Returns:
+        dict | None: ID, estado, contadores acumulados y token de continuación (None si ha
+        terminado) de la ejecución, o None si no había ninguna disponible
+    """
+    run = claim_run("send_weekly_emails", RUNNER_ID, run_id, continuation)
+    if run is None:
+        return None
+
+    logger.info(f"Iniciando la ejecución encolada {run['_id']} (tramo {run.get('invocations', 1)})")
+    previous: Dict[str, Any] = dict(run.get("progress") or {})
+    progress: Dict[str, Any] = dict(previous)
+
+    slice_end = run.get("slice_end")
+    if slice_end is None:
+        slice_end = get_slice_end()
+        save_run_slice_end(run["_id"], slice_end)
+
+    def on_progress(counters: Dict[str, Any]) -> None:
+        progress.update(merge_progress(previous, counters))
+        update_run_progress(run["_id"], progress)
+
+    options.update(
+        on_progress=on_progress, slice_end=slice_end, max_users=max_users, max_seconds=max_seconds, run_id=run["_id"]
+    )
+    try:
+        if use_async:
+            asyncio.run(process_pending_emails_async(**options))
+        else:
+            process_pending_emails(**options)
+    except Exception as e:
+        logger.error(f"Error en la ejecución encolada {run['_id']}: {str(e)}")
+        finish_run(run["_id"], progress, str(e))
+        raise
+
+    chunked = max_users is not None or max_seconds is not None
+    if chunked and has_claimable_users(get_due_query(slice_end)):
+        next_continuation = encode_continuation(run["_id"], progress.get("last_user_id"))
+        pause_run(run["_id"], progress, next_continuation)
+        logger.info(f"Tramo de la ejecución {run['_id']} completado: {progress}")
+        return {"run_id": str(run["_id"]), "status": "queued", "progress": progress, "continuation": next_continuation}
+
+    finish_run(run["_id"], progress)
+    logger.info(f"Ejecución encolada {run['_id']} completada: {progress}")
+    return {"run_id": str(run["_id"]), "status": "completed", "progress": progress, "continuation": None}
+
+
+def run_queued_sends(use_async: bool = False, **options) -> int:
+    """Ejecuta una tras otra las ejecuciones encoladas del envío semanal hasta vaciar la cola.
+
+    Returns:
+        int: Número de ejecuciones procesadas
+    """
+    processed = 0
+    while execute_send_run(use_async=use_async, **options) is not None:
+        processed += 1
+    return processed
+
+
+def run_migrations() -> Dict[str, int]:
+    """Completa los campos añadidos a los usuarios después de su creación (`email_lower`,
+    `next_send_at`, `send_priority` y `send_failures`) y el `expires_at` de las entradas de la
+    caché. Cada migración solo procesa los documentos sin el campo, por lo que se puede ejecutar
+    tantas veces como se quiera. Al final hace único el índice de `email_lower` si no hay
+    cuentas repetidas.
+
+    Returns:
+        dict: Documentos actualizados por cada migración
+    """
+    results = {
+        "email_lower": backfill_email_lower(users_collection),
+        "next_send_at": backfill_next_send_at(),
+        "send_priority": backfill_send_priority(),
+        "cache.expires_at": CacheManager.backfill_cache_expiry(),
+    }
+    for field, updated in results.items():
+        logger.info(f"Migración de {field}: {updated} documentos actualizados")
+
+    duplicates = create_unique_email_index(users_collection)
+    if duplicates:
+        logger.warning(
+            f"No se ha creado el índice único de email_lower: {len(duplicates)} emails con varias cuentas "
+            f"({', '.join(duplicates[:10])})"
+        )
+    return results
+
+
+def run_index_registry(create: bool = True) -> Dict[str, Dict[str, Any]]:
+    """Aplica el registro de índices (api/index_registry.py) a la base de datos y registra en el
+    log los índices que faltaban, los que tienen otras opciones, los que no están en el registro
+    y los que no se han usado desde el último reinicio del servidor.
+
+    Args:
+        create (bool): Si se crean los índices que faltan. Con False solo se informa.
+
+    Returns:
+        dict: Informe por colección, ver apply_index_registry
+    """
+    report = apply_index_registry(db, create)
+    for collection_name, status in report.items():
+        if status["missing"]:
+            action = "creados" if create else "pendientes de crear"
+            logger.info(f"{collection_name}: índices {action}: {', '.join(status['created'] if create else status['missing'])}")
+        if status["conflicts"]:
+            logger.warning(f"{collection_name}: índices con las mismas claves y otras opciones: {', '.join(status['conflicts'])}")
+        if status["unmanaged"]:
+            logger.warning(f"{collection_name}: índices fuera del registro: {', '.join(status['unmanaged'])}")
+        if status["unused"]:
+            logger.warning(f"{collection_name}: índices sin uso desde el último reinicio: {', '.join(status['unused'])}")
+    return report
+
+
+def run_dry_run(
+    user_count: int = 1000,
+    use_async: bool = False,
+    ai_latency: str = "2.0,5.0",
+    search_latency: str = "1.0,2.5",
+    email_latency: str = "0.3,0.8",
+    seed: int = 42,
+    **options,
+) -> Dict[str, Any]:
+    """Simula una ejecución completa del envío con usuarios sintéticos y proveedores falsos.
+
+    Los usuarios se crean en una base de datos temporal (`<base de datos>_dryrun`) que se
+    borra al terminar, y durante la simulación se sustituyen los proveedores de IA y de
+    búsqueda por FakeAIProvider y el transporte de correo por LocalEmailTransport, todos
+    con latencias log-normales deterministas. No se llama a ningún servicio externo ni se
+    modifica ningún usuario real.
+
+    Args:
+        user_count (int, optional): Número de usuarios sintéticos. Defaults to 1000.
+        use_async (bool, optional): Si se usa process_pending_emails_async. Defaults to False.
+        ai_latency (str, optional): Latencia de cada llamada a la IA, "mediana,p95" en segundos.
+        search_latency (str, optional): Latencia de cada búsqueda web, "mediana,p95" en segundos.
+        email_latency (str, optional): Latencia de cada lote de correos, "mediana,p95" en segundos.
+        seed (int, optional): Semilla para los usuarios y las latencias. Defaults to 42.
+        options: Parámetros de concurrencia que se pasan a process_pending_emails.
+
+    Returns:
+        dict: Informe con usuarios por segundo, latencias por etapa y memoria máxima
+    """
+    global users_collection
+
+    dry_run_db = client[f"{db.name}_dryrun"]
+    client.drop_database(dry_run_db.name)
+
+    # Usuarios sintéticos repartidos entre idiomas y proveedores, pendientes desde ya
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    synthetic_users = [
+        {
+            "_id": ObjectId(),
+            "email": f"dry-run-{index}@example.com",
+            "account_status": "active",
+            "language": rng.choice(["es", "en"]),
+            "ai_provider": rng.choice(["groq", "openai", "deepseek"]),
+            "search_provider": rng.choice(["tavily", "serpapi"]),
+            "role": "paid" if rng.random() < 0.2 else "free",
+            "send_failures": 0,
+            "last_email_sent": None,
+            "next_send_at": now - timedelta(minutes=1),
+        }
+        for index in range(user_count)
+    ]
+    for user in synthetic_users:
+        user["send_priority"] = get_send_priority(user["role"])
+    for start in range(0, len(synthetic_users), 1000):
+        dry_run_db["users"].insert_many(synthetic_users[start:start + 1000])
+    del synthetic_users
+
+    transport = services.LocalEmailTransport(
+        latency=LatencyModel.parse(email_latency, seed).sample, keep_outbox=False
+    )
+    fake_providers = {
+        name: FakeAIProvider(
+            name,
+            LatencyModel.parse(ai_latency, seed + index),
+            LatencyModel.parse(search_latency, seed + index + 100),
+        )
+        for index, name in enumerate(["groq", "openai", "deepseek"])
+    }
+
+    # Sustituir colecciones, proveedores y transporte, guardando los originales
+    originals = {
+        "users_collection": users_collection,
+        "schedule_users": schedule_service.users_collection,
+        "send_runs": send_ledger_service.send_runs_collection,
+        "send_ledger": send_ledger_service.send_ledger_collection,
+        "maintenance_runs": maintenance_run_service.maintenance_runs_collection,
+        "retry_users": retry_queue_service.users_collection,
+        "email_retries": retry_queue_service.email_retries_collection,
+        "email_dead_letters": retry_queue_service.email_dead_letters_collection,
+        "ai_providers": dict(services.ai_providers),
+        "email_transport": services.email_transport,
+    }
+    users_collection = dry_run_db["users"]
+    schedule_service.users_collection = dry_run_db["users"]
+    send_ledger_service.send_runs_collection = dry_run_db["send_runs"]
+    send_ledger_service.send_ledger_collection = dry_run_db["send_ledger"]
+    maintenance_run_service.maintenance_runs_collection = dry_run_db["maintenance_runs"]
+    retry_queue_service.users_collection = dry_run_db["users"]
+    retry_queue_service.email_retries_collection = dry_run_db["email_retries"]
+    retry_queue_service.email_dead_letters_collection = dry_run_db["email_dead_letters"]
+    services.ai_providers.clear()
+    services.ai_providers.update(fake_providers)
+    services.email_transport = transport
+
+    logger.info(f"Simulando el envío a {user_count} usuarios sintéticos ({'asyncio' if use_async else 'hilos'})")
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        if use_async:
+            total, success, errors = asyncio.run(process_pending_emails_async(**options))
+        else:
+            total, success, errors = process_pending_emails(**options)
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        users_collection = originals["users_collection"]
+        schedule_service.users_collection = originals["schedule_users"]
+        send_ledger_service.send_runs_collection = originals["send_runs"]
+        send_ledger_service.send_ledger_collection = originals["send_ledger"]
+        maintenance_run_service.maintenance_runs_collection = originals["maintenance_runs"]
+        retry_queue_service.users_collection = originals["retry_users"]
+        retry_queue_service.email_retries_collection = originals["email_retries"]
+        retry_queue_service.email_dead_letters_collection = originals["email_dead_letters"]
+        services.ai_providers.clear()
+        services.ai_providers.update(originals["ai_providers"])
+        services.email_transport = originals["email_transport"]
+        client.drop_database(dry_run_db.name)
+
+    report = {
+        "users": total,
+        "sent": success,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "users_per_second": round(total / elapsed, 2) if elapsed else 0.0,
+        "email_batches": transport.batches,
+        "stages": metrics.summary(),
+        "peak_memory_mb": round(peak_memory / (1024 * 1024), 2),
+    }
+    print_dry_run_report(report)
+    return report
+
+
+def print_dry_run_report(report: Dict[str, Any]) -> None:
+    """Muestra por pantalla el informe de run_dry_run."""
+    print()
+    print(
+        f"Simulación: {report['users']} usuarios en {report['seconds']} s "
+        f"({report['users_per_second']} usuarios/s), {report['sent']} enviados, {report['errors']} errores, "
+        f"{report['email_batches']} lotes de correo"
+    )
+    print(f"{'Etapa':<18}{'n':>8}{'p50 (s)':>12}{'p95 (s)':>12}{'máx (s)':>12}{'total (s)':>12}")
+    for stage, stats in report["stages"].items():
+        print(
+            f"{stage:<18}{stats['count']:>8}{stats['p50']:>12.4f}{stats['p95']:>12.4f}"
+            f"{stats['max']:>12.4f}{stats['total']:>12.4f}"
+        )
+    print(f"Memoria máxima de Python: {report['peak_memory_mb']} MB")
+
+
 if __name__ == "__main__":
-    logger.info("Iniciando proceso de envío de correos semanales")
+    parser = argparse.ArgumentParser(description="Mantenimiento del correo semanal de UpdateMe")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="send",
+        choices=["send", "pregenerate", "worker", "retry", "indexes", "migrate"],
+        help=(
+            "send: envía los correos de la franja actual; pregenerate: genera por adelantado los resúmenes; "
+            "worker: ejecuta los envíos encolados desde el endpoint de mantenimiento; "
+            "retry: reintenta los correos fallidos cuyo siguiente intento ya toca; "
+            "indexes: crea los índices del registro e informa de los que faltan o no se usan; "
+            "migrate: completa los campos nuevos de los usuarios existentes"
+        ),
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Ejecuta el envío con asyncio y los clientes asíncronos de los proveedores",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Simula el envío con usuarios sintéticos y proveedores falsos, sin llamar a servicios externos",
+    )
+    parser.add_argument("--check", action="store_true", help="Con indexes, solo informa sin crear los índices")
+    parser.add_argument("--users", type=int, default=1000, help="Usuarios sintéticos de la simulación")
+    parser.add_argument("--ai-latency", default="2.0,5.0", help="Latencia de la IA en la simulación: mediana[,p95] en segundos")
+    parser.add_argument("--search-latency", default="1.0,2.5", help="Latencia de la búsqueda en la simulación: mediana[,p95]")
+    parser.add_argument("--email-latency", default="0.3,0.8", help="Latencia de cada lote de correos en la simulación: mediana[,p95]")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla de la simulación")
+    parser.add_argument("--workers", type=int, help="Hilos del pool (por defecto EMAIL_WORKERS)")
+    parser.add_argument("--generation-concurrency", type=int, help="Generaciones simultáneas (por defecto según el modo)")
+    parser.add_argument("--send-concurrency", type=int, help="Envíos simultáneos (por defecto EMAIL_SEND_CONCURRENCY)")
+    parser.add_argument("--batch-size", type=int, help="Usuarios por tanda (por defecto EMAIL_CURSOR_BATCH_SIZE)")
+    args = parser.parse_args()
+
+    concurrency = {
+        "generation_concurrency": args.generation_concurrency,
+        "send_concurrency": args.send_concurrency,
+        "batch_size": args.batch_size,
+    }
+    if not args.use_async:
+        concurrency["max_workers"] = args.workers
 
     try:
-        total, success, errors = process_pending_emails()
+        if args.dry_run:
+            run_dry_run(
+                args.users,
+                args.use_async,
+                args.ai_latency,
+                args.search_latency,
+                args.email_latency,
+                args.seed,
+                **concurrency,
+            )
+        elif args.command == "pregenerate":
+            logger.info("Iniciando la pregeneración de los resúmenes semanales")
+            pregenerate_digests()
+        elif args.command == "worker":
+            logger.info("Ejecutando los envíos encolados")
+            processed = run_queued_sends(args.use_async, **concurrency)
+            logger.info(f"Se completaron {processed} ejecuciones encoladas")
+        elif args.command == "migrate":
+            logger.info("Ejecutando las migraciones de los usuarios")
+            run_migrations()
+        elif args.command == "indexes":
+            logger.info("Aplicando el registro de índices" if not args.check else "Comprobando el registro de índices")
+            run_index_registry(create=not args.check)
+        elif args.command == "retry":
+            logger.info("Procesando la cola de reintentos")
+            create_retry_indexes()
+            sent, failed = process_retry_queue(batch_size=args.batch_size)
+            logger.info(f"Reintentos completados: {sent} reenviados, {failed} fallidos de nuevo")
+        else:
+            logger.info("Iniciando proceso de envío de correos semanales")
+            if args.use_async:
+                total, success, errors = asyncio.run(process_pending_emails_async(**concurrency))
+            else:
+                total, success, errors = process_pending_emails(**concurrency)
 
-        logger.info(f"Proceso completado: {total} usuarios procesados")
-        logger.info(f"Éxitos: {success}, Errores: {errors}")
+            logger.info(f"Proceso completado: {total} usuarios procesados")
+            logger.info(f"Éxitos: {success}, Errores: {errors}")
 
     except Exception as e:
         logger.error(f"Error en el proceso principal: {str(e)}")
@@ -19,11 +19,12 @@ class CacheEntry:
     cache_key: str
     """Clave única para identificar la entrada en la caché."""
 
-    response: Union[Dict[str, Any], str]
+    response: Union[Dict[str, Any], str, None]
     """Respuesta de la API externa almacenada en la caché.
 
     Sirve para obtener al completo la respuesta de la API sin necesidad de volver a
-    realizar la llamada. Puede ser un diccionario o una cadena de texto.
+    realizar la llamada. Puede ser un diccionario o una cadena de texto. Es None si la
+    respuesta se ha guardado comprimida en `response_compressed`.
     """
 
     created_at: datetime
@@ -60,4 +61,28 @@ class CacheEntry:
     """
 
     ttl_days: int = 7
-    """Tiempo de vida de la entrada en la caché en días."""
+    """Tiempo de vida de la entrada en la caché en días.
+
+    Depende del tipo de proveedor (ver CacheManager.get_ttl_days).
+    """
+
+    response_compressed: Optional[bytes] = None
+    """Respuesta en JSON comprimida con zlib, para las respuestas grandes.
+
+    Ver CacheManager.encode_response y CacheManager.decode_response.
+    """
+
+    response_encoding: Optional[str] = None
+    """Codificación de `response_compressed` ("json+zlib"), o None si la respuesta no está comprimida."""
+
+    raw_bytes: Optional[int] = None
+    """Tamaño en bytes de la respuesta serializada en JSON, sin comprimir."""
+
+    stored_bytes: Optional[int] = None
+    """Tamaño en bytes de la respuesta tal como se guarda (comprimida o no)."""
+
+    expires_at: Optional[datetime] = None
+    """Fecha y hora (UTC) en que caduca la entrada: `created_at` más `ttl_days`.
+
+    El índice TTL de la colección borra la entrada al alcanzarla.
+    """
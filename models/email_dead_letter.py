@@ -0,0 +1,44 @@
+from dataclasses import dataclass
+from typing import Optional
+from datetime import datetime
+from bson import ObjectId
+
+
+@dataclass
+class EmailDeadLetter:
+    """
+    Modelo para representar un correo semanal que no se ha podido enviar tras agotar
+    los reintentos o por un error que no se puede reintentar (por ejemplo, una dirección no válida).
+
+    Conserva el correo generado para poder revisarlo o reenviarlo manualmente.
+    """
+
+    _id: ObjectId
+    """ID único de la entrada."""
+
+    run_week: str
+    """Semana del envío en formato ISO, por ejemplo 2025-W17."""
+
+    user_id: ObjectId
+    """ID del usuario al que no se ha podido enviar el correo."""
+
+    email: str
+    """Correo electrónico del destinatario."""
+
+    subject: str
+    """Asunto del correo."""
+
+    html: str
+    """Cuerpo del correo ya renderizado para el usuario."""
+
+    attempts: int
+    """Intentos de envío realizados."""
+
+    first_failed_at: datetime
+    """Fecha y hora del primer fallo."""
+
+    created_at: datetime
+    """Fecha y hora en que el correo se dio por perdido."""
+
+    last_error: Optional[str] = None
+    """Error del último intento."""
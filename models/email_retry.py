@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from typing import Optional
+from datetime import datetime
+from bson import ObjectId
+
+
+@dataclass
+class EmailRetry:
+    """
+    Modelo para representar un correo semanal pendiente de reintento.
+
+    Guarda el correo ya generado, de forma que el reintento no vuelve a llamar a la IA,
+    y la fecha del siguiente intento, calculada con backoff exponencial.
+    """
+
+    _id: ObjectId
+    """ID único del reintento."""
+
+    run_week: str
+    """Semana del envío en formato ISO, por ejemplo 2025-W17.
+
+    Junto con `user_id` identifica de forma única el reintento.
+    """
+
+    user_id: ObjectId
+    """ID del usuario al que se envía el correo."""
+
+    email: str
+    """Correo electrónico del destinatario."""
+
+    subject: str
+    """Asunto del correo."""
+
+    html: str
+    """Cuerpo del correo ya renderizado para el usuario."""
+
+    attempts: int
+    """Intentos de envío fallidos hasta el momento, incluido el envío original."""
+
+    next_attempt_at: datetime
+    """Fecha a partir de la cual se puede volver a intentar el envío.
+
+    Respeta la cabecera Retry-After del proveedor si la ha indicado.
+    """
+
+    created_at: datetime
+    """Fecha y hora del primer fallo."""
+
+    updated_at: datetime
+    """Fecha y hora del último intento."""
+
+    last_error: Optional[str] = None
+    """Error del último intento."""
+
+    locked_until: Optional[datetime] = None
+    """Fecha hasta la que un proceso tiene reservado el reintento para enviarlo."""
+
+    lock_token: Optional[ObjectId] = None
+    """Token de la última reserva, para recuperar los reintentos reservados por el proceso."""
@@ -0,0 +1,73 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Literal, Optional
+from datetime import datetime
+from bson import ObjectId
+
+
+@dataclass
+class MaintenanceRun:
+    """
+    Modelo para representar una ejecución encolada de una tarea de mantenimiento,
+    como el envío de los correos semanales.
+
+    El endpoint de mantenimiento crea la ejecución y responde al momento con su ID;
+    el trabajo lo hace después un hilo en segundo plano o `python maintenance.py worker`.
+    """
+
+    _id: ObjectId
+    """ID único de la ejecución. Es el que devuelve el endpoint para consultar el progreso."""
+
+    kind: Literal["send_weekly_emails"]
+    """Tarea que realiza la ejecución."""
+
+    status: Literal["queued", "running", "completed", "failed"]
+    """Estado de la ejecución.
+
+    queued: Creada, o con un tramo terminado, y a la espera de que un proceso la recoja.
+
+    running: Un proceso la está ejecutando. Si deja de actualizar `updated_at`, otro puede retomarla.
+
+    completed: Terminada. Los contadores de `progress` son los definitivos.
+
+    failed: Interrumpida por un error, que se guarda en `error`.
+    """
+
+    created_at: datetime
+    """Fecha y hora en que se encoló la ejecución."""
+
+    updated_at: datetime
+    """Fecha y hora del último cambio de estado o de progreso."""
+
+    progress: Dict[str, Any] = field(default_factory=dict)
+    """Contadores de progreso: usuarios procesados (total), enviados (sent),
+    errores (errors), saltados por estar ya enviados (skipped) y el último usuario procesado (last_user_id)."""
+
+    started_at: Optional[datetime] = None
+    """Fecha y hora en que un proceso empezó a ejecutarla."""
+
+    finished_at: Optional[datetime] = None
+    """Fecha y hora en que terminó, con éxito o con error."""
+
+    runner_id: Optional[str] = None
+    """Identificador del proceso que la ejecuta."""
+
+    slice_end: Optional[datetime] = None
+    """Final de la franja del planificador que procesa. Se fija en el primer tramo."""
+
+    invocations: int = 0
+    """Número de veces que un proceso ha recogido la ejecución (tramos ejecutados)."""
+
+    continuation: Optional[str] = None
+    """Token de continuación del último tramo de una ejecución por tramos.
+
+    Solo la invocación que presenta este token puede retomarla. Es None cuando ha terminado.
+    """
+
+    error: Optional[str] = None
+    """Error que interrumpió la ejecución, si lo hay."""
+
+    reports: List[Dict[str, Any]] = field(default_factory=list)
+    """Informes de la ejecución, uno por tramo: duración, usuarios, latencias e histograma por etapa
+    (stages), aciertos de la caché (cache), llamadas y tasa de error por proveedor (providers),
+    esperas de los limitadores de peticiones (rate_limits) y límite adaptativo de peticiones en
+    vuelo de cada proveedor (concurrency)."""
@@ -0,0 +1,53 @@
+from dataclasses import dataclass
+from typing import Literal, Optional
+from datetime import datetime
+from bson import ObjectId
+
+
+@dataclass
+class SendLedgerEntry:
+    """
+    Modelo para representar el estado del correo semanal de un usuario en una semana.
+
+    Permite reanudar una ejecución interrumpida sin repetir el trabajo ya hecho
+    y garantiza que nadie recibe dos veces el mismo correo semanal.
+    """
+
+    _id: ObjectId
+    """ID único de la entrada."""
+
+    run_week: str
+    """Semana del envío en formato ISO, por ejemplo 2025-W17.
+
+    Junto con `user_id` identifica de forma única la entrada.
+    """
+
+    user_id: ObjectId
+    """ID del usuario al que pertenece la entrada."""
+
+    email: str
+    """Correo electrónico del usuario en el momento del envío."""
+
+    state: Literal["queued", "generated", "sent", "failed"]
+    """Estado del correo semanal del usuario.
+
+    queued: El usuario está pendiente y aún no tiene contenido generado.
+
+    generated: El contenido de su cohorte ya está generado y guardado en `send_runs`.
+
+    sent: El correo ha sido aceptado por el proveedor. No se volverá a enviar esa semana.
+
+    failed: El envío ha fallado. Se reintentará en la siguiente ejecución.
+    """
+
+    created_at: datetime
+    """Fecha y hora en que el usuario entró en la ejecución de la semana."""
+
+    updated_at: datetime
+    """Fecha y hora del último cambio de estado."""
+
+    cohort_id: Optional[str] = None
+    """Identificador de la cohorte cuyo contenido recibe el usuario."""
+
+    error: Optional[str] = None
+    """Último error de envío, si lo hay."""
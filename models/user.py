@@ -27,6 +27,12 @@ class User:
     Es único y se utiliza para la autenticación y recuperación de contraseña.
     """
 
+    email_lower: str
+    """Correo electrónico normalizado (sin espacios y en minúsculas, ver normalize_email).
+
+    Está indexado y es el campo por el que se busca a los usuarios por email.
+    """
+
     created_at: datetime
     """Fecha de creación del usuario en la base de datos.
     
@@ -113,3 +119,22 @@ class User:
 
     Permite enviar cada semana un correo electrónico al usuario con información relevante.
     """
+
+    next_send_at: Optional[datetime] = None
+    """Fecha del próximo correo semanal del usuario.
+
+    Se calcula al crear el usuario y después de cada envío. La hora del día es fija para
+    cada usuario, de forma que los envíos se reparten a lo largo de todo el día.
+    """
+
+    send_priority: int = 0
+    """Prioridad del correo semanal del usuario según su rol (ver SEND_PRIORITY_BY_ROLE).
+
+    Se actualiza cuando cambia el rol. Dentro de cada franja se envía antes a los de mayor prioridad.
+    """
+
+    send_failures: int = 0
+    """Envíos del correo semanal fallidos desde el último correcto.
+
+    A igual prioridad, se envía antes a los usuarios con más fallos.
+    """
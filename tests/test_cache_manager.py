@@ -0,0 +1,131 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from api import cache_manager
+from api.cache_manager import CACHE_COMPRESSION_MIN_BYTES, CacheManager, MemoryCache, cache_collection
+from api.metrics import StageMetrics
+
+
+class TestMemoryCache(unittest.TestCase):
+    """Pruebas para la caché en memoria que hay delante de MongoDB."""
+
+    def test_evicts_least_recently_used_entry(self):
+        """Dada una caché llena, la entrada usada hace más tiempo debe descartarse al guardar otra."""
+        cache = MemoryCache(max_entries=2, ttl_seconds=60)
+        cache.set("a", {"value": 1}, "2025-04-21")
+        cache.set("b", {"value": 2}, "2025-04-21")
+        cache.get("a", "2025-04-21")
+        cache.set("c", {"value": 3}, "2025-04-21")
+
+        self.assertEqual(cache.get("a", "2025-04-21"), {"value": 1})
+        self.assertIsNone(cache.get("b", "2025-04-21"))
+        self.assertEqual(len(cache), 2)
+
+    def test_expired_or_previous_day_entries_are_misses(self):
+        """Dada una entrada caducada o de otro día, la caché no debe devolverla."""
+        cache = MemoryCache(max_entries=10, ttl_seconds=60)
+        with patch("api.cache_manager.time.monotonic", return_value=1000):
+            cache.set("a", {"value": 1}, "2025-04-21", ttl_seconds=10)
+            cache.set("b", {"value": 2}, "2025-04-21")
+        with patch("api.cache_manager.time.monotonic", return_value=1020):
+            self.assertIsNone(cache.get("a", "2025-04-21"))
+            self.assertIsNone(cache.get("b", "2025-04-22"))
+
+    def test_returns_copies(self):
+        """Dada una respuesta leída de la caché, modificarla no debe cambiar la guardada."""
+        cache = MemoryCache(max_entries=10, ttl_seconds=60)
+        cache.set("a", {"items": [1]}, "2025-04-21")
+        cache.get("a", "2025-04-21")["items"].append(2)
+
+        self.assertEqual(cache.get("a", "2025-04-21"), {"items": [1]})
+
+
+class TestCacheCompression(unittest.TestCase):
+    """Pruebas para la compresión de las respuestas grandes de la caché."""
+
+    def test_large_responses_are_compressed_and_restored(self):
+        """Dada una respuesta mayor que el umbral, debe guardarse comprimida y recuperarse igual."""
+        response = {"results": [{"raw_content": "Noticias de la semana. " * 50, "score": 0.9}] * 20}
+
+        fields = CacheManager.encode_response(response)
+
+        self.assertIsNone(fields["response"])
+        self.assertGreaterEqual(fields["raw_bytes"], CACHE_COMPRESSION_MIN_BYTES)
+        self.assertLess(fields["stored_bytes"], fields["raw_bytes"])
+        self.assertEqual(CacheManager.decode_response(fields), response)
+
+    def test_small_responses_are_stored_as_is(self):
+        """Dada una respuesta menor que el umbral, debe guardarse sin comprimir."""
+        fields = CacheManager.encode_response("resumen")
+
+        self.assertEqual(fields["response"], "resumen")
+        self.assertNotIn("response_compressed", fields)
+        self.assertEqual(fields["raw_bytes"], fields["stored_bytes"])
+        self.assertEqual(CacheManager.decode_response(fields), "resumen")
+
+
+class TestCacheCoalescing(unittest.TestCase):
+    """Pruebas para el recuento de los fallos de caché resueltos con el cálculo de otro hilo o proceso."""
+
+    def test_each_shared_lookup_is_counted_once(self):
+        """Dados varios hilos que encuentran la respuesta guardada por otro proceso, cada uno debe contarse una vez."""
+        stage_metrics = StageMetrics()
+        calls = []
+        results = []
+
+        def peek_cache(cache_key):
+            time.sleep(0.1)
+            return "resumen"
+
+        with patch.object(cache_manager, "metrics", stage_metrics), \
+                patch.object(CacheManager, "peek_cache", side_effect=peek_cache):
+            threads = [
+                threading.Thread(target=lambda: results.append(CacheManager.single_flight("key", lambda: calls.append(1))))
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(calls, [])
+        self.assertEqual(results, ["resumen"] * 3)
+        self.assertEqual(stage_metrics.report()["cache"]["coalesced"], 3)
+
+
+class TestClearExpiredCache(unittest.TestCase):
+    """Pruebas para la limpieza de las entradas caducadas de la caché en MongoDB."""
+
+    provider_type = "test_clear_expired_cache"
+
+    def setUp(self):
+        self.addCleanup(cache_collection.delete_many, {"provider_type": self.provider_type})
+
+    def insert_entry(self, cache_key, created_days_ago, expires_in_days=None):
+        entry = {
+            "cache_key": cache_key,
+            "provider_type": self.provider_type,
+            "created_at": datetime.now() - timedelta(days=created_days_ago),
+        }
+        if expires_in_days is not None:
+            entry["expires_at"] = datetime.now(timezone.utc) + timedelta(days=expires_in_days)
+        cache_collection.insert_one(entry)
+
+    def test_deletes_entries_past_their_expiry(self):
+        """Dadas entradas con y sin `expires_at`, debe borrar las caducadas y las antiguas sin el campo."""
+        self.insert_entry("expired", created_days_ago=2, expires_in_days=-1)
+        self.insert_entry("long_ttl", created_days_ago=10, expires_in_days=20)
+        self.insert_entry("legacy_old", created_days_ago=10)
+        self.insert_entry("legacy_recent", created_days_ago=1)
+
+        deleted = CacheManager.clear_expired_cache(days_to_keep=7)
+
+        remaining = sorted(entry["cache_key"] for entry in cache_collection.find({"provider_type": self.provider_type}))
+        self.assertEqual(deleted, 2)
+        self.assertEqual(remaining, ["legacy_recent", "long_ttl"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+import api.services as services
+import maintenance
+from api.service.digest_service import DigestCohort
+
+
+class FailingProvider:
+    """Proveedor cuyo modelo falla: generate_content devuelve el texto de error."""
+
+    def generate_digest(self, *args):
+        return "Error: 503 Service Unavailable"
+
+    async def generate_digest_async(self, *args):
+        return "Error: 503 Service Unavailable"
+
+
+class WorkingProvider:
+    def generate_digest(self, *args):
+        return "<p>Noticias</p>"
+
+    async def generate_digest_async(self, *args):
+        return "<p>Noticias</p>"
+
+
+class TestDigestBody(unittest.TestCase):
+    """Pruebas para la generación del cuerpo del boletín de una cohorte."""
+
+    def test_error_result_falls_back_to_next_provider(self):
+        """Dado un proveedor que devuelve "Error: ...", se debe usar el siguiente proveedor."""
+        providers = {"groq": FailingProvider(), "openai": WorkingProvider()}
+        with patch.object(services, "ai_providers", providers):
+            self.assertEqual(services.generate_digest_body(provider="groq"), "<p>Noticias</p>")
+            self.assertEqual(asyncio.run(services.generate_digest_body_async(provider="groq")), "<p>Noticias</p>")
+
+    def test_error_result_is_not_a_digest(self):
+        """Dado que todos los proveedores fallan y no hay caché, no se debe devolver ningún cuerpo."""
+        with patch.object(services, "ai_providers", {"groq": FailingProvider()}), \
+                patch.object(services.CacheManager, "get_provider_cache_by_date", return_value=[]):
+            self.assertIsNone(services.generate_digest_body(provider="groq"))
+
+        self.assertFalse(services.is_valid_digest_body("Error: timeout"))
+        self.assertFalse(services.is_valid_digest_body(""))
+        self.assertTrue(services.is_valid_digest_body("<p>Noticias</p>"))
+
+
+class TestRunDigest(unittest.TestCase):
+    """Pruebas para la carga y el guardado del boletín de una cohorte durante el envío."""
+
+    def build_cohort(self):
+        return DigestCohort(language="es", ai_provider="groq", search_provider="tavily", system_prompt="")
+
+    def test_failed_generation_is_not_saved(self):
+        """Dada una generación que devuelve "Error: ...", no se debe guardar ni usar como boletín."""
+        def fail(cohort):
+            cohort.body = "Error: 503 Service Unavailable"
+
+        async def fail_async(cohort):
+            fail(cohort)
+
+        cohort = self.build_cohort()
+        with patch.object(maintenance, "get_run_digest", return_value=None), \
+                patch.object(maintenance, "generate_cohort_digest", side_effect=fail), \
+                patch.object(maintenance, "generate_cohort_digest_async", side_effect=fail_async), \
+                patch.object(maintenance, "save_run_digest") as save_run_digest:
+            self.assertEqual(maintenance.load_or_generate_digest("2025-W17", cohort), "failed")
+            self.assertIsNone(cohort.body)
+            self.assertEqual(asyncio.run(maintenance.load_or_generate_digest_async("2025-W17", cohort)), "failed")
+            self.assertIsNone(cohort.body)
+
+        save_run_digest.assert_not_called()
+
+    def test_invalid_stored_digest_is_regenerated(self):
+        """Dado un boletín guardado con un error, se debe generar de nuevo en lugar de reutilizarlo."""
+        def generate(cohort):
+            cohort.body = "<p>Noticias</p>"
+
+        cohort = self.build_cohort()
+        with patch.object(maintenance, "get_run_digest", return_value={"body": "Error: timeout"}), \
+                patch.object(maintenance, "generate_cohort_digest", side_effect=generate), \
+                patch.object(maintenance, "save_run_digest") as save_run_digest:
+            self.assertEqual(maintenance.load_or_generate_digest("2025-W17", cohort), "generated")
+
+        save_run_digest.assert_called_once_with("2025-W17", cohort.cohort_id, "<p>Noticias</p>")
+
+
+if __name__ == '__main__':
+    unittest.main()
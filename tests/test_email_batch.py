@@ -0,0 +1,36 @@
+import unittest
+from api.services import LocalEmailTransport, RESEND_BATCH_LIMIT, send_batch_emails
+
+
+class TestEmailBatch(unittest.TestCase):
+    """Pruebas para el envío de correos por lotes con el transporte local."""
+
+    def build_messages(self, count):
+        return [(f"user{i}@example.com", "Asunto", f"<p>{i}</p>") for i in range(count)]
+
+    def test_messages_are_grouped_in_batches(self):
+        """Dados más correos que el límite del proveedor, se deben enviar en el mínimo número de lotes."""
+        transport = LocalEmailTransport()
+        messages = self.build_messages(RESEND_BATCH_LIMIT * 2 + 1)
+
+        results = send_batch_emails(messages, transport=transport)
+
+        self.assertEqual(transport.batches, 3)
+        self.assertEqual(len(transport.outbox), len(messages))
+        self.assertTrue(all(result["success"] for result in results))
+        self.assertEqual([result["to"] for result in results], [to for to, _, _ in messages])
+
+    def test_rejected_batch_reports_each_recipient(self):
+        """Dado un lote rechazado, se debe marcar como fallido solo a los destinatarios de ese lote."""
+        transport = LocalEmailTransport(rejected_emails=["user0@example.com"])
+        messages = self.build_messages(RESEND_BATCH_LIMIT + 1)
+
+        results = send_batch_emails(messages, transport=transport)
+
+        self.assertEqual(sum(not result["success"] for result in results), RESEND_BATCH_LIMIT)
+        self.assertTrue(results[-1]["success"])
+        self.assertIn("error", results[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from api.service.maintenance_run_service import (
+    MAINTENANCE_RUN_STALE_SECONDS,
+    claim_run,
+    enqueue_run,
+    maintenance_runs_collection,
+    pause_run,
+)
+
+
+class TestMaintenanceRuns(unittest.TestCase):
+    """Pruebas para la recogida de las ejecuciones encoladas de mantenimiento."""
+
+    kind = "test_maintenance_runs"
+
+    def setUp(self):
+        self.run, _ = enqueue_run(self.kind)
+        self.addCleanup(maintenance_runs_collection.delete_many, {"kind": self.kind})
+        claim_run(self.kind, "endpoint", self.run["_id"])
+        pause_run(self.run["_id"], {"total": 1}, "token-1")
+
+    def test_paused_run_requires_its_continuation(self):
+        """Dada una ejecución por tramos en pausa, solo se debe recoger con su token de continuación."""
+        self.assertIsNone(claim_run(self.kind, "worker"))
+        self.assertIsNone(claim_run(self.kind, "endpoint", self.run["_id"], "token-0"))
+
+        run = claim_run(self.kind, "endpoint", self.run["_id"], "token-1")
+
+        self.assertEqual(run["runner_id"], "endpoint")
+
+    def test_abandoned_paused_run_can_be_resumed_without_token(self):
+        """Dada una ejecución en pausa que nadie ha retomado a tiempo, el worker debe poder recogerla."""
+        stale = datetime.now(timezone.utc) - timedelta(seconds=MAINTENANCE_RUN_STALE_SECONDS + 1)
+        maintenance_runs_collection.update_one({"_id": self.run["_id"]}, {"$set": {"updated_at": stale}})
+
+        run = claim_run(self.kind, "worker")
+
+        self.assertEqual(run["_id"], self.run["_id"])
+
+
+if __name__ == '__main__':
+    unittest.main()
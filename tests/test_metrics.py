@@ -0,0 +1,46 @@
+import unittest
+from api.metrics import StageMetrics
+
+
+class TestStageMetrics(unittest.TestCase):
+    """Pruebas para las métricas por etapa del envío semanal."""
+
+    def test_summary_includes_percentiles_and_histogram(self):
+        """Dadas varias duraciones de una etapa, el resumen debe incluir sus percentiles y su histograma."""
+        metrics = StageMetrics()
+        for seconds in (0.001, 0.02, 0.02, 3, 120):
+            metrics.record("search", seconds)
+
+        summary = metrics.summary()["search"]
+
+        self.assertEqual(summary["count"], 5)
+        self.assertEqual(summary["p50"], 0.02)
+        self.assertEqual(summary["max"], 120)
+        self.assertEqual(
+            summary["histogram"],
+            [{"le": 0.005, "count": 1}, {"le": 0.025, "count": 2}, {"le": 5, "count": 1}, {"le": None, "count": 1}],
+        )
+
+    def test_report_counts_cache_hits_and_provider_errors(self):
+        """Dadas llamadas fallidas a un proveedor, el informe debe incluir su tasa de error y los aciertos de caché."""
+        metrics = StageMetrics()
+        metrics.increment("cache_hits", 3)
+        metrics.increment("cache_misses")
+        metrics.record_call("groq")
+        with self.assertRaises(RuntimeError):
+            with metrics.provider_call("groq"):
+                raise RuntimeError("429")
+
+        report = metrics.report()
+
+        self.assertEqual(report["cache"]["hits"], 3)
+        self.assertEqual(report["cache"]["misses"], 1)
+        self.assertEqual(report["cache"]["hit_rate"], 0.75)
+        self.assertEqual(report["providers"]["groq"], {"calls": 2, "errors": 1, "error_rate": 0.5})
+
+        metrics.reset()
+        self.assertEqual(metrics.report()["providers"], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
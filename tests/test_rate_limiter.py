@@ -0,0 +1,74 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+import requests
+from api.rate_limiter import AdaptiveConcurrencyLimit, RateLimiter
+from api.serviceAi import talivy_provider
+
+
+def http_error(status: int) -> Exception:
+    """Construye un error con el código HTTP indicado, como los de requests o httpx."""
+    error = Exception(f"HTTP {status}")
+    error.response = SimpleNamespace(status_code=status, headers={})
+    return error
+
+
+class TestAdaptiveConcurrencyLimit(unittest.TestCase):
+    """Pruebas para el límite adaptativo de peticiones en vuelo."""
+
+    def test_limit_grows_while_calls_succeed(self):
+        """Dadas varias rondas de llamadas correctas, el límite debe subir uno por ronda hasta el máximo."""
+        limit = AdaptiveConcurrencyLimit("groq", initial=2, maximum=4)
+        for _ in range(20):
+            with limit.slot():
+                pass
+
+        stats = limit.get_stats()
+        self.assertEqual(stats["limit"], 4)
+        self.assertEqual(stats["increases"], 2)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_overload_halves_the_limit_once_per_round(self):
+        """Dados varios 429 de llamadas que estaban en vuelo a la vez, el límite debe reducirse una sola vez."""
+        limit = AdaptiveConcurrencyLimit("tavily", initial=8, maximum=16)
+        started = [limit.acquire() for _ in range(3)]
+        for call_started in started:
+            limit.release(call_started, http_error(429))
+
+        self.assertEqual(limit.get_stats()["limit"], 4)
+        self.assertEqual(limit.get_stats()["decreases"], 1)
+
+        # Una llamada posterior a la reducción sí puede volver a reducirlo
+        with self.assertRaises(TimeoutError):
+            with limit.slot():
+                raise TimeoutError()
+        self.assertEqual(limit.get_stats()["limit"], 2)
+
+    def test_client_errors_do_not_change_the_limit(self):
+        """Dado un error 400, el límite no debe cambiar ni dejar el hueco ocupado."""
+        limit = AdaptiveConcurrencyLimit("resend", initial=2, maximum=8)
+        with self.assertRaises(Exception):
+            with limit.slot():
+                raise http_error(400)
+
+        self.assertEqual(limit.get_stats()["limit"], 2)
+        self.assertEqual(limit.get_stats()["in_flight"], 0)
+        self.assertIsNotNone(limit.try_acquire())
+
+    def test_search_timeout_reduces_the_limit(self):
+        """Dada una búsqueda síncrona que no responde a tiempo, debe fallar y contar como sobrecarga."""
+        limit = AdaptiveConcurrencyLimit("tavily", initial=8, maximum=16)
+        provider = talivy_provider.TavilyProvider("key")
+        with patch.object(RateLimiter, "acquire"), \
+                patch.dict(RateLimiter._concurrency, {"tavily": limit}), \
+                patch.object(talivy_provider.requests, "post", side_effect=requests.exceptions.ReadTimeout()) as post:
+            result = provider.search("noticias")
+
+        self.assertFalse(result["success"])
+        self.assertEqual(post.call_args.kwargs["timeout"], talivy_provider.SEARCH_TIMEOUT_SECONDS)
+        self.assertEqual(limit.get_stats()["limit"], 4)
+        self.assertEqual(limit.get_stats()["in_flight"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import random
+import unittest
+from types import SimpleNamespace
+from api.rate_limiter import get_retry_after, is_retryable_error
+from api.service.retry_queue_service import EMAIL_RETRY_MAX_SECONDS, compute_retry_delay
+
+
+class TestRetryQueue(unittest.TestCase):
+    """Pruebas para el cálculo de esperas de la cola de reintentos."""
+
+    def test_retry_delay_grows_with_jitter_up_to_the_maximum(self):
+        """Dados varios intentos fallidos, la espera debe duplicarse con jitter sin superar el máximo."""
+        rng = random.Random(1)
+        first = compute_retry_delay(1, rng=rng)
+        second = compute_retry_delay(2, rng=rng)
+        last = compute_retry_delay(50, rng=rng)
+
+        self.assertTrue(30 <= first <= 60)
+        self.assertTrue(60 <= second <= 120)
+        self.assertTrue(EMAIL_RETRY_MAX_SECONDS / 2 <= last <= EMAIL_RETRY_MAX_SECONDS)
+
+    def test_retry_after_is_the_minimum_delay(self):
+        """Dado un error 429 con Retry-After, la espera debe respetar la cabecera."""
+        error = Exception("Too Many Requests")
+        error.response = SimpleNamespace(status_code=429, headers={"retry-after": "600"})
+
+        self.assertTrue(is_retryable_error(error))
+        self.assertEqual(get_retry_after(error), 600)
+        self.assertGreaterEqual(compute_retry_delay(1, get_retry_after(error)), 600)
+
+    def test_client_errors_are_not_retryable(self):
+        """Dado un error 422 (datos no válidos), no debe reintentarse."""
+        error = Exception("Invalid `to` field")
+        error.code = 422
+
+        self.assertFalse(is_retryable_error(error))
+        self.assertIsNone(get_retry_after(error))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
+import os
 import unittest
+from unittest.mock import patch
 from conftest import TestBase
 
 class TestRoutes(TestBase):
@@ -65,5 +67,57 @@ class TestRoutes(TestBase):
         response = self.client.get('/change-language/es', follow_redirects=True)
         self.assertEqual(response.status_code, 200)
 
+    def test_send_weekly_emails_without_api_key(self):
+        """Dada la ruta '/api/maintenance/send-weekly-emails' sin clave de API, se debe recibir 401
+        tanto al encolar un envío como al consultar su estado."""
+        response = self.client.post('/api/maintenance/send-weekly-emails')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.get('/api/maintenance/send-weekly-emails/000000000000000000000000')
+        self.assertEqual(response.status_code, 401)
+
+    @patch.dict('os.environ', {'MAINTENANCE_API_KEY': 'test-key'})
+    def test_send_weekly_emails_invalid_continuation(self):
+        """Dado un token de continuación que no es válido, se debe recibir 400 sin tocar ninguna ejecución."""
+        response = self.client.post(
+            '/api/maintenance/send-weekly-emails',
+            headers={'X-API-Key': 'test-key'},
+            json={'continuation': 'no-es-un-token'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @patch.dict('os.environ', {'MAINTENANCE_API_KEY': 'test-key'})
+    def test_send_weekly_emails_enqueues_run(self):
+        """Dada una clave de API válida, se debe encolar una ejecución y poder consultar su estado."""
+        from bson import ObjectId
+        from api.service.maintenance_run_service import maintenance_runs_collection
+
+        response = self.client.post(
+            '/api/maintenance/send-weekly-emails',
+            headers={'X-API-Key': 'test-key'},
+            json={'mode': 'worker'},
+        )
+        self.assertEqual(response.status_code, 202)
+        data = response.get_json()
+        self.assertTrue(data['success'])
+        self.addCleanup(maintenance_runs_collection.delete_one, {"_id": ObjectId(data['run_id']), "status": "queued"})
+
+        response = self.client.get(data['status_url'], headers={'X-API-Key': 'test-key'})
+        self.assertEqual(response.status_code, 200)
+
+    @patch.dict('os.environ', {'MAINTENANCE_API_KEY': 'test-key'})
+    def test_send_weekly_emails_does_not_start_a_thread_by_default(self):
+        """Sin modo indicado, la ejecución solo se debe encolar para el worker, sin hilos en la petición."""
+        from bson import ObjectId
+        from api.service.maintenance_run_service import maintenance_runs_collection
+
+        os.environ.pop('MAINTENANCE_SEND_MODE', None)
+        os.environ.pop('VERCEL', None)
+        with patch('api.routes.threading.Thread') as thread:
+            response = self.client.post('/api/maintenance/send-weekly-emails', headers={'X-API-Key': 'test-key'})
+        self.assertEqual(response.status_code, 202)
+        self.addCleanup(maintenance_runs_collection.delete_one, {"_id": ObjectId(response.get_json()['run_id']), "status": "queued"})
+        thread.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from bson import ObjectId
+import maintenance
+from api.service.retry_queue_service import email_retries_collection
+from api.service.schedule_service import get_due_query
+
+
+class TestSendRetries(unittest.TestCase):
+    """Pruebas para el envío semanal de los usuarios con un correo en la cola de reintentos."""
+
+    def setUp(self):
+        self.user_id = ObjectId()
+        self.email = f"retry-{self.user_id}@example.com"
+        maintenance.users_collection.insert_one({
+            "_id": self.user_id,
+            "email": self.email,
+            "email_lower": self.email,
+            "language": "es",
+            "account_status": "active",
+            "next_send_at": datetime.now(timezone.utc) - timedelta(minutes=1),
+        })
+        self.addCleanup(maintenance.users_collection.delete_one, {"_id": self.user_id})
+        self.addCleanup(email_retries_collection.delete_many, {"user_id": self.user_id})
+        self.sent = []
+        self.reject = True
+
+    def send_batch_emails(self, messages, **kwargs):
+        self.sent.extend(to for to, _, _ in messages)
+        if self.reject:
+            return [{"to": to, "success": False, "error": "429 Too Many Requests", "retryable": True} for to, _, _ in messages]
+        return [{"to": to, "success": True} for to, _, _ in messages]
+
+    def run_send(self):
+        def generate(run_week, cohort, *args):
+            cohort.body = "<p>Noticias</p>"
+            return "generated"
+
+        with patch.object(maintenance, "send_batch_emails", side_effect=self.send_batch_emails), \
+                patch.object(maintenance, "load_or_generate_digest", side_effect=generate), \
+                patch.object(maintenance, "get_due_query", lambda slice_end: {**get_due_query(slice_end), "_id": self.user_id}):
+            return maintenance.process_pending_emails()
+
+    def test_failed_user_is_sent_once_in_the_next_run(self):
+        """Dado un usuario cuyo envío falló, la siguiente ejecución debe enviarle un solo correo."""
+        self.run_send()
+        self.assertEqual(self.sent, [self.email])
+        self.assertEqual(email_retries_collection.count_documents({"user_id": self.user_id}), 1)
+
+        # Una hora después: su reserva ha caducado y el reintento ya toca
+        past = datetime.now(timezone.utc) - timedelta(minutes=1)
+        maintenance.users_collection.update_one({"_id": self.user_id}, {"$set": {"send_lease.expires_at": past}})
+        email_retries_collection.update_one({"user_id": self.user_id}, {"$set": {"next_attempt_at": past}})
+        self.sent = []
+        self.reject = False
+
+        total, success, errors = self.run_send()
+
+        self.assertEqual(self.sent, [self.email])
+        self.assertEqual((total, success, errors), (1, 1, 0))
+        self.assertEqual(email_retries_collection.count_documents({"user_id": self.user_id}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
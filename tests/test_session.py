@@ -76,6 +76,7 @@ class TestRegister(TestBase):
         users_collection.insert_one({
             "_id": ObjectId(),
             "email": test_email,
+            "email_lower": test_email,
             "username": test_email.split("@")[0],  # Username generado automáticamente del email
             "created_at": "2025-04-15T00:00:00",
             "role": "free",
@@ -131,6 +132,7 @@ class TestRegister(TestBase):
         users_collection.insert_one({
             "_id": ObjectId(),
             "email": test_email,
+            "email_lower": test_email,
             "username": "existinguser",
             "created_at": "2025-04-15T00:00:00",
             "role": "free",
@@ -425,6 +427,7 @@ class TestLogin(TestBase):
         users_collection.insert_one({
             "_id": self.test_user_id,
             "email": self.test_email,
+            "email_lower": self.test_email,
             "username": self.test_username,
             "created_at": datetime.now().isoformat(),
             "role": "free",
@@ -540,6 +543,7 @@ class TestLogin(TestBase):
         users_collection.insert_one({
             "_id": ObjectId(),
             "email": subscriber_email,
+            "email_lower": subscriber_email,
             "username": subscriber_email.split("@")[0],
             "created_at": datetime.now().isoformat(),
             "role": "free",
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+import unittest
+from api.single_flight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Pruebas para la agrupación de cálculos concurrentes con la misma clave."""
+
+    def test_concurrent_threads_share_one_computation(self):
+        """Dados varios hilos que piden la misma clave a la vez, solo uno debe calcularla."""
+        flights = SingleFlight()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return {"content": "resumen"}
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do("key", compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([value for value, _ in results], [{"content": "resumen"}] * 5)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True, True])
+
+    def test_concurrent_coroutines_share_result_and_errors(self):
+        """Dadas varias corrutinas con la misma clave, deben compartir el resultado o la excepción del primero."""
+        flights = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "resumen"
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("429")
+
+        async def run():
+            values = await asyncio.gather(*[flights.do_async("key", compute) for _ in range(5)])
+            errors = await asyncio.gather(*[flights.do_async("other", fail) for _ in range(3)], return_exceptions=True)
+            return values, errors
+
+        values, errors = asyncio.run(run())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({value for value, _ in values}, {"resumen"})
+        self.assertTrue(all(isinstance(error, RuntimeError) for error in errors))
+
+    def test_next_call_computes_again(self):
+        """Dado un cálculo ya terminado, la siguiente llamada con la misma clave debe volver a calcular."""
+        flights = SingleFlight()
+
+        self.assertEqual(flights.do("key", lambda: 1), (1, False))
+        self.assertEqual(flights.do("key", lambda: 2), (2, False))
+
+
+if __name__ == '__main__':
+    unittest.main()